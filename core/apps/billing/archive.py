@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.apps.billing.models import (
+    SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem,
+    ArchivedSalesTransaction, ArchivedSalesTransactionItem, ArchivedProductReturn, ArchivedProductReturnItem,
+)
+from core.apps.common.cache import bump_model_version
+
+
+def return_window_start(now=None):
+    """Sales before this moment can no longer be returned"""
+    return (now or timezone.now()) - timedelta(days=settings.RETURN_WINDOW_DAYS)
+
+
+def closed_period_end(now=None):
+    """Start of the month the return window starts in: every month before it is closed"""
+    start = timezone.localtime(return_window_start(now))
+    return start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _copy(queryset, archive_model):
+    """Insert the rows of queryset into archive_model, column for column"""
+    attnames = [field.attname for field in archive_model._meta.concrete_fields if field.name != 'archived_at']
+    rows = queryset.order_by().values_list(*attnames)
+    return len(archive_model.objects.bulk_create([archive_model(**dict(zip(attnames, row))) for row in rows]))
+
+
+def archive_chunk(before, chunk_size):
+    """
+    Move the oldest chunk_size sales made before `before`, with their items,
+    returns and return items, into the archive tables in one short
+    transaction. Returns the number of sales and returns moved.
+    """
+    with transaction.atomic():
+        sale_ids = list(
+            SalesTransaction.objects.filter(transaction_date__lt=before)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not sale_ids:
+            return 0, 0
+        return_ids = list(ProductReturn.objects.filter(transaction_id__in=sale_ids).values_list('id', flat=True))
+
+        _copy(SalesTransaction.objects.filter(id__in=sale_ids), ArchivedSalesTransaction)
+        _copy(SalesTransactionItem.objects.filter(transaction_id__in=sale_ids), ArchivedSalesTransactionItem)
+        _copy(ProductReturn.objects.filter(id__in=return_ids), ArchivedProductReturn)
+        _copy(ProductReturnItem.objects.filter(product_return_id__in=return_ids), ArchivedProductReturnItem)
+
+        #children first; _raw_delete is one DELETE per table, without loading rows for signals
+        for queryset in (
+            ProductReturnItem.objects.filter(product_return_id__in=return_ids),
+            ProductReturn.objects.filter(id__in=return_ids),
+            SalesTransactionItem.objects.filter(transaction_id__in=sale_ids),
+            SalesTransaction.objects.filter(id__in=sale_ids),
+        ):
+            queryset._raw_delete(queryset.db)
+    return len(sale_ids), len(return_ids)
+
+
+def archive_sales(before, chunk_size=None, pause=None):
+    """
+    Archive every sale made before `before`, chunk by chunk. The pause
+    between chunks lets checkouts take the write lock in between.
+    Yields the running (sales, returns) totals after each chunk.
+    """
+    if before > return_window_start():
+        raise ValueError("Sales still inside the return window cannot be archived")
+    chunk_size = chunk_size or settings.ARCHIVE['CHUNK_SIZE']
+    pause = settings.ARCHIVE['PAUSE_SECONDS'] if pause is None else pause
+
+    sales = returns = 0
+    try:
+        while True:
+            moved_sales, moved_returns = archive_chunk(before, chunk_size)
+            if not moved_sales:
+                return
+            sales += moved_sales
+            returns += moved_returns
+            yield sales, returns
+            time.sleep(pause)
+    finally:
+        if sales:
+            #the raw deletes sent no signals
+            bump_model_version(SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem)
@@ -0,0 +1,122 @@
+import random
+from decimal import Decimal
+
+from django.db.models import Count
+
+from core.apps.billing.models import SalesTransaction
+from core.apps.products.models import Product, PurchaseOrder, PurchaseOrderItem, Supplier
+from core.apps.users.models import Customer
+
+
+#every scenario takes the shared context and the number of iterations,
+#prepares its data and returns a callable performing one request
+
+
+class BenchmarkContext:
+    """Shared state of one benchmark run"""
+
+    def __init__(self, client, seed):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.product_ids = list(Product.objects.values_list('id', flat=True))
+        self.customer_ids = list(
+            Customer.objects.order_by('-id').values_list('id', flat=True)[:200]
+        )
+        #sales made by the checkout scenario, consumed by the return scenario
+        self.new_sales = []
+
+
+def checkout(ctx, iterations):
+    Product.objects.update(current_stock=Decimal('1000000'))
+
+    def run():
+        product_ids = ctx.rng.sample(ctx.product_ids, 3)
+        response = ctx.client.post('/sales/', {
+            'payment_method': 'Cash',
+            'amount_paid': '100000.00',
+            'items': [
+                {'product': product_id, 'quantity': '1', 'unit_price': '10.00'}
+                for product_id in product_ids
+            ],
+        }, format='json')
+        ctx.new_sales.append(response.data)
+        return response
+    return run
+
+
+def product_return(ctx, iterations):
+    sales = list(ctx.new_sales)
+
+    def run():
+        sale = sales.pop()
+        item = sale['items'][0]
+        return ctx.client.post('/returns/', {
+            'transaction': sale['id'],
+            'reason': 'benchmark',
+            'refund_method': 'Cash',
+            'items': [{'product': item['product'], 'quantity': '1', 'unit_price': item['unit_price']}],
+        }, format='json')
+    return run
+
+
+def product_scan(ctx, iterations):
+    def run():
+        return ctx.client.get(f"/products/{ctx.rng.choice(ctx.product_ids)}/")
+    return run
+
+
+def purchase_order_complete(ctx, iterations):
+    supplier = Supplier.objects.first()
+    orders = []
+    for _ in range(iterations):
+        order = PurchaseOrder.objects.create(supplier=supplier)
+        PurchaseOrderItem.objects.bulk_create([
+            PurchaseOrderItem(purchase_order=order, product_id=product_id, quantity=10, unit_price=Decimal('5.00'))
+            for product_id in ctx.rng.sample(ctx.product_ids, 5)
+        ])
+        orders.append(order)
+
+    def run():
+        order = orders.pop()
+        received = {str(item_id): 10 for item_id in order.items.values_list('id', flat=True)}
+        return ctx.client.post(
+            f"/purchase_orders/{order.id}/complete/", {'received_quantities': received}, format='json'
+        )
+    return run
+
+
+def purchase_history(ctx, iterations):
+    #always the busiest customer: the longest history is the worst case, and
+    #a random pick would make the query count depend on the seed
+    busiest = (
+        SalesTransaction.objects.filter(customer__isnull=False)
+        .values('customer').annotate(visits=Count('id')).order_by('-visits', 'customer')
+        .values_list('customer', flat=True).first()
+    ) or ctx.customer_ids[0]
+
+    def run():
+        return ctx.client.get(f"/customers/{busiest}/purchase_history/")
+    return run
+
+
+def list_endpoint(path):
+    def scenario(ctx, iterations):
+        def run():
+            return ctx.client.get(path)
+        return run
+    return scenario
+
+
+#scenarios run in this order; return consumes the sales made by checkout
+SCENARIOS = {
+    'checkout': checkout,
+    'return': product_return,
+    'product_scan': product_scan,
+    'po_complete': purchase_order_complete,
+    'purchase_history': purchase_history,
+    'list_products': list_endpoint('/products/'),
+    'list_customers': list_endpoint('/customers/'),
+    'list_sales': list_endpoint('/sales/'),
+    'list_returns': list_endpoint('/returns/'),
+    'list_purchase_orders': list_endpoint('/purchase_orders/'),
+}
@@ -0,0 +1,275 @@
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from core.apps.billing.models import (
+    SalesTransactionItem, ProductReturnItem, ArchivedSalesTransactionItem, ArchivedProductReturnItem,
+)
+from core.apps.products.models import Product, InventoryAdjustment, ProductPurchasePriceHistory
+
+try:
+    import numpy
+    from numpy.lib import format as npy_format
+except ImportError:
+    numpy = None
+
+
+MANIFEST = 'manifest.json'
+
+#dtype of each column kind; 'dict' columns are int32 codes into a dictionary kept in the manifest
+DTYPES = {'int': '<i8', 'float': '<f8', 'datetime': '<M8[s]', 'dict': '<i4'}
+
+
+class Source:
+    """
+    Rows of a table from one or more models sharing an id space, live and
+    archived rows of the same data. Exported in id order past a watermark.
+    """
+
+    def __init__(self, name, querysets, date_field, row):
+        self.name = name
+        self.querysets = querysets
+        self.date_field = date_field
+        self.row = row
+
+    def chunk(self, watermark, cutoff, size):
+        rows = []
+        for queryset in self.querysets:
+            #only rows old enough that no transaction holding a lower id is still open
+            rows += queryset.filter(id__gt=watermark, **{f'{self.date_field}__lte': cutoff}).order_by('id')[:size]
+        return sorted(rows, key=lambda row: row['id'])[:size]
+
+
+def _sale_lines():
+    return [
+        model.objects.values(
+            'id', 'product_id', 'quantity', 'unit_price', 'discount_amount', 'tax_amount',
+            sale_id=F('transaction_id'), sold_at=F('transaction__transaction_date'),
+            customer_id=F('transaction__customer_id'), payment_method=F('transaction__payment_method'),
+            category_id=F('product__category_id'), supplier_id=F('product__supplier_id'),
+        )
+        for model in (SalesTransactionItem, ArchivedSalesTransactionItem)
+    ]
+
+
+def _returned_lines():
+    return [
+        model.objects.values('id', 'product_id', 'quantity', moved_at=F('product_return__return_date'))
+        for model in (ProductReturnItem, ArchivedProductReturnItem)
+    ]
+
+
+def _money(value):
+    return float(value)
+
+
+#name: (columns as (name, kind, value of a row), sources)
+APPENDED_TABLES = {
+    'sales_lines': (
+        (
+            ('id', 'int', lambda row: row['id']),
+            ('sale_id', 'int', lambda row: row['sale_id']),
+            ('sold_at', 'datetime', lambda row: row['sold_at']),
+            ('customer_id', 'int', lambda row: row['customer_id'] or -1),
+            ('payment_method', 'dict', lambda row: row['payment_method']),
+            ('product_id', 'int', lambda row: row['product_id']),
+            ('category_id', 'int', lambda row: row['category_id']),
+            ('supplier_id', 'int', lambda row: row['supplier_id']),
+            ('quantity', 'float', lambda row: _money(row['quantity'])),
+            ('unit_price', 'float', lambda row: _money(row['unit_price'])),
+            ('discount_amount', 'float', lambda row: _money(row['discount_amount'])),
+            ('tax_amount', 'float', lambda row: _money(row['tax_amount'])),
+            ('line_total', 'float', lambda row: _money(row['quantity'] * row['unit_price'] - row['discount_amount'])),
+        ),
+        lambda: [Source('lines', _sale_lines(), 'sold_at', None)],
+    ),
+    #signed, positive into stock
+    'stock_movements': (
+        (
+            ('kind', 'dict', lambda row: row['kind']),
+            ('source_id', 'int', lambda row: row['id']),
+            ('product_id', 'int', lambda row: row['product_id']),
+            ('quantity', 'float', lambda row: _money(row['quantity'])),
+            ('moved_at', 'datetime', lambda row: row['moved_at']),
+        ),
+        lambda: [
+            Source('sale', [
+                queryset.values('id', 'product_id', 'quantity', moved_at=F('sold_at')) for queryset in _sale_lines()
+            ], 'sold_at', lambda row: {**row, 'quantity': -row['quantity']}),
+            Source('return', _returned_lines(), 'moved_at', None),
+            Source('adjustment', [
+                InventoryAdjustment.objects.values(
+                    'id', 'product_id', 'quantity', 'adjustment_type', moved_at=F('adjustment_date')
+                )
+            ], 'moved_at', lambda row: {
+                **row,
+                'quantity': row['quantity'] if row['adjustment_type'] == InventoryAdjustment.AdjustmentTypeChoices.INCREASE
+                else -row['quantity'],
+            }),
+            Source('purchase', [
+                ProductPurchasePriceHistory.objects.filter(quantity_received__gt=0).values(
+                    'id', 'product_id', quantity=F('quantity_received'), moved_at=F('effective_date')
+                )
+            ], 'moved_at', None),
+        ],
+    ),
+}
+
+#small tables, written whole on every export
+SNAPSHOT_TABLES = {
+    'products': (
+        (
+            ('id', 'int', lambda row: row['id']),
+            ('name', 'dict', lambda row: row['name']),
+            ('sku', 'dict', lambda row: row['sku']),
+            ('category', 'dict', lambda row: row['category__name']),
+            ('supplier', 'dict', lambda row: row['supplier__name']),
+            ('unit_of_measurement', 'dict', lambda row: row['unit_of_measurement']),
+            ('purchase_price', 'float', lambda row: _money(row['purchase_price'])),
+            ('selling_price', 'float', lambda row: _money(row['selling_price'])),
+            ('current_stock', 'float', lambda row: _money(row['current_stock'])),
+            ('minimum_stock', 'float', lambda row: _money(row['minimum_stock'])),
+        ),
+        lambda: Product.objects.order_by('id').values(
+            'id', 'name', 'sku', 'category__name', 'supplier__name', 'unit_of_measurement',
+            'purchase_price', 'selling_price', 'current_stock', 'minimum_stock',
+        ),
+    ),
+}
+
+
+def _array(kind, values, dictionary):
+    """values as a column of kind; new strings of a 'dict' column are added to dictionary"""
+    if kind == 'dict':
+        codes = {value: code for code, value in enumerate(dictionary)}
+        for value in values:
+            if value not in codes:
+                codes[value] = len(dictionary)
+                dictionary.append(value)
+        values = [codes[value] for value in values]
+    elif kind == 'datetime':
+        #seconds since the epoch, UTC
+        values = [int(value.timestamp()) for value in values]
+        return numpy.array(values, dtype='<i8').astype(DTYPES[kind])
+    return numpy.array(values, dtype=DTYPES[kind])
+
+
+def _header(array_dtype, rows):
+    return {'descr': npy_format.dtype_to_descr(numpy.dtype(array_dtype)), 'fortran_order': False, 'shape': (rows,)}
+
+
+def append_column(path, array, rows):
+    """
+    Append array to the 1-d .npy file at path, which holds rows committed
+    rows. Whatever an interrupted export wrote past them is overwritten.
+    The header keeps room for the row count to grow, so it is rewritten
+    in place and the file stays memory-mappable.
+    """
+    if not path.exists():
+        with open(path, 'wb') as file:
+            npy_format.write_array_header_1_0(file, _header(array.dtype, 0))
+    with open(path, 'r+b') as file:
+        npy_format.read_magic(file)
+        shape, _, dtype = npy_format.read_array_header_1_0(file)
+        if dtype != array.dtype:
+            raise ValueError(f"{path} holds {dtype}, cannot append {array.dtype}")
+        data_start = file.tell()
+        file.seek(data_start + rows * dtype.itemsize)
+        file.write(array.tobytes())
+        file.truncate()
+        file.seek(0)
+        npy_format.write_array_header_1_0(file, _header(dtype, rows + len(array)))
+        if file.tell() != data_start:
+            raise ValueError(f"The header of {path} outgrew its padding")
+
+
+def _write_manifest(path, manifest):
+    #renamed into place, a reader never sees half a manifest
+    temporary = path / f'{MANIFEST}.tmp'
+    temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temporary, path / MANIFEST)
+
+
+def _table_manifest(table, columns):
+    return {
+        'rows': 0,
+        'watermarks': {},
+        'columns': {
+            name: {'file': f'{table}/{name}.npy', 'dtype': DTYPES[kind], **({'dictionary': []} if kind == 'dict' else {})}
+            for name, kind, _ in columns
+        },
+    }
+
+
+def load_manifest(path):
+    manifest_path = Path(path) / MANIFEST
+    if manifest_path.exists():
+        return json.loads(manifest_path.read_text())
+    return {'format': 1, 'tables': {}}
+
+
+def _append_rows(path, manifest, table, columns, rows):
+    state = manifest['tables'][table]
+    for name, kind, value in columns:
+        column = state['columns'][name]
+        array = _array(kind, [value(row) for row in rows], column.get('dictionary'))
+        append_column(path / column['file'], array, state['rows'])
+    state['rows'] += len(rows)
+
+
+def export_columnar(path=None, chunk_size=None):
+    """
+    Append the sales lines and stock movements made since the last export
+    to the column files under path, CHUNK_SIZE rows per step, and rewrite
+    the product table. The manifest, saved after every step, records each
+    table's row count, per source watermarks and the string dictionaries;
+    columns are cut back to its row count on the next run if an export
+    was interrupted. Yields (table, rows written) after each step.
+    """
+    if numpy is None:
+        raise ImportError("The columnar export needs numpy, install it with `pip install numpy`")
+    path = Path(path or settings.COLUMNAR_EXPORT['PATH'])
+    chunk_size = chunk_size or settings.COLUMNAR_EXPORT['CHUNK_SIZE']
+    cutoff = timezone.now() - timezone.timedelta(seconds=settings.COLUMNAR_EXPORT['SETTLE_SECONDS'])
+    manifest = load_manifest(path)
+
+    for table, (columns, sources) in APPENDED_TABLES.items():
+        (path / table).mkdir(parents=True, exist_ok=True)
+        state = manifest['tables'].setdefault(table, _table_manifest(table, columns))
+        for source in sources():
+            while True:
+                rows = source.chunk(state['watermarks'].get(source.name, 0), cutoff, chunk_size)
+                if not rows:
+                    break
+                state['watermarks'][source.name] = rows[-1]['id']
+                if source.row:
+                    rows = [source.row(row) for row in rows]
+                _append_rows(path, manifest, table, columns, [{**row, 'kind': source.name} for row in rows])
+                manifest['exported_at'] = timezone.now().isoformat()
+                _write_manifest(path, manifest)
+                yield table, len(rows)
+
+    for table, (columns, queryset) in SNAPSHOT_TABLES.items():
+        (path / table).mkdir(parents=True, exist_ok=True)
+        manifest['tables'][table] = _table_manifest(table, columns)
+        for column in manifest['tables'][table]['columns'].values():
+            (path / column['file']).unlink(missing_ok=True)
+        rows = list(queryset())
+        _append_rows(path, manifest, table, columns, rows)
+        manifest['exported_at'] = timezone.now().isoformat()
+        _write_manifest(path, manifest)
+        yield table, len(rows)
+
+
+def load_table(path, table):
+    """{column: array} of an exported table, memory-mapped; dictionary columns decoded lazily by the caller"""
+    path = Path(path)
+    state = load_manifest(path)['tables'][table]
+    return {
+        name: numpy.load(path / column['file'], mmap_mode='r')[:state['rows']]
+        for name, column in state['columns'].items()
+    }
@@ -0,0 +1,130 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.apps.billing.models import (
+    SalesTransaction, SalesTransactionItem, ProductReturnItem,
+    ArchivedSalesTransaction, ArchivedSalesTransactionItem, ArchivedProductReturnItem, SalesFact,
+)
+from core.apps.products.models import ProductPurchasePriceHistory
+
+
+AMOUNT = DecimalField(max_digits=20, decimal_places=2)
+CENT = Decimal('0.01')
+
+#(sales, their items, their return items): live sales and archived ones
+SOURCES = (
+    (SalesTransaction, SalesTransactionItem, ProductReturnItem),
+    (ArchivedSalesTransaction, ArchivedSalesTransactionItem, ArchivedProductReturnItem),
+)
+
+
+def _line_rows(item_model, return_item_model, sale_ids):
+    """The lines of sale_ids with their product, sale and return details, in one query"""
+    returned = return_item_model.objects.filter(
+        product_return__transaction=OuterRef('transaction'), product=OuterRef('product')
+    ).values('product')
+    cost = ProductPurchasePriceHistory.objects.filter(
+        product=OuterRef('product'), effective_date__lte=OuterRef('transaction__transaction_date')
+    ).order_by('-effective_date', '-id').values('purchase_price')[:1]
+    return item_model.objects.filter(transaction_id__in=sale_ids).values(
+        'id', 'transaction_id', 'product_id', 'quantity', 'unit_price', 'discount_amount', 'tax_amount',
+        category_id=F('product__category_id'),
+        supplier_id=F('product__supplier_id'),
+        customer_id=F('transaction__customer_id'),
+        cashier_id=F('transaction__created_by_id'),
+        payment_method=F('transaction__payment_method'),
+        sold_at=F('transaction__transaction_date'),
+        #the latest purchase price before the sale, the current one for sales older than the price history
+        unit_cost=Coalesce(Subquery(cost), F('product__purchase_price')),
+        returned_quantity=Subquery(returned.annotate(total=Sum('quantity')).values('total'), output_field=AMOUNT),
+        returned_amount=Subquery(
+            returned.annotate(total=Sum(F('quantity') * F('unit_price'), output_field=AMOUNT)).values('total')
+        ),
+    )
+
+
+def _fact(row):
+    local = timezone.localtime(row['sold_at'])
+    line_total = row['quantity'] * row['unit_price'] - row['discount_amount']
+    return SalesFact(
+        id=row['id'], sale_id=row['transaction_id'], product_id=row['product_id'],
+        category_id=row['category_id'], supplier_id=row['supplier_id'], customer_id=row['customer_id'],
+        cashier_id=row['cashier_id'], payment_method=row['payment_method'], sold_at=row['sold_at'],
+        sale_date=local.date(), year=local.year, month=local.month, weekday=local.isoweekday(), hour=local.hour,
+        quantity=row['quantity'], unit_price=row['unit_price'], discount_amount=row['discount_amount'],
+        line_total=line_total, tax_amount=row['tax_amount'],
+        unit_cost=row['unit_cost'], cost=(row['unit_cost'] * row['quantity']).quantize(CENT),
+        returned_quantity=row['returned_quantity'] or 0, returned_amount=row['returned_amount'] or 0,
+    )
+
+
+def _split_returns(rows):
+    """
+    Returns name a sale's product, not one of its lines: the returned
+    quantity of a product sold on several lines fills them in id order,
+    the last taking whatever is left, and the returned amount follows the
+    quantities
+    """
+    lines = {}
+    for row in sorted(rows, key=lambda row: row['id']):
+        lines.setdefault((row['transaction_id'], row['product_id']), []).append(row)
+    for group in lines.values():
+        returned_quantity = quantity_left = group[0]['returned_quantity'] or 0
+        amount_left = group[0]['returned_amount'] or 0
+        for row in group[:-1]:
+            quantity = min(row['quantity'], quantity_left)
+            amount = (group[0]['returned_amount'] * quantity / returned_quantity).quantize(CENT) if quantity else 0
+            row['returned_quantity'], row['returned_amount'] = quantity, amount
+            quantity_left -= quantity
+            amount_left -= amount
+        group[-1]['returned_quantity'], group[-1]['returned_amount'] = quantity_left, amount_left
+    return rows
+
+
+def refresh_facts(sale_ids, sources=SOURCES):
+    """
+    Rebuild the facts of sale_ids from their lines, one query per source,
+    replacing what was there in one transaction. Returns the number of
+    lines written.
+    """
+    facts = [
+        _fact(row)
+        for _, item_model, return_item_model in sources
+        for row in _split_returns(list(_line_rows(item_model, return_item_model, sale_ids)))
+    ]
+    with transaction.atomic():
+        SalesFact.objects.filter(sale_id__in=sale_ids).delete()
+        SalesFact.objects.bulk_create(facts)
+    return len(facts)
+
+
+def backfill_facts(chunk_size=None, pause=None):
+    """
+    Rebuild the facts of every live and archived sale, chunk_size sales
+    per transaction with a pause in between so checkouts get the write
+    lock. Yields the running (sales, lines) totals after each chunk.
+    """
+    chunk_size = chunk_size or settings.SALES_FACTS['CHUNK_SIZE']
+    pause = settings.SALES_FACTS['PAUSE_SECONDS'] if pause is None else pause
+
+    sales = lines = 0
+    for source in SOURCES:
+        sale_model = source[0]
+        last_id = 0
+        while True:
+            sale_ids = list(
+                sale_model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not sale_ids:
+                break
+            lines += refresh_facts(sale_ids, [source])
+            sales += len(sale_ids)
+            last_id = sale_ids[-1]
+            yield sales, lines
+            time.sleep(pause)
@@ -0,0 +1,200 @@
+import logging
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Floor, Greatest, Round
+from django.utils import timezone
+
+from core.apps.billing.models import (
+    SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem, LoyaltyRule, LoyaltyCursor,
+)
+from core.apps.common.cache import bump_model_version
+from core.apps.common.serializers import day_start
+from core.apps.users.models import Customer
+
+
+logger = logging.getLogger(__name__)
+
+RATE = DecimalField(max_digits=12, decimal_places=6)
+
+
+def points_value(points):
+    """Discount worth of redeeming points"""
+    return (points * Decimal(settings.LOYALTY['POINT_VALUE'])).quantize(Decimal('0.01'))
+
+
+def redeem_points(customer_id, points):
+    """
+    Take points from a customer's balance with one conditional UPDATE,
+    returning False when they do not have that many. Two checkouts can
+    never spend the same points.
+    """
+    redeemed = bool(
+        Customer.objects.filter(pk=customer_id, loyalty_points__gte=points)
+        .update(loyalty_points=F('loyalty_points') - points)
+    )
+    if redeemed:
+        bump_model_version(Customer)
+    return redeemed
+
+
+def _specificity(rule):
+    #category rules before general ones, dated promotions before standing rules, newest first
+    return (rule.category_id is None, rule.valid_from is None and rule.valid_until is None, -rule.id)
+
+
+def rate_expression(category_lookup, date_lookup, rules):
+    """
+    Points per 1.00 of an item as a CASE over the active rules, the most
+    specific rule matching the item's category and sale date first
+    """
+    whens = []
+    for rule in sorted(rules, key=_specificity):
+        condition = Q()
+        if rule.category_id is not None:
+            condition &= Q(**{category_lookup: rule.category_id})
+        if rule.valid_from:
+            condition &= Q(**{f'{date_lookup}__gte': day_start(rule.valid_from)})
+        if rule.valid_until:
+            condition &= Q(**{f'{date_lookup}__lt': day_start(rule.valid_until + timedelta(days=1))})
+        rate = Value(rule.points_per_unit * rule.multiplier, output_field=RATE)
+        if not condition:
+            #a standing rule for every product matches whatever is left
+            return Case(*whens, default=rate, output_field=RATE)
+        whens.append(When(condition, then=rate))
+    return Case(*whens, default=Value(0, output_field=RATE), output_field=RATE)
+
+
+def _points(value, prefix=''):
+    """
+    Whole points of value, the points of a sale's item prices, scaled to
+    what the customer actually paid after the sale's discount and
+    redeemed points
+    """
+    subtotal, discount = F(f'{prefix}subtotal'), F(f'{prefix}discount_amount')
+    #multiplied before dividing, SQLite divides whole-number amounts as integers;
+    #rounded before the floor, float arithmetic would turn 3 points into 2.9999...
+    return Case(
+        When(**{f'{prefix}subtotal__gt': 0}, then=Floor(Round(value * (subtotal - discount) / subtotal, 6))),
+        default=Value(0), output_field=RATE,
+    )
+
+
+def sale_points(first_id, last_id, rules):
+    """
+    {customer id: points earned} by the sales with ids in (first_id, last_id],
+    in one grouped query. Points are counted per sale, rounded down.
+    """
+    rate = rate_expression('product__category_id', 'transaction__transaction_date', rules)
+    items_value = Subquery(
+        SalesTransactionItem.objects.filter(transaction=OuterRef('pk'))
+        .values('transaction')
+        .annotate(value=Sum((F('quantity') * F('unit_price') - F('discount_amount')) * rate, output_field=RATE))
+        .values('value')
+    )
+    rows = (
+        SalesTransaction.objects.filter(id__gt=first_id, id__lte=last_id, customer__isnull=False)
+        .annotate(points=_points(items_value))
+        .values('customer_id')
+        .annotate(delta=Sum('points'))
+        .order_by()
+    )
+    return {row['customer_id']: int(row['delta'] or 0) for row in rows}
+
+
+def return_points(first_id, last_id, rules):
+    """
+    {customer id: points lost} by the returns with ids in (first_id, last_id],
+    at the rates and discount of the sale they undo, in one grouped query
+    """
+    rate = rate_expression('product__category_id', 'product_return__transaction__transaction_date', rules)
+    items_value = Subquery(
+        ProductReturnItem.objects.filter(product_return=OuterRef('pk'))
+        .values('product_return')
+        .annotate(value=Sum(F('quantity') * F('unit_price') * rate, output_field=RATE))
+        .values('value')
+    )
+    rows = (
+        ProductReturn.objects.filter(id__gt=first_id, id__lte=last_id, transaction__customer__isnull=False)
+        .annotate(points=_points(items_value, 'transaction__'))
+        .values('transaction__customer_id')
+        .annotate(delta=Sum('points'))
+        .order_by()
+    )
+    return {row['transaction__customer_id']: int(row['delta'] or 0) for row in rows}
+
+
+def apply_deltas(deltas, chunk_size=500):
+    """Move loyalty points by {customer id: delta}, one UPDATE per chunk of customers, never below zero"""
+    customer_ids = [customer_id for customer_id, delta in deltas.items() if delta]
+    for offset in range(0, len(customer_ids), chunk_size):
+        chunk = customer_ids[offset:offset + chunk_size]
+        delta = Case(*[When(id=customer_id, then=Value(deltas[customer_id])) for customer_id in chunk])
+        Customer.objects.filter(id__in=chunk).update(loyalty_points=Greatest(F('loyalty_points') + delta, 0))
+    if customer_ids:
+        #update() sends no signals, cached customer responses hold the old points
+        bump_model_version(Customer)
+    return len(customer_ids)
+
+
+class LoyaltyAccrual:
+    """
+    Credits loyalty points for new sales and takes them back for new
+    returns, BATCH_SIZE rows at a time past the watermark of each. A
+    batch's deltas and the watermark move in one transaction, so every
+    sale and return counts exactly once. Runs apart from checkout.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.LOYALTY['BATCH_SIZE']
+        self.stopping = False
+
+    def _next_batch(self, model, date_field, last_id):
+        queryset = model.objects.filter(id__gt=last_id)
+        settle = settings.LOYALTY['SETTLE_SECONDS']
+        if settle:
+            #leave time for transactions holding lower ids to commit
+            queryset = queryset.filter(**{f'{date_field}__lte': timezone.now() - timedelta(seconds=settle)})
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:self.batch_size])
+        return ids[-1] if ids else None
+
+    def _accrue(self, name, model, date_field, points, sign):
+        with transaction.atomic():
+            cursor, _ = LoyaltyCursor.objects.select_for_update().get_or_create(name=name)
+            last_id = self._next_batch(model, date_field, cursor.last_id)
+            if last_id is None:
+                return 0
+            rules = list(LoyaltyRule.objects.filter(is_active=True))
+            deltas = {
+                customer_id: sign * delta
+                for customer_id, delta in points(cursor.last_id, last_id, rules).items()
+            } if rules else {}
+            customers = apply_deltas(deltas)
+            logger.info("Loyalty %s #%s-#%s: points moved for %s customers", name, cursor.last_id + 1, last_id, customers)
+            cursor.last_id = last_id
+            cursor.save()
+        return 1
+
+    def accrue(self):
+        """Process one batch of sales and one of returns, returning the number of batches processed"""
+        return (
+            self._accrue('sales', SalesTransaction, 'transaction_date', sale_points, 1)
+            + self._accrue('returns', ProductReturn, 'return_date', return_points, -1)
+        )
+
+    def run(self, burst=False, poll_interval=None):
+        """Accrue until stopped; burst returns once everything is processed"""
+        poll_interval = settings.LOYALTY['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        batches = 0
+        while not self.stopping:
+            count = self.accrue()
+            batches += count
+            if not count:
+                if burst:
+                    break
+                time.sleep(poll_interval)
+        return batches
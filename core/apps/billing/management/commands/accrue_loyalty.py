@@ -0,0 +1,30 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.apps.billing.loyalty import LoyaltyAccrual
+
+
+class Command(BaseCommand):
+    help = "Credit loyalty points for new sales and take them back for new returns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=settings.LOYALTY['POLL_INTERVAL'],
+                            help='seconds an idle job waits before checking for new sales')
+        parser.add_argument('--batch-size', type=int, default=settings.LOYALTY['BATCH_SIZE'],
+                            help='sales or returns credited per transaction')
+        parser.add_argument('--burst', action='store_true', help='exit once every settled sale is credited')
+
+    def handle(self, *args, **options):
+        accrual = LoyaltyAccrual(batch_size=options['batch_size'])
+
+        def stop(signum, frame):
+            #finish the batch in hand, then exit
+            accrual.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        batches = accrual.run(burst=options['burst'], poll_interval=options['poll_interval'])
+        self.stdout.write(f"Processed {batches} batches")
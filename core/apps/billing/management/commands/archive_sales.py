@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.apps.billing.archive import archive_sales, closed_period_end
+
+
+class Command(BaseCommand):
+    help = "Move sales and returns of closed months into the archive tables, in short chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='archive sales made before this date (YYYY-MM-DD), '
+                                             'by default the start of the month the return window starts in')
+        parser.add_argument('--chunk-size', type=int, help='sales moved per transaction')
+        parser.add_argument('--pause', type=float, help='seconds to wait between chunks')
+
+    def handle(self, *args, **options):
+        before = closed_period_end()
+        if options['before']:
+            try:
+                before = timezone.make_aware(datetime.strptime(options['before'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError("--before must be a date in the YYYY-MM-DD format")
+
+        self.stdout.write(f"Archiving sales made before {before:%Y-%m-%d %H:%M %Z}")
+        sales = returns = 0
+        try:
+            for sales, returns in archive_sales(before, options['chunk_size'], options['pause']):
+                self.stdout.write(f"  {sales} sales, {returns} returns archived")
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Archived {sales} sales and {returns} returns"))
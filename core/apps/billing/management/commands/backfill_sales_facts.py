@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.apps.billing.facts import backfill_facts
+
+
+class Command(BaseCommand):
+    help = "Rebuild the sales fact table from every live and archived sale, in short chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='sales rebuilt per transaction')
+        parser.add_argument('--pause', type=float, help='seconds to wait between chunks')
+
+    def handle(self, *args, **options):
+        sales = lines = 0
+        for sales, lines in backfill_facts(options['chunk_size'], options['pause']):
+            self.stdout.write(f"  {sales} sales, {lines} lines")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the facts of {sales} sales, {lines} lines"))
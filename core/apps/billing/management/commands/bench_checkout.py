@@ -0,0 +1,136 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, OperationalError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.apps.common.benchmark import temporary_database, percentile
+from core.apps.products.models import Category, Supplier, Product
+from core.apps.users.models import User
+
+
+PROFILES = {
+    'default': {},
+    'production': settings.SQLITE_PRODUCTION_OPTIONS,
+}
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent checkout throughput on SQLite with and without the production profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,4,8',
+                            help='comma separated list of concurrent checkout workers')
+        parser.add_argument('--checkouts', type=int, default=50,
+                            help='checkouts performed by each worker')
+        parser.add_argument('--readers', type=int, default=2,
+                            help='threads listing products while checkouts run')
+        parser.add_argument('--profile', choices=['default', 'production', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        workers = [int(w) for w in options['workers'].split(',')]
+        profiles = list(PROFILES) if options['profile'] == 'both' else [options['profile']]
+
+        self.stdout.write(
+            f"{'profile':<12}{'workers':>8}{'ok':>8}{'locked':>8}{'failed':>8}{'co/s':>10}"
+            f"{'co p95 ms':>11}{'read p95 ms':>13}"
+        )
+        for profile in profiles:
+            for worker_count in workers:
+                #the test client talks to the in-process app as "testserver"
+                with temporary_database(PROFILES[profile]), override_settings(ALLOWED_HOSTS=['testserver']):
+                    result = self._run(worker_count, options['checkouts'], options['readers'])
+                self.stdout.write(
+                    f"{profile:<12}{worker_count:>8}{result['ok']:>8}{result['locked']:>8}{result['failed']:>8}"
+                    f"{result['throughput']:>10.1f}{result['checkout_p95']:>11.1f}"
+                    f"{result['read_p95']:>13.1f}"
+                )
+
+    def _seed(self, product_count=20):
+        user = User.objects.create_user('bench', 'bench@example.com', 'bench', role=User.RoleChoices.ADMIN)
+        category = Category.objects.create(name='Bench')
+        supplier = Supplier.objects.create(name='Bench', contact_person='Bench', phone='0', address='-')
+        Product.objects.bulk_create([
+            Product(
+                name=f'Product {i}', sku=f'BENCH-{i}', category=category, supplier=supplier,
+                purchase_price=Decimal('5.00'), selling_price=Decimal('10.00'),
+                current_stock=Decimal('1000000.00'),
+            )
+            for i in range(product_count)
+        ])
+        return user, list(Product.objects.values_list('id', flat=True))
+
+    def _run(self, worker_count, checkouts, readers):
+        user, product_ids = self._seed()
+        stats = {'ok': 0, 'locked': 0, 'failed': 0, 'checkout': [], 'read': []}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def client():
+            api = APIClient()
+            api.force_authenticate(user)
+            return api
+
+        def checkout_worker(offset):
+            api = client()
+            try:
+                for i in range(checkouts):
+                    product_id = product_ids[(offset + i) % len(product_ids)]
+                    payload = {
+                        'payment_method': 'Cash',
+                        'amount_paid': '100.00',
+                        'items': [{'product': product_id, 'quantity': '1', 'unit_price': '10.00'}],
+                    }
+                    started = time.perf_counter()
+                    try:
+                        response = api.post('/sales/', payload, format='json')
+                        outcome = 'ok' if response.status_code == 201 else 'failed'
+                    except OperationalError:
+                        #"database is locked" surfaces here with the default profile
+                        outcome = 'locked'
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        stats[outcome] += 1
+                        stats['checkout'].append(elapsed)
+            finally:
+                connections.close_all()
+
+        def read_worker():
+            api = client()
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        api.get('/products/')
+                    except OperationalError:
+                        pass
+                    with lock:
+                        stats['read'].append((time.perf_counter() - started) * 1000)
+            finally:
+                connections.close_all()
+
+        read_threads = [threading.Thread(target=read_worker) for _ in range(readers)]
+        write_threads = [threading.Thread(target=checkout_worker, args=(i,)) for i in range(worker_count)]
+
+        started = time.perf_counter()
+        for thread in read_threads + write_threads:
+            thread.start()
+        for thread in write_threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in read_threads:
+            thread.join()
+
+        return {
+            'ok': stats['ok'],
+            'locked': stats['locked'],
+            'failed': stats['failed'],
+            'throughput': stats['ok'] / elapsed if elapsed else 0.0,
+            'checkout_p95': percentile(stats['checkout'], 95),
+            'read_p95': percentile(stats['read'], 95),
+        }
@@ -0,0 +1,65 @@
+import io
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core.apps.billing.serializers import SalesTransactionSerializer, SalesTransactionValuesSerializer
+from core.apps.billing.views import SalesTransactionViewSet
+from core.apps.common.benchmark import temporary_database, percentile
+from core.apps.products.serializers import ProductSerializer, ProductValuesSerializer
+from core.apps.products.views import ProductViewSet
+from core.apps.users.serializers import CustomerSerializer, CustomerValuesSerializer
+from core.apps.users.views import CustomerViewSet
+
+
+#endpoint, viewset queryset, ModelSerializer, ValuesSerializer
+ENDPOINTS = (
+    ('products', ProductViewSet.queryset, ProductSerializer, ProductValuesSerializer),
+    ('customers', CustomerViewSet.queryset, CustomerSerializer, CustomerValuesSerializer),
+    ('sales', SalesTransactionViewSet.queryset, SalesTransactionSerializer, SalesTransactionValuesSerializer),
+)
+
+
+class Command(BaseCommand):
+    help = "Compare list rendering through the ModelSerializers and the values based read path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--sales', type=int, default=2000, help='size of the seeded sales history')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        with temporary_database(settings.DATABASES['default'].get('OPTIONS')):
+            call_command(
+                'generate_dataset', seed=options['seed'], sales=options['sales'],
+                products=2000, customers=2000, purchase_orders=50, deposits=0, adjustments=0,
+                stdout=io.StringIO(),
+            )
+            self.stdout.write(
+                f"{'endpoint':<12}{'rows':>8}{'serializer p50 ms':>20}{'values p50 ms':>16}{'speedup':>10}"
+            )
+            for name, queryset, serializer_class, values_serializer_class in ENDPOINTS:
+                #both paths fetch from the database and render JSON, like a list request
+                slow, rows = self._time(
+                    lambda: serializer_class(queryset.all(), many=True).data, options['iterations']
+                )
+                fast, values_rows = self._time(
+                    lambda: values_serializer_class(queryset.all()).data, options['iterations']
+                )
+                if values_rows != rows:
+                    self.stderr.write(self.style.ERROR(f"{name}: the two paths render different JSON"))
+                self.stdout.write(
+                    f"{name:<12}{queryset.count():>8}{slow:>20.2f}{fast:>16.2f}{slow / fast:>9.1f}x"
+                )
+
+    def _time(self, build, iterations):
+        renderer = JSONRenderer()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            rendered = renderer.render(build())
+            samples.append((time.perf_counter() - started) * 1000)
+        return percentile(samples, 50), rendered
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apps.billing import columnar
+
+
+class Command(BaseCommand):
+    help = "Append new sales lines and stock movements to the columnar export and rewrite its product table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='directory of the column files and their manifest')
+        parser.add_argument('--chunk-size', type=int, help='rows appended per step')
+
+    def handle(self, *args, **options):
+        if columnar.numpy is None:
+            raise CommandError("The columnar export needs numpy, install it with `pip install numpy`")
+        written = {}
+        for table, rows in columnar.export_columnar(options['path'], options['chunk_size']):
+            written[table] = written.get(table, 0) + rows
+            self.stdout.write(f"  {table}: {rows} rows")
+        summary = ', '.join(f"{rows} {table}" for table, rows in written.items()) or "nothing new"
+        self.stdout.write(self.style.SUCCESS(f"Exported {summary}"))
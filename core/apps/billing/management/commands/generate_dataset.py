@@ -0,0 +1,404 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.apps.billing.models import SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem
+from core.apps.common.cache import bump_model_version
+from core.apps.products.models import (
+    Category, Supplier, Product, PurchaseOrder, PurchaseOrderItem, InventoryAdjustment
+)
+from core.apps.users.models import Customer, CustomerDeposit, CustomerLedgerEntry
+
+
+#relative shop traffic per hour of the day, busy around lunch and after work
+HOURLY_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 1, 4, 6, 8, 10, 12, 10, 7, 6, 8, 11, 12, 9, 5, 2, 0, 0]
+#monday .. sunday
+WEEKDAY_WEIGHTS = [0.9, 0.9, 1.0, 1.0, 1.2, 1.5, 1.3]
+ITEMS_PER_SALE_WEIGHTS = [35, 25, 15, 10, 6, 4, 3, 2]
+QUANTITY_WEIGHTS = [80, 12, 4, 2, 2]
+
+
+def cents(value):
+    return Decimal(value).scaleb(-2)
+
+
+@contextmanager
+def historical_timestamps(*models):
+    """
+    Let bulk_create keep the generated dates instead of overwriting
+    auto_now/auto_now_add fields with the current time.
+    """
+    toggled = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                toggled.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in toggled:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = "Generate a reproducible synthetic dataset with realistic sales distributions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=30)
+        parser.add_argument('--suppliers', type=int, default=50)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--purchase-orders', type=int, default=2000)
+        parser.add_argument('--sales', type=int, default=100000)
+        parser.add_argument('--customer-share', type=float, default=0.4,
+                            help='share of sales made by a registered customer')
+        parser.add_argument('--return-rate', type=float, default=0.04,
+                            help='share of sales that get a (usually partial) return')
+        parser.add_argument('--deposits', type=int, default=3000)
+        parser.add_argument('--adjustments', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=365, help='length of the sales history')
+        parser.add_argument('--pareto-alpha', type=float, default=1.16,
+                            help='skew of product and customer popularity, 1.16 gives the 80/20 rule')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.alpha = options['pareto_alpha']
+        #history covers whole days up to today, so hour slots line up with midnight
+        self.end = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start = self.end - timedelta(days=options['days'])
+        self.slot_weights = self._time_slot_weights(options['days'])
+        #customer id -> balance change in cents
+        self.balances = {}
+
+        started = time.perf_counter()
+        with historical_timestamps(
+            Category, Supplier, Product, Customer, CustomerDeposit, PurchaseOrder,
+            InventoryAdjustment, SalesTransaction, ProductReturn,
+        ):
+            categories = self._create_categories(options['categories'])
+            suppliers = self._create_suppliers(options['suppliers'])
+            products = self._create_products(options['products'], categories, suppliers)
+            customers = self._create_customers(options['customers'])
+            self._create_purchase_orders(options['purchase_orders'], suppliers, products)
+            self._create_sales(options['sales'], products, customers, options)
+            self._create_deposits(options['deposits'], customers)
+            self._create_adjustments(options['adjustments'], products)
+            self._apply_balances()
+
+        bump_model_version(
+            Category, Supplier, Product, Customer, CustomerDeposit, PurchaseOrder, PurchaseOrderItem,
+            InventoryAdjustment, SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Dataset generated in {time.perf_counter() - started:.1f}s (seed {options['seed']})"
+        ))
+
+    def _pareto_weights(self, count):
+        """Cumulative popularity weights, a few items take most of the traffic"""
+        weights = [self.rng.paretovariate(self.alpha) for _ in range(count)]
+        return list(accumulate(weights))
+
+    def _time_slot_weights(self, days):
+        """Cumulative weights of every hour in the history window"""
+        weights = []
+        for day in range(days):
+            weekday = (self.start + timedelta(days=day)).weekday()
+            weights.extend(WEEKDAY_WEIGHTS[weekday] * hourly for hourly in HOURLY_WEIGHTS)
+        return list(accumulate(weights))
+
+    def _random_moments(self, count):
+        """Sorted timestamps following the weekday and time-of-day traffic pattern"""
+        slots = self.rng.choices(range(len(self.slot_weights)), cum_weights=self.slot_weights, k=count)
+        return sorted(
+            self.start + timedelta(hours=slot, seconds=self.rng.randrange(3600))
+            for slot in slots
+        )
+
+    def _chunked_moments(self, total):
+        """
+        (offset, size, moments) per chunk of total rows, the moments drawn
+        at once and cut in order, so ids given out chunk by chunk increase
+        with time as they do for rows stamped with auto_now_add
+        """
+        moments = self._random_moments(total)
+        for offset, size in self._chunks(total):
+            yield offset, size, moments[offset:offset + size]
+
+    def _random_date(self):
+        return self.start + timedelta(seconds=self.rng.randrange(int((self.end - self.start).total_seconds())))
+
+    def _chunks(self, total):
+        for offset in range(0, total, self.chunk_size):
+            yield offset, min(self.chunk_size, total - offset)
+
+    def _progress(self, label, done, total):
+        self.stdout.write(f"  {label}: {done}/{total}", ending='\r' if done < total else '\n')
+
+    def _create_categories(self, count):
+        #category names are unique, continue numbering after existing ones
+        offset = Category.objects.count()
+        now = self.start
+        created = Category.objects.bulk_create([
+            Category(name=f"Category {offset + i}", created_at=now, updated_at=now)
+            for i in range(count)
+        ], batch_size=self.chunk_size)
+        return [category.id for category in created]
+
+    def _create_suppliers(self, count):
+        now = self.start
+        created = Supplier.objects.bulk_create([
+            Supplier(
+                name=f"Supplier {i}", contact_person=f"Contact {i}", phone=f"98{i:08d}",
+                address=f"{i} Market Road", created_at=now, updated_at=now,
+            )
+            for i in range(count)
+        ], batch_size=self.chunk_size)
+        return [supplier.id for supplier in created]
+
+    def _create_products(self, count, categories, suppliers):
+        offset = Product.objects.count()
+        now = self.start
+        self.product_prices = {}
+        created_ids = []
+
+        for chunk_offset, size in self._chunks(count):
+            products = []
+            for i in range(chunk_offset, chunk_offset + size):
+                purchase = self.rng.randrange(100, 500000)
+                selling = int(purchase * self.rng.uniform(1.1, 1.6))
+                products.append(Product(
+                    name=f"Product {offset + i}", sku=f"GEN-{offset + i:08d}",
+                    barcode=f"{self.rng.randrange(10 ** 12, 10 ** 13)}",
+                    category_id=self.rng.choice(categories), supplier_id=self.rng.choice(suppliers),
+                    purchase_price=cents(purchase), selling_price=cents(selling),
+                    current_stock=self.rng.randrange(0, 500), minimum_stock=self.rng.randrange(0, 20),
+                    unit_of_measurement=self.rng.choice(Product.UnitChoices.values),
+                    created_at=now, updated_at=now,
+                ))
+            with transaction.atomic():
+                created = Product.objects.bulk_create(products)
+            for product in created:
+                created_ids.append(product.id)
+                self.product_prices[product.id] = int(product.selling_price * 100)
+            self._progress('products', chunk_offset + size, count)
+
+        #ranked popularity is independent of the id order
+        self.rng.shuffle(created_ids)
+        self.product_weights = self._pareto_weights(len(created_ids))
+        return created_ids
+
+    def _create_customers(self, count):
+        created_ids = []
+        for chunk_offset, size in self._chunks(count):
+            customers = []
+            for i in range(chunk_offset, chunk_offset + size):
+                joined = self._random_date()
+                customers.append(Customer(
+                    name=f"Customer {i}", phone=f"97{i:08d}", email=f"customer{i}@example.com",
+                    created_at=joined, updated_at=joined,
+                ))
+            with transaction.atomic():
+                created_ids.extend(customer.id for customer in Customer.objects.bulk_create(customers))
+            self._progress('customers', chunk_offset + size, count)
+
+        self.customer_weights = self._pareto_weights(len(created_ids))
+        return created_ids
+
+    def _create_purchase_orders(self, count, suppliers, products):
+        for chunk_offset, size, moments in self._chunked_moments(count):
+            orders = []
+            for moment in moments:
+                status = (
+                    PurchaseOrder.StatusChoices.PENDING if moment > self.end - timedelta(days=7)
+                    else PurchaseOrder.StatusChoices.COMPLETED
+                )
+                orders.append(PurchaseOrder(
+                    supplier_id=self.rng.choice(suppliers), order_date=moment.date(), status=status,
+                    created_at=moment, updated_at=moment,
+                ))
+
+            with transaction.atomic():
+                orders = PurchaseOrder.objects.bulk_create(orders)
+                items = []
+                for order in orders:
+                    total = 0
+                    for product_id in self.rng.sample(products, min(len(products), self.rng.randint(1, 10))):
+                        quantity = self.rng.randint(5, 200)
+                        unit_cents = int(self.product_prices[product_id] * self.rng.uniform(0.6, 0.9))
+                        received = quantity if order.status == PurchaseOrder.StatusChoices.COMPLETED else 0
+                        items.append(PurchaseOrderItem(
+                            purchase_order=order, product_id=product_id, quantity=quantity,
+                            unit_price=cents(unit_cents), received_quantity=received,
+                        ))
+                        total += quantity * unit_cents
+                    order.total_amount = cents(total)
+                PurchaseOrderItem.objects.bulk_create(items, batch_size=self.chunk_size)
+                PurchaseOrder.objects.bulk_update(orders, ['total_amount'], batch_size=self.chunk_size)
+            self._progress('purchase orders', chunk_offset + size, count)
+
+    def _create_sales(self, count, products, customers, options):
+        methods = SalesTransaction.PaymentMethodChoices
+        item_counts = range(1, len(ITEMS_PER_SALE_WEIGHTS) + 1)
+        quantities = range(1, len(QUANTITY_WEIGHTS) + 1)
+        lines = 0
+        #(return date, sale id, refund method, refund, returned lines), written once all sales are
+        self.returns = []
+
+        for chunk_offset, size, moments in self._chunked_moments(count):
+            sales = []
+            baskets = []
+            for moment in moments:
+                customer_id = None
+                if customers and self.rng.random() < options['customer_share']:
+                    customer_id = self.rng.choices(customers, cum_weights=self.customer_weights)[0]
+
+                size_of_basket = self.rng.choices(item_counts, weights=ITEMS_PER_SALE_WEIGHTS)[0]
+                #deduplicated in draw order, a set would order the draws below by id
+                basket_products = dict.fromkeys(
+                    self.rng.choices(products, cum_weights=self.product_weights, k=size_of_basket)
+                )
+                basket = []
+                subtotal = 0
+                for product_id in basket_products:
+                    quantity = self.rng.choices(quantities, weights=QUANTITY_WEIGHTS)[0]
+                    unit_cents = self.product_prices[product_id]
+                    discount = unit_cents * quantity // 20 if self.rng.random() < 0.1 else 0
+                    basket.append((product_id, quantity, unit_cents, discount))
+                    subtotal += quantity * unit_cents - discount
+
+                if customer_id and self.rng.random() < 0.25:
+                    method = methods.CREDIT
+                    paid = self.rng.choice([0, subtotal // 2])
+                    self.balances[customer_id] = self.balances.get(customer_id, 0) + subtotal - paid
+                else:
+                    method = methods.CASH if self.rng.random() < 0.65 else methods.ONLINE
+                    #cash customers round up and get change back
+                    paid = -(-subtotal // 10000) * 10000 if method == methods.CASH else subtotal
+
+                sales.append(SalesTransaction(
+                    customer_id=customer_id, transaction_date=moment, payment_method=method,
+                    subtotal=cents(subtotal), total_amount=cents(subtotal), amount_paid=cents(paid),
+                    change_amount=cents(max(0, paid - subtotal)), created_at=moment, updated_at=moment,
+                ))
+                baskets.append(basket)
+
+            with transaction.atomic():
+                sales = SalesTransaction.objects.bulk_create(sales)
+                items = [
+                    SalesTransactionItem(
+                        transaction_id=sale.id, product_id=product_id, quantity=quantity,
+                        unit_price=cents(unit_cents), discount_amount=cents(discount),
+                    )
+                    for sale, basket in zip(sales, baskets)
+                    for product_id, quantity, unit_cents, discount in basket
+                ]
+                SalesTransactionItem.objects.bulk_create(items, batch_size=self.chunk_size)
+            self._draw_returns(sales, baskets, options['return_rate'])
+
+            lines += len(items)
+            self._progress('sales', chunk_offset + size, count)
+        self.stdout.write(f"  sale lines: {lines}")
+        self._create_returns()
+
+    def _draw_returns(self, sales, baskets, return_rate):
+        refund_methods = ProductReturn.RefundMethodChoices
+        for sale, basket in zip(sales, baskets):
+            if self.rng.random() >= return_rate:
+                continue
+
+            #usually only part of the basket, and part of the quantity, comes back
+            returned = []
+            for product_id, quantity, unit_cents, _ in self.rng.sample(basket, self.rng.randint(1, len(basket))):
+                returned.append((product_id, self.rng.randint(1, quantity), unit_cents))
+            refund = sum(quantity * unit_cents for _, quantity, unit_cents in returned)
+
+            method = refund_methods.CREDIT if sale.customer_id and self.rng.random() < 0.5 else refund_methods.CASH
+            if method == refund_methods.CREDIT:
+                self.balances[sale.customer_id] = self.balances.get(sale.customer_id, 0) - refund
+
+            moment = min(self.end, sale.transaction_date + timedelta(hours=self.rng.randint(1, 24 * 14)))
+            self.returns.append((moment, sale.id, method, refund, returned))
+
+    def _create_returns(self):
+        #in date order, a return can come weeks after its sale
+        self.returns.sort(key=lambda drawn: drawn[:2])
+        for chunk_offset, size in self._chunks(len(self.returns)):
+            drawn = self.returns[chunk_offset:chunk_offset + size]
+            with transaction.atomic():
+                returns = ProductReturn.objects.bulk_create([
+                    ProductReturn(
+                        transaction_id=sale_id, return_date=moment, reason="Customer return",
+                        refund_method=method, refund_amount=cents(refund), created_at=moment, updated_at=moment,
+                    )
+                    for moment, sale_id, method, refund, _ in drawn
+                ])
+                ProductReturnItem.objects.bulk_create([
+                    ProductReturnItem(
+                        product_return_id=product_return.id, product_id=product_id,
+                        quantity=quantity, unit_price=cents(unit_cents),
+                    )
+                    for product_return, (*_, returned) in zip(returns, drawn)
+                    for product_id, quantity, unit_cents in returned
+                ], batch_size=self.chunk_size)
+            self._progress('returns', chunk_offset + size, len(self.returns))
+
+    def _create_deposits(self, count, customers):
+        if not customers:
+            return
+        for chunk_offset, size, moments in self._chunked_moments(count):
+            deposits = []
+            for moment in moments:
+                customer_id = self.rng.choices(customers, cum_weights=self.customer_weights)[0]
+                amount = self.rng.randrange(1000, 500000, 500)
+                self.balances[customer_id] = self.balances.get(customer_id, 0) - amount
+                deposits.append(CustomerDeposit(
+                    customer_id=customer_id, amount=cents(amount), deposit_date=moment, created_at=moment,
+                ))
+            with transaction.atomic():
+                CustomerDeposit.objects.bulk_create(deposits)
+            self._progress('deposits', chunk_offset + size, count)
+
+    def _create_adjustments(self, count, products):
+        types = InventoryAdjustment.AdjustmentTypeChoices
+        for chunk_offset, size, moments in self._chunked_moments(count):
+            adjustments = [
+                InventoryAdjustment(
+                    product_id=self.rng.choices(products, cum_weights=self.product_weights)[0],
+                    adjustment_type=types.DECREASE if self.rng.random() < 0.7 else types.INCREASE,
+                    quantity=self.rng.randint(1, 10),
+                    reason=self.rng.choice(["Damaged", "Stock count", "Expired", "Found in storage"]),
+                    adjustment_date=moment, created_at=moment, updated_at=moment,
+                )
+                for moment in moments
+            ]
+            with transaction.atomic():
+                InventoryAdjustment.objects.bulk_create(adjustments)
+            self._progress('adjustments', chunk_offset + size, count)
+
+    def _apply_balances(self):
+        customer_ids = list(self.balances)
+        for offset in range(0, len(customer_ids), self.chunk_size):
+            customers = Customer.objects.in_bulk(customer_ids[offset:offset + self.chunk_size])
+            entries = []
+            for customer in customers.values():
+                amount = cents(self.balances[customer.id])
+                customer.outstanding_balance += amount
+                entries.append(CustomerLedgerEntry(
+                    customer_id=customer.id, entry_type=CustomerLedgerEntry.EntryTypeChoices.ADJUSTMENT,
+                    amount=amount, balance_after=customer.outstanding_balance, notes="Generated dataset",
+                ))
+            with transaction.atomic():
+                Customer.objects.bulk_update(customers.values(), ['outstanding_balance'])
+                #the ledger explains every balance, generated ones included
+                CustomerLedgerEntry.objects.bulk_create(entries)
@@ -0,0 +1,166 @@
+import io
+import json
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.apps.billing.benchmarks import SCENARIOS, BenchmarkContext
+from core.apps.common.audit import audit_writer
+from core.apps.common.benchmark import temporary_database, percentile
+from core.apps.common.cache import bump_model_version
+from core.apps.common.views import CachedResponseMixin
+from core.apps.users.models import User
+
+
+def cached_response_models():
+    """
+    The models keying the cached responses of the API's viewsets. User is
+    left out, it keys the auth cache too and a token user is cached in a
+    long-running worker.
+    """
+    from core.urls import router
+
+    models = set()
+    for _, viewset, _ in router.registry:
+        if issubclass(viewset, CachedResponseMixin):
+            models.update(viewset.cache_models or (viewset.queryset.model,))
+    models.discard(User)
+    return models
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API endpoints against a seeded database and compare with stored baselines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help='run only this scenario, can be repeated')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--sales', type=int, default=2000, help='size of the seeded sales history')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--baselines', default=str(settings.BASE_DIR / 'benchmarks' / 'baselines.json'))
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='allowed relative latency regression over the baseline p95')
+        parser.add_argument('--update-baselines', action='store_true',
+                            help='store this run as the new baselines instead of comparing')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write("DEBUG is on, run with MODE=production for representative numbers")
+
+        names = options['scenario'] or list(SCENARIOS)
+        #the test client talks to the in-process app as "testserver"
+        with temporary_database(settings.DATABASES['default'].get('OPTIONS')), \
+                override_settings(ALLOWED_HOSTS=['testserver']):
+            call_command(
+                'generate_dataset', seed=options['seed'], sales=options['sales'],
+                products=500, customers=1000, purchase_orders=200, deposits=200, adjustments=200,
+                stdout=io.StringIO(),
+            )
+            try:
+                results = self._run(names, options)
+            finally:
+                #the buffered audit log belongs to the temporary database
+                audit_writer.flush()
+
+        self._report(results)
+        if options['update_baselines']:
+            self._store(results, options['baselines'])
+            return
+        self._compare(results, options['baselines'], options['tolerance'])
+
+    def _run(self, names, options):
+        user = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark',
+                                        role=User.RoleChoices.ADMIN)
+        client = APIClient()
+        #a real token so authentication is part of every measurement
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        ctx = BenchmarkContext(client, options['seed'])
+        cached_models = cached_response_models()
+
+        results = {}
+        for name in names:
+            iterations = options['iterations']
+            run = SCENARIOS[name](ctx, iterations + options['warmup'])
+            for _ in range(options['warmup']):
+                run()
+
+            latencies = []
+            queries = []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                #measure the uncached path, warmup and earlier iterations would make every read a cache hit
+                bump_model_version(*cached_models)
+                #audit entries buffered by earlier requests would otherwise be written by whichever one is timed
+                audit_writer.flush()
+                with CaptureQueriesContext(connection) as captured:
+                    request_started = time.perf_counter()
+                    response = run()
+                    latencies.append((time.perf_counter() - request_started) * 1000)
+                if response.status_code >= 400:
+                    raise CommandError(f"{name} failed with {response.status_code}: {response.content[:200]}")
+                queries.append(len(captured))
+            elapsed = time.perf_counter() - started
+
+            results[name] = {
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'rps': round(iterations / elapsed, 1),
+                'queries': max(queries),
+            }
+        return results
+
+    def _report(self, results):
+        self.stdout.write(
+            f"{'scenario':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<22}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                f"{result['rps']:>9.1f}{result['queries']:>9}"
+            )
+
+    def _store(self, results, path):
+        try:
+            with open(path) as f:
+                baselines = json.load(f)
+        except FileNotFoundError:
+            baselines = {}
+        baselines.update(results)
+        with open(path, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Baselines written to {path}"))
+
+    def _compare(self, results, path, tolerance):
+        try:
+            with open(path) as f:
+                baselines = json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f"No baselines at {path}, run with --update-baselines first")
+
+        failures = []
+        for name, result in results.items():
+            baseline = baselines.get(name)
+            if baseline is None:
+                self.stdout.write(self.style.WARNING(f"{name}: no baseline"))
+                continue
+
+            #query counts are deterministic so any increase is a regression
+            if result['queries'] > baseline['queries']:
+                failures.append(f"{name}: {result['queries']} queries per request, budget {baseline['queries']}")
+
+            budget = baseline['p95_ms'] * (1 + tolerance)
+            if result['p95_ms'] > budget:
+                failures.append(f"{name}: p95 {result['p95_ms']:.2f} ms, budget {budget:.2f} ms")
+
+        if failures:
+            raise CommandError("Performance budget exceeded:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("All scenarios within budget"))
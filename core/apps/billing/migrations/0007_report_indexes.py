@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_archive'),
+        ('products', '0003_alter_inventoryadjustment_quantity_and_more'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedsalestransactionitem',
+            index=models.Index(fields=['transaction', 'product', 'quantity', 'unit_price', 'discount_amount'], name='billing_archive_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salestransaction',
+            index=models.Index(fields=['transaction_date', 'total_amount'], name='billing_sale_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salestransactionitem',
+            index=models.Index(fields=['transaction', 'product', 'quantity', 'unit_price', 'discount_amount'], name='billing_sale_item_report_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:26
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_loyalty'),
+        ('products', '0003_alter_inventoryadjustment_quantity_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedproductreturnitem',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='archivedsalestransactionitem',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='archivedsalestransactionitem',
+            name='tax_inclusive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='archivedsalestransactionitem',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=7),
+        ),
+        migrations.AddField(
+            model_name='productreturnitem',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='salestransactionitem',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='salestransactionitem',
+            name='tax_inclusive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='salestransactionitem',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=7),
+        ),
+        migrations.CreateModel(
+            name='TaxRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('name', models.CharField(max_length=100)),
+                ('rate', models.DecimalField(decimal_places=4, max_digits=7, validators=[django.core.validators.MinValueValidator(0)])),
+                ('mode', models.CharField(choices=[('Exclusive', 'Added to the price'), ('Inclusive', 'Included in the price')], default='Exclusive', max_length=10)),
+                ('rounding', models.CharField(choices=[('Half up', 'Half up'), ('Half even', 'Half even'), ('Up', 'Up'), ('Down', 'Down')], default='Half up', max_length=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tax_rules', to='products.category')),
+                ('created_by', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_created', to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tax_rules', to='products.product')),
+                ('updated_by', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_updated', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:31
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0009_tax_rules'),
+        ('users', '0003_ledger_user_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terminal', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('Open', 'Open'), ('Closed', 'Closed')], default='Open', max_length=10)),
+                ('opening_float', models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)])),
+                ('counted_cash', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('opened_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShiftReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productreturn',
+            index=models.Index(fields=['created_by', 'return_date'], name='billing_return_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salestransaction',
+            index=models.Index(fields=['created_by', 'transaction_date'], name='billing_sale_user_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='shifts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='shiftreport',
+            name='shift',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='report', to='billing.shift'),
+        ),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'Open')), fields=('user',), name='billing_shift_one_open_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'Open')), fields=('terminal',), name='billing_shift_one_open_per_terminal'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_shifts'),
+        ('products', '0003_alter_inventoryadjustment_quantity_and_more'),
+        ('users', '0003_ledger_user_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesFact',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sale_id', models.BigIntegerField()),
+                ('payment_method', models.CharField(choices=[('Cash', 'Cash'), ('Online', 'Online'), ('Credit', 'Credit')], max_length=10)),
+                ('sold_at', models.DateTimeField()),
+                ('sale_date', models.DateField()),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('weekday', models.PositiveSmallIntegerField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('tax_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cost', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('returned_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('returned_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('cashier', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('category', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='products.category')),
+                ('customer', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='users.customer')),
+                ('product', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='products.product')),
+                ('supplier', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='products.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sale_id'], name='billing_fact_sale_idx'), models.Index(fields=['sale_date', 'category'], name='billing_fact_date_category_idx'), models.Index(fields=['supplier', 'sale_date'], name='billing_fact_supplier_idx'), models.Index(fields=['product', 'sale_date'], name='billing_fact_product_idx'), models.Index(fields=['customer', 'sale_date'], name='billing_fact_customer_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.core.validators import MinValueValidator
 from core.apps.common.models import (
@@ -5,7 +6,7 @@ from core.apps.common.models import (
     AuditModelMixin,
 )
 from core.apps.users.models import Customer
-from core.apps.products.models import Product
+from core.apps.products.models import Category, Product, Supplier
 
 
 class SalesTransaction(TimeStampModelMixin, AuditModelMixin):
@@ -23,8 +24,18 @@ class SalesTransaction(TimeStampModelMixin, AuditModelMixin):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2)
     change_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    #loyalty points spent on this sale, their value is part of discount_amount
+    points_redeemed = models.PositiveIntegerField(default=0)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            #period scans of the reports, the heatmap reads nothing else
+            models.Index(fields=['transaction_date', 'total_amount'], name='billing_sale_date_idx'),
+            #a cashier's sales during a shift, for the Z-report
+            models.Index(fields=['created_by', 'transaction_date'], name='billing_sale_user_date_idx'),
+        ]
+    
     def __str__(self):
         return f"Sale-{self.id}"
 
@@ -35,6 +46,19 @@ class SalesTransactionItem(models.Model):
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)])
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    #the tax rule applied at checkout, kept so later rule changes do not alter the sale
+    tax_rate = models.DecimalField(max_digits=7, decimal_places=4, default=0)
+    tax_inclusive = models.BooleanField(default=False)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    
+    class Meta:
+        indexes = [
+            #covers the report aggregates, which read the items of a period's sales without touching the table
+            models.Index(
+                fields=['transaction', 'product', 'quantity', 'unit_price', 'discount_amount'],
+                name='billing_sale_item_report_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
@@ -57,6 +81,12 @@ class ProductReturn(TimeStampModelMixin, AuditModelMixin):
     refund_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            #a cashier's returns during a shift, for the Z-report
+            models.Index(fields=['created_by', 'return_date'], name='billing_return_user_date_idx'),
+        ]
+    
     def __str__(self):
         return f"Return for Sale-{self.transaction.id}"
 
@@ -66,6 +96,8 @@ class ProductReturnItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    #share of the sold line's tax given back
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
@@ -73,3 +105,275 @@ class ProductReturnItem(models.Model):
     @property
     def total_price(self):
         return self.quantity * self.unit_price
+
+
+# loyalty models below
+class LoyaltyRule(TimeStampModelMixin, AuditModelMixin):
+    """
+    Loyalty points earned per 1.00 spent, times multiplier. A rule with a
+    category covers that category's products only, one with valid dates
+    only the sales made on those days. The most specific matching rule
+    applies to each sold item (see core.apps.billing.loyalty).
+    """
+    name = models.CharField(max_length=100)
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True, related_name='loyalty_rules'
+    )
+    points_per_unit = models.DecimalField(max_digits=8, decimal_places=4, validators=[MinValueValidator(0)])
+    multiplier = models.DecimalField(max_digits=5, decimal_places=2, default=1, validators=[MinValueValidator(0)])
+    valid_from = models.DateField(null=True, blank=True)
+    valid_until = models.DateField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.name
+
+
+class LoyaltyCursor(models.Model):
+    """How far loyalty accrual got through the sales or the returns"""
+    name = models.CharField(max_length=20, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} up to #{self.last_id}"
+
+
+# tax models below
+class TaxRule(TimeStampModelMixin, AuditModelMixin):
+    """
+    Tax rate of a product, of a category's products, or of every product
+    when it names neither; the most specific active rule applies. Inclusive
+    rates are part of the selling price, exclusive ones are added to it.
+    Each line's tax is rounded on its own, the way rounding says.
+    Compiled into an in-process lookup by core.apps.billing.tax.
+    """
+    class ModeChoices(models.TextChoices):
+        EXCLUSIVE = 'Exclusive', 'Added to the price'
+        INCLUSIVE = 'Inclusive', 'Included in the price'
+    
+    class RoundingChoices(models.TextChoices):
+        HALF_UP = 'Half up', 'Half up'
+        HALF_EVEN = 'Half even', 'Half even'
+        UP = 'Up', 'Up'
+        DOWN = 'Down', 'Down'
+    
+    name = models.CharField(max_length=100)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='tax_rules')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='tax_rules')
+    #percent
+    rate = models.DecimalField(max_digits=7, decimal_places=4, validators=[MinValueValidator(0)])
+    mode = models.CharField(max_length=10, choices=ModeChoices.choices, default=ModeChoices.EXCLUSIVE)
+    rounding = models.CharField(max_length=10, choices=RoundingChoices.choices, default=RoundingChoices.HALF_UP)
+    is_active = models.BooleanField(default=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.rate}%)"
+
+
+# shift models below
+class Shift(models.Model):
+    """
+    A cashier's session at a terminal, from opening the drawer with
+    opening_float to counting it at close. Everything the user rang up in
+    between belongs to the shift (see core.apps.billing.shifts).
+    """
+    class StatusChoices(models.TextChoices):
+        OPEN = 'Open', 'Open'
+        CLOSED = 'Closed', 'Closed'
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='shifts')
+    terminal = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.OPEN)
+    opening_float = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)])
+    counted_cash = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    opened_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(status='Open'), name='billing_shift_one_open_per_user'
+            ),
+            models.UniqueConstraint(
+                fields=['terminal'], condition=models.Q(status='Open'), name='billing_shift_one_open_per_terminal'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Shift-{self.id} at {self.terminal}"
+
+
+class ShiftReportQuerySet(models.QuerySet):
+    """Z-reports are final, reprints read them as they were printed"""
+
+    def update(self, **kwargs):
+        raise TypeError("Shift reports cannot be changed")
+
+    def delete(self):
+        raise TypeError("Shift reports cannot be changed")
+
+
+class ShiftReport(models.Model):
+    """The Z-report of a closed shift, stored as served"""
+    shift = models.OneToOneField(Shift, on_delete=models.PROTECT, related_name='report')
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShiftReportQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Shift reports cannot be changed")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Shift reports cannot be changed")
+
+    def __str__(self):
+        return f"Z-report of Shift-{self.shift_id}"
+
+
+# archive models below: closed periods moved out of the live tables by
+# `manage.py archive_sales`, with their ids, columns and audit fields kept
+class ArchivedSalesTransaction(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, null=True, related_name='+')
+    transaction_date = models.DateTimeField(db_index=True)
+    payment_method = models.CharField(max_length=10, choices=SalesTransaction.PaymentMethodChoices.choices)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2)
+    change_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    points_redeemed = models.PositiveIntegerField(default=0)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    updated_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Sale-{self.id} (archived)"
+
+
+class ArchivedSalesTransactionItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    transaction = models.ForeignKey(ArchivedSalesTransaction, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='+')
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_rate = models.DecimalField(max_digits=7, decimal_places=4, default=0)
+    tax_inclusive = models.BooleanField(default=False)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['transaction', 'product', 'quantity', 'unit_price', 'discount_amount'],
+                name='billing_archive_item_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product.name} (archived)"
+
+
+class ArchivedProductReturn(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    transaction = models.ForeignKey(ArchivedSalesTransaction, on_delete=models.CASCADE, related_name='returns')
+    return_date = models.DateTimeField(db_index=True)
+    reason = models.TextField()
+    refund_method = models.CharField(max_length=10, choices=ProductReturn.RefundMethodChoices.choices)
+    refund_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    updated_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Return for Sale-{self.transaction_id} (archived)"
+
+
+class ArchivedProductReturnItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    product_return = models.ForeignKey(ArchivedProductReturn, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='+')
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product.name} (archived)"
+
+
+# analytics models below
+class SalesFact(models.Model):
+    """
+    One row per sale line, live or archived, with everything analytics
+    group by copied in: category, supplier, customer, cashier, date parts,
+    purchase cost and what came back. Rebuilt per sale by the
+    billing.refresh_sales_facts task after every sale and return, filled
+    for history by `manage.py backfill_sales_facts` (see
+    core.apps.billing.facts). No foreign key constraints, facts outlive
+    archiving and are never joined to find a sale.
+    """
+    #the sale item's id
+    id = models.BigIntegerField(primary_key=True)
+    sale_id = models.BigIntegerField()
+    product = models.ForeignKey(
+        Product, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+'
+    )
+    category = models.ForeignKey(
+        Category, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+'
+    )
+    supplier = models.ForeignKey(
+        Supplier, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+'
+    )
+    customer = models.ForeignKey(
+        Customer, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, related_name='+'
+    )
+    cashier = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True,
+        related_name='+',
+    )
+    payment_method = models.CharField(max_length=10, choices=SalesTransaction.PaymentMethodChoices.choices)
+    sold_at = models.DateTimeField()
+    #local date parts of sold_at, weekday 1 is Monday
+    sale_date = models.DateField()
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    weekday = models.PositiveSmallIntegerField()
+    hour = models.PositiveSmallIntegerField()
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    #quantity x unit_price - discount_amount
+    line_total = models.DecimalField(max_digits=12, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    #purchase price in effect when sold, and times quantity
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    cost = models.DecimalField(max_digits=12, decimal_places=2)
+    returned_quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    returned_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            #rebuilding a sale's facts
+            models.Index(fields=['sale_id'], name='billing_fact_sale_idx'),
+            #period slices by category, the most common dashboard cut
+            models.Index(fields=['sale_date', 'category'], name='billing_fact_date_category_idx'),
+            #margin by supplier, sales and returns by product, baskets by customer
+            models.Index(fields=['supplier', 'sale_date'], name='billing_fact_supplier_idx'),
+            models.Index(fields=['product', 'sale_date'], name='billing_fact_product_idx'),
+            models.Index(fields=['customer', 'sale_date'], name='billing_fact_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Fact of Sale-{self.sale_id} line #{self.id}"
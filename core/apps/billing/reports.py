@@ -0,0 +1,193 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+
+from core.apps.billing.models import (
+    SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem,
+    ArchivedSalesTransaction, ArchivedSalesTransactionItem, ArchivedProductReturn, ArchivedProductReturnItem,
+)
+from core.apps.common.serializers import day_start, decimal_to_string
+from core.apps.products.models import Category, Product
+
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+#sums of many lines outgrow the 10 digits of the columns they add up
+AMOUNT = DecimalField(max_digits=20, decimal_places=4)
+
+#live tables and their archive counterparts, a period can span both
+SALE_MODELS = (SalesTransaction, ArchivedSalesTransaction)
+SALE_ITEM_MODELS = (SalesTransactionItem, ArchivedSalesTransactionItem)
+RETURN_MODELS = (ProductReturn, ArchivedProductReturn)
+RETURN_ITEM_MODELS = (ProductReturnItem, ArchivedProductReturnItem)
+
+
+def report_period(date_from=None, date_to=None):
+    """
+    [start, end) datetimes of the local days date_from through date_to,
+    the last DEFAULT_DAYS days up to today when they are not given
+    """
+    today = timezone.localdate()
+    date_to = date_to or today
+    date_from = date_from or min(date_to, today) - timedelta(days=settings.REPORTS['DEFAULT_DAYS'] - 1)
+    return day_start(date_from), day_start(date_to + timedelta(days=1))
+
+
+def _grouped(models, date_lookup, start, end, groups, **aggregates):
+    """
+    Run one grouped aggregate per model over the rows whose date_lookup
+    falls in [start, end) and add the results up: {group: {name: total}}.
+    groups maps each group name to a field path or an expression.
+    """
+    #values() names plain fields after their path, expressions after their group
+    columns = [path if isinstance(path, str) else name for name, path in groups.items()]
+    fields = [path for path in groups.values() if isinstance(path, str)]
+    expressions = {name: path for name, path in groups.items() if not isinstance(path, str)}
+    totals = {}
+    for model in models:
+        rows = (
+            model.objects.filter(**{f'{date_lookup}__gte': start, f'{date_lookup}__lt': end})
+            .values(*fields, **expressions).annotate(**aggregates).order_by()
+        )
+        for row in rows:
+            group = tuple(row.pop(column) for column in columns)
+            total = totals.setdefault(group, dict.fromkeys(aggregates, 0))
+            for name, value in row.items():
+                total[name] += value or 0
+    return totals
+
+
+def _sold(start, end, groups):
+    return _grouped(
+        SALE_ITEM_MODELS, 'transaction__transaction_date', start, end, groups,
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('unit_price') - F('discount_amount'), output_field=AMOUNT),
+    )
+
+
+def _returned(start, end, groups):
+    #returns count against the period of the sale they undo
+    return _grouped(
+        RETURN_ITEM_MODELS, 'product_return__transaction__transaction_date', start, end, groups,
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('unit_price'), output_field=AMOUNT),
+    )
+
+
+def _net(sold, returned, name):
+    """{group: total} of name sold minus returned"""
+    return {
+        group: sold.get(group, {}).get(name, 0) - returned.get(group, {}).get(name, 0)
+        for group in sold.keys() | returned.keys()
+    }
+
+
+def _money(value):
+    return decimal_to_string(Decimal(value).quantize(Decimal('0.01')))
+
+
+def top_products(start, end, limit, order_by='revenue'):
+    """The limit best selling products of the period, by net revenue or net quantity"""
+    groups = {'product': 'product_id'}
+    sold, returned = _sold(start, end, groups), _returned(start, end, groups)
+    quantities, revenues = _net(sold, returned, 'units'), _net(sold, returned, 'revenue')
+    ranking = revenues if order_by == 'revenue' else quantities
+    ranked = sorted(ranking, key=lambda group: (-ranking[group], group))[:limit]
+
+    products = Product.objects.in_bulk([product_id for product_id, in ranked])
+    return [
+        {
+            'product': product_id,
+            'name': products[product_id].name,
+            'sku': products[product_id].sku,
+            'quantity': _money(quantities[group]),
+            'revenue': _money(revenues[group]),
+        }
+        for group in ranked
+        for product_id in group
+    ]
+
+
+def category_mix(start, end):
+    """Net revenue per category and its share of the period's net revenue, largest first"""
+    groups = {'category': 'product__category_id'}
+    sold, returned = _sold(start, end, groups), _returned(start, end, groups)
+    quantities, revenues = _net(sold, returned, 'units'), _net(sold, returned, 'revenue')
+    total = sum(revenues.values())
+    names = dict(Category.objects.filter(id__in=[category_id for category_id, in revenues]).values_list('id', 'name'))
+    return [
+        {
+            'category': category_id,
+            'name': names[category_id],
+            'quantity': _money(quantities[group]),
+            'revenue': _money(revenues[group]),
+            'share': _money(Decimal(revenues[group]) * 100 / total if total else 0),
+        }
+        for group in sorted(revenues, key=lambda group: (-revenues[group], group))
+        for category_id in group
+    ]
+
+
+def heatmap(start, end):
+    """
+    Sales per weekday and local hour of the period, as rows Monday through
+    Sunday of 24 hourly cells: transaction counts and revenue net of refunds
+    """
+    def hour_of(date_lookup):
+        return {'weekday': ExtractIsoWeekDay(date_lookup), 'hour': ExtractHour(date_lookup)}
+
+    sales = _grouped(
+        SALE_MODELS, 'transaction_date', start, end, hour_of('transaction_date'),
+        transactions=Count('id'), revenue=Sum('total_amount', output_field=AMOUNT),
+    )
+    refunds = _grouped(
+        RETURN_MODELS, 'transaction__transaction_date', start, end, hour_of('transaction__transaction_date'),
+        revenue=Sum('refund_amount', output_field=AMOUNT),
+    )
+    revenues = _net(sales, refunds, 'revenue')
+    return {
+        'weekdays': list(WEEKDAYS),
+        'transactions': [
+            [sales.get((weekday, hour), {}).get('transactions', 0) for hour in range(24)]
+            for weekday in range(1, 8)
+        ],
+        'revenue': [
+            [_money(revenues.get((weekday, hour), 0)) for hour in range(24)]
+            for weekday in range(1, 8)
+        ],
+    }
+
+
+def cached_report(name, params, build):
+    """
+    Serve a report from the response cache for CACHE_SECONDS. Once it is
+    stale, the first request to notice rebuilds it while concurrent ones
+    keep getting the stale copy, so a dashboard left open on many screens
+    runs the aggregates once per interval rather than once per viewer.
+    """
+    response_cache = caches['responses']
+    key = f"report:{name}:" + urlencode(sorted((param, str(value)) for param, value in params.items()))
+    lock_key = f"{key}:rebuilding"
+    cached = response_cache.get(key)
+    now = time.time()
+    if cached is not None:
+        fresh_until, data = cached
+        if fresh_until > now or not response_cache.add(lock_key, True, settings.REPORTS['REBUILD_TIMEOUT']):
+            return data
+
+    try:
+        data = build()
+        ttl = settings.REPORTS['CACHE_SECONDS']
+        #kept past its freshness so there is something to serve while it is rebuilt
+        response_cache.set(key, (now + ttl, data), ttl + settings.REPORTS['STALE_SECONDS'])
+    finally:
+        if cached is not None:
+            response_cache.delete(lock_key)
+    return data
@@ -1,17 +1,32 @@
+from django.conf import settings
 from rest_framework import serializers
-from core.apps.billing.models import SalesTransactionItem, SalesTransaction, ProductReturnItem, ProductReturn
+from core.apps.common.serializers import (
+    BulkPrimaryKeyRelatedField, BulkRelatedListSerializer, ValuesSerializer,
+    DateRangeQuerySerializer, decimal_to_string, rate_to_string, datetime_to_string
+)
+from core.apps.products.models import Product
+from core.apps.billing.archive import return_window_start
+from core.apps.billing.loyalty import points_value
+from core.apps.billing.models import (
+    SalesTransactionItem, SalesTransaction, ProductReturnItem, ProductReturn,
+    ArchivedSalesTransaction, ArchivedSalesTransactionItem, ArchivedProductReturn, ArchivedProductReturnItem,
+    LoyaltyRule, TaxRule, Shift,
+)
 
 
 class SalesTransactionItemSerializer(serializers.ModelSerializer):
+    product = BulkPrimaryKeyRelatedField(queryset=Product.objects.all())
     product_name = serializers.CharField(source='product.name', read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
         model = SalesTransactionItem
+        list_serializer_class = BulkRelatedListSerializer
         fields = [
             'id', 'product', 'product_name', 'quantity', 'unit_price', 
-            'discount_amount', 'total_price'
+            'discount_amount', 'total_price', 'tax_rate', 'tax_inclusive', 'tax_amount'
         ]
+        read_only_fields = ['tax_rate', 'tax_inclusive', 'tax_amount']
     
     def validate(self, data):
         if data.get('discount_amount') and data.get('unit_price') and data.get('quantity'):
@@ -22,14 +37,17 @@ class SalesTransactionItemSerializer(serializers.ModelSerializer):
 
 
 class ProductReturnItemSerializer(serializers.ModelSerializer):
+    product = BulkPrimaryKeyRelatedField(queryset=Product.objects.all())
     product_name = serializers.CharField(source='product.name', read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
         model = ProductReturnItem
+        list_serializer_class = BulkRelatedListSerializer
         fields = [
-            'id', 'product', 'product_name', 'quantity', 'unit_price', 'total_price'
+            'id', 'product', 'product_name', 'quantity', 'unit_price', 'total_price', 'tax_amount'
         ]
+        read_only_fields = ['tax_amount']
 
 
 class ProductReturnSerializer(serializers.ModelSerializer):
@@ -51,6 +69,12 @@ class ProductReturnSerializer(serializers.ModelSerializer):
         if not items_data:
             raise serializers.ValidationError("Return must have at least one item")
         
+        #sales outside the window are closed and may already be archived
+        if transaction and transaction.transaction_date < return_window_start():
+            raise serializers.ValidationError(
+                f"The {settings.RETURN_WINDOW_DAYS} day return window for this transaction has passed"
+            )
+        
         # Validate that credit refunds require a customer
         refund_method = data.get('refund_method')
         if refund_method == ProductReturn.RefundMethodChoices.CREDIT:
@@ -69,10 +93,10 @@ class ProductReturnSerializer(serializers.ModelSerializer):
             product_id__in=products_id_return
         )
         
-        #create mapping of product -> quantity sold
+        #create mapping of product -> quantity sold, a product may be on several lines
         sold_quantities = {}
         for item in sold_items:
-            sold_quantities[item.product_id] = item.quantity
+            sold_quantities[item.product_id] = sold_quantities.get(item.product_id, 0) + item.quantity
             
         #get all previous returns for this transaction
         previous_returns = ProductReturn.objects.filter(transaction=transaction)
@@ -122,17 +146,22 @@ class SalesTransactionSerializer(serializers.ModelSerializer):
     items = SalesTransactionItemSerializer(many=True)
     returns = ProductReturnSerializer(many=True, read_only=True)
     customer_name = serializers.CharField(source='customer.name', read_only=True, allow_null=True)
+    redeem_points = serializers.IntegerField(
+        min_value=1, required=False, write_only=True,
+        help_text="Loyalty points of the customer to spend, taken off the total as a discount",
+    )
     
     class Meta:
         model = SalesTransaction
         fields = [
             'id', 'customer', 'customer_name', 'transaction_date', 
             'payment_method', 'subtotal', 'discount_amount', 'tax_amount', 
-            'total_amount', 'amount_paid', 'change_amount', 'notes', 'items', 'returns'
+            'total_amount', 'amount_paid', 'change_amount', 'points_redeemed', 'redeem_points',
+            'notes', 'items', 'returns'
         ]
         read_only_fields = [
             'transaction_date', 'subtotal', 'tax_amount',
-            'total_amount', 'change_amount'
+            'total_amount', 'change_amount', 'points_redeemed'
         ]
     
     def validate(self, data):
@@ -145,4 +174,253 @@ class SalesTransactionSerializer(serializers.ModelSerializer):
             if not data.get('customer'):
                 raise serializers.ValidationError("Customer is required for credit payments")
         
+        #whether the customer has the points is checked when they are taken, at checkout
+        if data.get('redeem_points'):
+            if not data.get('customer'):
+                raise serializers.ValidationError("Customer is required to redeem loyalty points")
+            subtotal = sum(
+                item['quantity'] * item['unit_price'] - item.get('discount_amount', 0) for item in data.get('items', [])
+            )
+            if data.get('discount_amount', 0) + points_value(data['redeem_points']) > subtotal:
+                raise serializers.ValidationError("Redeemed points and discount cannot exceed the transaction subtotal")
+        
+        return data
+
+
+class SalesTransactionItemValuesSerializer(ValuesSerializer):
+    model = SalesTransactionItem
+    fields = (
+        ('id', 'id', None),
+        ('product', 'product_id', None),
+        ('product_name', 'product__name', None),
+        ('quantity', 'quantity', decimal_to_string),
+        ('unit_price', 'unit_price', decimal_to_string),
+        ('discount_amount', 'discount_amount', decimal_to_string),
+        ('total_price', lambda row: row['quantity'] * row['unit_price'] - row['discount_amount'], decimal_to_string),
+        ('tax_rate', 'tax_rate', rate_to_string),
+        ('tax_inclusive', 'tax_inclusive', None),
+        ('tax_amount', 'tax_amount', decimal_to_string),
+    )
+
+
+class ProductReturnItemValuesSerializer(ValuesSerializer):
+    model = ProductReturnItem
+    fields = (
+        ('id', 'id', None),
+        ('product', 'product_id', None),
+        ('product_name', 'product__name', None),
+        ('quantity', 'quantity', decimal_to_string),
+        ('unit_price', 'unit_price', decimal_to_string),
+        ('total_price', lambda row: row['quantity'] * row['unit_price'], decimal_to_string),
+        ('tax_amount', 'tax_amount', decimal_to_string),
+    )
+
+
+class ProductReturnValuesSerializer(ValuesSerializer):
+    model = ProductReturn
+    fields = (
+        ('id', 'id', None),
+        ('transaction', 'transaction_id', None),
+        ('return_date', 'return_date', datetime_to_string),
+        ('reason', 'reason', None),
+        ('refund_amount', 'refund_amount', decimal_to_string),
+        ('refund_method', 'refund_method', None),
+        ('notes', 'notes', None),
+    )
+    nested = (
+        ('items', ProductReturnItemValuesSerializer, 'product_return_id'),
+    )
+
+
+class SalesTransactionValuesSerializer(ValuesSerializer):
+    """Values based equivalent of SalesTransactionSerializer for the read endpoints"""
+    model = SalesTransaction
+    fields = (
+        ('id', 'id', None),
+        ('customer', 'customer_id', None),
+        ('customer_name', 'customer__name', None),
+        ('transaction_date', 'transaction_date', datetime_to_string),
+        ('payment_method', 'payment_method', None),
+        ('subtotal', 'subtotal', decimal_to_string),
+        ('discount_amount', 'discount_amount', decimal_to_string),
+        ('tax_amount', 'tax_amount', decimal_to_string),
+        ('total_amount', 'total_amount', decimal_to_string),
+        ('amount_paid', 'amount_paid', decimal_to_string),
+        ('change_amount', 'change_amount', decimal_to_string),
+        ('points_redeemed', 'points_redeemed', None),
+        ('notes', 'notes', None),
+    )
+    nested = (
+        ('items', SalesTransactionItemValuesSerializer, 'transaction_id'),
+        ('returns', ProductReturnValuesSerializer, 'transaction_id'),
+    )
+
+
+class ArchivedSalesTransactionItemValuesSerializer(SalesTransactionItemValuesSerializer):
+    model = ArchivedSalesTransactionItem
+
+
+class ArchivedProductReturnItemValuesSerializer(ProductReturnItemValuesSerializer):
+    model = ArchivedProductReturnItem
+
+
+class ArchivedProductReturnValuesSerializer(ProductReturnValuesSerializer):
+    model = ArchivedProductReturn
+    nested = (
+        ('items', ArchivedProductReturnItemValuesSerializer, 'product_return_id'),
+    )
+
+
+class ArchivedSalesTransactionValuesSerializer(SalesTransactionValuesSerializer):
+    """Archived sales, rendered exactly like live ones"""
+    model = ArchivedSalesTransaction
+    nested = (
+        ('items', ArchivedSalesTransactionItemValuesSerializer, 'transaction_id'),
+        ('returns', ArchivedProductReturnValuesSerializer, 'transaction_id'),
+    )
+
+
+class ArchivedProductReturnSerializer(ProductReturnSerializer):
+    """Read-only, describes the archive endpoints in the schema"""
+    class Meta(ProductReturnSerializer.Meta):
+        model = ArchivedProductReturn
+        read_only_fields = ProductReturnSerializer.Meta.fields
+
+
+class ArchivedSalesTransactionSerializer(SalesTransactionSerializer):
+    """Read-only, describes the archive endpoints in the schema"""
+    returns = ArchivedProductReturnSerializer(many=True, read_only=True)
+
+    class Meta(SalesTransactionSerializer.Meta):
+        model = ArchivedSalesTransaction
+        read_only_fields = SalesTransactionSerializer.Meta.fields
+
+
+class LoyaltyRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LoyaltyRule
+        fields = [
+            'id', 'name', 'category', 'points_per_unit', 'multiplier',
+            'valid_from', 'valid_until', 'is_active'
+        ]
+    
+    def validate(self, data):
+        valid_from = data.get('valid_from', getattr(self.instance, 'valid_from', None))
+        valid_until = data.get('valid_until', getattr(self.instance, 'valid_until', None))
+        if valid_from and valid_until and valid_from > valid_until:
+            raise serializers.ValidationError("valid_from must not be after valid_until")
         return data
+
+
+class TaxRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TaxRule
+        fields = ['id', 'name', 'product', 'category', 'rate', 'mode', 'rounding', 'is_active']
+    
+    def validate(self, data):
+        product = data.get('product', getattr(self.instance, 'product', None))
+        category = data.get('category', getattr(self.instance, 'category', None))
+        if product and category:
+            raise serializers.ValidationError("A tax rule applies to a product or to a category, not both")
+        return data
+
+
+class ShiftSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Shift
+        fields = ['id', 'user', 'terminal', 'status', 'opening_float', 'counted_cash', 'opened_at', 'closed_at']
+        read_only_fields = ['user', 'status', 'counted_cash', 'opened_at', 'closed_at']
+
+
+class ShiftCloseSerializer(serializers.Serializer):
+    counted_cash = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0, help_text="Cash found in the drawer"
+    )
+
+
+class ZReportSalesSerializer(serializers.Serializer):
+    payment_method = serializers.CharField()
+    transactions = serializers.IntegerField()
+    gross = serializers.DecimalField(max_digits=20, decimal_places=2, help_text="Item totals before the sale discount")
+    discounts = serializers.DecimalField(max_digits=20, decimal_places=2)
+    tax = serializers.DecimalField(max_digits=20, decimal_places=2)
+    net = serializers.DecimalField(max_digits=20, decimal_places=2)
+    points_redeemed = serializers.IntegerField()
+
+
+class ZReportRefundsSerializer(serializers.Serializer):
+    refund_method = serializers.CharField()
+    returns = serializers.IntegerField()
+    refunded = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
+class ZReportTotalsSerializer(serializers.Serializer):
+    transactions = serializers.IntegerField()
+    gross = serializers.DecimalField(max_digits=20, decimal_places=2)
+    discounts = serializers.DecimalField(max_digits=20, decimal_places=2)
+    tax = serializers.DecimalField(max_digits=20, decimal_places=2)
+    net = serializers.DecimalField(max_digits=20, decimal_places=2)
+    refunded = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
+class ZReportCashSerializer(serializers.Serializer):
+    opening_float = serializers.DecimalField(max_digits=20, decimal_places=2)
+    expected = serializers.DecimalField(
+        max_digits=20, decimal_places=2, help_text="Float plus cash sales, deposits and payments, less cash refunds"
+    )
+    counted = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+    difference = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+
+
+class ZReportSerializer(serializers.Serializer):
+    """Describes the shift report in the schema, the report itself is built in billing.shifts"""
+    shift = serializers.IntegerField()
+    user = serializers.IntegerField()
+    terminal = serializers.CharField()
+    opened_at = serializers.DateTimeField()
+    closed_at = serializers.DateTimeField(allow_null=True)
+    sales = ZReportSalesSerializer(many=True)
+    refunds = ZReportRefundsSerializer(many=True)
+    deposits = serializers.DecimalField(max_digits=20, decimal_places=2)
+    credit_payments = serializers.DecimalField(max_digits=20, decimal_places=2)
+    totals = ZReportTotalsSerializer()
+    cash = ZReportCashSerializer()
+
+
+# report serializers below: they describe the /reports/ endpoints in the
+# schema, the reports themselves are built as plain data in billing.reports
+class ReportQuerySerializer(DateRangeQuerySerializer):
+    date_from = serializers.DateField(required=False, help_text="First day, inclusive. Defaults to the last 7 days.")
+    date_to = serializers.DateField(required=False, help_text="Last day, inclusive. Defaults to today.")
+
+
+class TopProductsQuerySerializer(ReportQuerySerializer):
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=settings.REPORTS['MAX_LIMIT'])
+    order_by = serializers.ChoiceField(choices=['revenue', 'quantity'], required=False)
+
+
+class TopProductSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    name = serializers.CharField()
+    sku = serializers.CharField()
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=2, help_text="Sold minus returned")
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, help_text="Sold minus returned")
+
+
+class CategoryMixSerializer(serializers.Serializer):
+    category = serializers.IntegerField()
+    name = serializers.CharField()
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=2)
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2)
+    share = serializers.DecimalField(max_digits=5, decimal_places=2, help_text="Percent of the period's net revenue")
+
+
+class HeatmapSerializer(serializers.Serializer):
+    weekdays = serializers.ListField(child=serializers.CharField())
+    transactions = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField()), help_text="One row per weekday, one cell per hour"
+    )
+    revenue = serializers.ListField(
+        child=serializers.ListField(child=serializers.DecimalField(max_digits=20, decimal_places=2)),
+        help_text="Net of refunds, one row per weekday, one cell per hour",
+    )
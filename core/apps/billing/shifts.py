@@ -0,0 +1,162 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Greatest
+from django.utils import timezone
+
+from core.apps.billing.models import SalesTransaction, ProductReturn, Shift, ShiftReport
+from core.apps.common.serializers import decimal_to_string, datetime_to_string
+from core.apps.users.models import CustomerLedgerEntry
+
+
+#sums of a shift's rows outgrow the 10 digits of the columns they add up
+AMOUNT = DecimalField(max_digits=20, decimal_places=2)
+
+COLLECTED = (CustomerLedgerEntry.EntryTypeChoices.DEPOSIT, CustomerLedgerEntry.EntryTypeChoices.PAYMENT)
+
+ZERO = Value(Decimal(0), output_field=AMOUNT)
+
+
+def _cash_taken():
+    """
+    Cash a sale put in the drawer: what was paid less the change and less
+    the store credit that checkout added to amount_paid. The credit is the
+    part of the sale's ledger charge that is not still owed.
+    """
+    charge = CustomerLedgerEntry.objects.filter(
+        customer_id=OuterRef('customer_id'),
+        entry_type=CustomerLedgerEntry.EntryTypeChoices.SALE,
+        reference=Concat(Value('Sale-'), OuterRef('id'), output_field=CharField()),
+    ).values('amount')[:1]
+    owed = Greatest(F('total_amount') - F('amount_paid'), ZERO, output_field=AMOUNT)
+    credit = Greatest(Coalesce(Subquery(charge), ZERO) - owed, ZERO, output_field=AMOUNT)
+    return F('amount_paid') - F('change_amount') - credit
+
+
+def _money(value):
+    return decimal_to_string(Decimal(value or 0))
+
+
+def _window(shift, end, date_field):
+    return {'created_by_id': shift.user_id, f'{date_field}__gte': shift.opened_at, f'{date_field}__lte': end}
+
+
+def open_shift(user, terminal, opening_float=0):
+    """Open a shift for user at terminal, neither may have another one open"""
+    try:
+        with transaction.atomic():
+            return Shift.objects.create(user=user, terminal=terminal, opening_float=opening_float)
+    except IntegrityError:
+        raise ValueError(f"{user} or terminal {terminal} already has an open shift")
+
+
+def z_report(shift, end=None, counted_cash=None):
+    """
+    Totals of what the shift's user rang up between opening and end, in
+    three grouped queries however busy the shift was: sales by payment
+    method, returns by refund method and account deposits and payments.
+    Deposits and payments are taken at the counter, in cash.
+    """
+    end = end or shift.closed_at or timezone.now()
+    sales = {
+        row['payment_method']: row
+        for row in SalesTransaction.objects.filter(**_window(shift, end, 'transaction_date'))
+        .values('payment_method')
+        .annotate(
+            transactions=Count('id'),
+            gross=Sum('subtotal', output_field=AMOUNT),
+            discounts=Sum('discount_amount', output_field=AMOUNT),
+            tax=Sum('tax_amount', output_field=AMOUNT),
+            net=Sum('total_amount', output_field=AMOUNT),
+            cash=Sum(_cash_taken(), output_field=AMOUNT),
+            points=Sum('points_redeemed'),
+        )
+        .order_by()
+    }
+    refunds = {
+        row['refund_method']: row
+        for row in ProductReturn.objects.filter(**_window(shift, end, 'return_date'))
+        .values('refund_method')
+        .annotate(returns=Count('id'), refunded=Sum('refund_amount', output_field=AMOUNT))
+        .order_by()
+    }
+    #ledger amounts are negative, they lower what the customer owes
+    collected = {
+        row['entry_type']: row
+        for row in CustomerLedgerEntry.objects.filter(**_window(shift, end, 'created_at'), entry_type__in=COLLECTED)
+        .values('entry_type')
+        .annotate(entries=Count('id'), received=-Sum('amount', output_field=AMOUNT))
+        .order_by()
+    }
+
+    def sales_total(name):
+        return sum((row[name] or 0 for row in sales.values()), Decimal(0))
+
+    def received(entry_type):
+        return collected.get(entry_type, {}).get('received') or Decimal(0)
+
+    #partly paid sales leave the rest on account, only the cash taken is in the drawer
+    cash_sales = sales.get(SalesTransaction.PaymentMethodChoices.CASH, {}).get('cash') or Decimal(0)
+    cash_refunds = refunds.get(ProductReturn.RefundMethodChoices.CASH, {}).get('refunded') or Decimal(0)
+    deposits = received(CustomerLedgerEntry.EntryTypeChoices.DEPOSIT)
+    payments = received(CustomerLedgerEntry.EntryTypeChoices.PAYMENT)
+    expected = shift.opening_float + cash_sales - cash_refunds + deposits + payments
+    return {
+        'shift': shift.id,
+        'user': shift.user_id,
+        'terminal': shift.terminal,
+        'opened_at': datetime_to_string(shift.opened_at),
+        'closed_at': datetime_to_string(shift.closed_at),
+        'sales': [
+            {
+                'payment_method': method,
+                'transactions': row.get('transactions', 0),
+                'gross': _money(row.get('gross')),
+                'discounts': _money(row.get('discounts')),
+                'tax': _money(row.get('tax')),
+                'net': _money(row.get('net')),
+                'points_redeemed': row.get('points') or 0,
+            }
+            for method in SalesTransaction.PaymentMethodChoices.values
+            for row in [sales.get(method, {})]
+        ],
+        'refunds': [
+            {
+                'refund_method': method,
+                'returns': row.get('returns', 0),
+                'refunded': _money(row.get('refunded')),
+            }
+            for method in ProductReturn.RefundMethodChoices.values
+            for row in [refunds.get(method, {})]
+        ],
+        'deposits': _money(deposits),
+        'credit_payments': _money(payments),
+        'totals': {
+            'transactions': sum(row['transactions'] for row in sales.values()),
+            'gross': _money(sales_total('gross')),
+            'discounts': _money(sales_total('discounts')),
+            'tax': _money(sales_total('tax')),
+            'net': _money(sales_total('net')),
+            'refunded': _money(sum((row['refunded'] or 0 for row in refunds.values()), Decimal(0))),
+        },
+        'cash': {
+            'opening_float': _money(shift.opening_float),
+            'expected': _money(expected),
+            'counted': None if counted_cash is None else _money(counted_cash),
+            'difference': None if counted_cash is None else _money(counted_cash - expected),
+        },
+    }
+
+
+def close_shift(shift_id, counted_cash):
+    """Close an open shift and store its Z-report, returning the report"""
+    with transaction.atomic():
+        shift = Shift.objects.select_for_update().get(pk=shift_id)
+        if shift.status != Shift.StatusChoices.OPEN:
+            raise ValueError(f"Shift-{shift.id} is already closed")
+        shift.status = Shift.StatusChoices.CLOSED
+        shift.closed_at = timezone.now()
+        shift.counted_cash = counted_cash
+        shift.save(update_fields=['status', 'closed_at', 'counted_cash'])
+        return ShiftReport.objects.create(shift=shift, data=z_report(shift, counted_cash=counted_cash))
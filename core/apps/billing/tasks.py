@@ -0,0 +1,9 @@
+from core.apps.billing.facts import refresh_facts
+from core.apps.common.taskqueue import task
+
+
+@task('billing.refresh_sales_facts', batch=True)
+def refresh_sales_facts(payloads):
+    """Rebuild the sales facts of every queued sale at once, a sale sold and returned since is rebuilt once"""
+    sale_ids = sorted({sale_id for payload in payloads for sale_id in payload['sale_ids']})
+    refresh_facts(sale_ids)
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP
+
+from django.conf import settings
+
+from core.apps.billing.models import TaxRule
+from core.apps.common.cache import get_model_versions
+
+
+CENT = Decimal('0.01')
+
+ROUNDING = {
+    TaxRule.RoundingChoices.HALF_UP: ROUND_HALF_UP,
+    TaxRule.RoundingChoices.HALF_EVEN: ROUND_HALF_EVEN,
+    TaxRule.RoundingChoices.UP: ROUND_UP,
+    TaxRule.RoundingChoices.DOWN: ROUND_DOWN,
+}
+
+Rate = namedtuple('Rate', ['rate', 'inclusive', 'rounding'])
+
+NO_TAX = Rate(Decimal(0), False, ROUND_HALF_UP)
+
+Sold = namedtuple('Sold', ['quantity', 'tax_amount', 'tax_inclusive'])
+
+
+class TaxTable:
+    """Active tax rules as dicts by product and by category, the newest rule of each winning"""
+
+    def __init__(self, rules):
+        self.products, self.categories, self.default = {}, {}, NO_TAX
+        for rule in sorted(rules, key=lambda rule: rule.id):
+            rate = Rate(rule.rate, rule.mode == TaxRule.ModeChoices.INCLUSIVE, ROUNDING[rule.rounding])
+            if rule.product_id:
+                self.products[rule.product_id] = rate
+            elif rule.category_id:
+                self.categories[rule.category_id] = rate
+            else:
+                self.default = rate
+
+    def rate_for(self, product):
+        return self.products.get(product.id) or self.categories.get(product.category_id) or self.default
+
+
+#(rules version, table, monotonic time it was built)
+_compiled = (None, None, 0)
+_lock = threading.Lock()
+
+
+def _stale(version, now):
+    return _compiled[0] != version or now - _compiled[2] >= settings.TAX['REFRESH_SECONDS']
+
+
+def tax_table():
+    """
+    The compiled TaxTable, rebuilt when a rule changed. Saving or deleting
+    a rule bumps its response cache version, which every process checks
+    here, so a basket costs one cache read and no query. A process that
+    does not share that cache, or missed the bump, rebuilds the table
+    REFRESH_SECONDS after the last build anyway.
+    """
+    global _compiled
+    version, = get_model_versions([TaxRule])
+    now = time.monotonic()
+    if _stale(version, now):
+        with _lock:
+            if _stale(version, now):
+                _compiled = (version, TaxTable(TaxRule.objects.filter(is_active=True)), time.monotonic())
+    return _compiled[1]
+
+
+def line_tax(amount, rate):
+    """Tax of a line worth amount, rounded to the cent on its own"""
+    if not rate.rate:
+        return Decimal('0.00')
+    divisor = 100 + rate.rate if rate.inclusive else 100
+    return (amount * rate.rate / divisor).quantize(CENT, rounding=rate.rounding)
+
+
+def discount_shares(amounts, discount):
+    """
+    discount spread over amounts in proportion to them, each share rounded
+    to the cent and the last one taking the rest
+    """
+    total = sum(amounts)
+    if not discount or not total:
+        return [Decimal('0.00')] * len(amounts)
+    shares = [(discount * amount / total).quantize(CENT, rounding=ROUND_HALF_UP) for amount in amounts[:-1]]
+    return shares + [discount - sum(shares)]
+
+
+def tax_items(items, discount=0):
+    """
+    Set tax_rate, tax_inclusive and tax_amount of sale items, whose products
+    are loaded. The sale's discount is taken off the lines in proportion to
+    their totals first, tax is charged on what the customer pays.
+    """
+    table = tax_table()
+    shares = discount_shares([item.total_price for item in items], discount)
+    for item, share in zip(items, shares):
+        rate = table.rate_for(item.product)
+        item.tax_rate, item.tax_inclusive = rate.rate, rate.inclusive
+        item.tax_amount = line_tax(max(item.total_price - share, 0), rate)
+
+
+def sold_products(items):
+    """Sale lines added up per product, returns name a product and may cover several of its lines"""
+    sold = {}
+    for item in items:
+        quantity, tax_amount, _ = sold.get(item.product_id, (0, 0, None))
+        sold[item.product_id] = Sold(quantity + item.quantity, tax_amount + item.tax_amount, item.tax_inclusive)
+    return sold
+
+
+def refund_tax(sold_item, quantity, returned_quantity, returned_tax):
+    """
+    Tax given back when quantity more units of sold_item, a product's lines
+    from sold_products, are returned, returned_quantity units and
+    returned_tax having been given back before: their share of the lines'
+    tax, and the rest of it with the last units
+    """
+    if returned_quantity + quantity >= sold_item.quantity:
+        return sold_item.tax_amount - returned_tax
+    return (sold_item.tax_amount * quantity / sold_item.quantity).quantize(CENT, rounding=ROUND_HALF_UP)
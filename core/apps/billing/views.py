@@ -1,16 +1,39 @@
 from django.db import transaction
+from django.db.models import Sum
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from drf_spectacular.utils import extend_schema
 from rest_framework import viewsets, permissions, status, serializers
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from core.apps.products.models import Product
-from core.apps.billing.models import SalesTransactionItem, SalesTransaction, ProductReturnItem, ProductReturn
-from core.apps.billing.serializers import  SalesTransactionSerializer, ProductReturnSerializer
+from core.apps.billing.models import (
+    SalesTransactionItem, SalesTransaction, ProductReturnItem, ProductReturn,
+    ArchivedSalesTransaction, ArchivedProductReturn, LoyaltyRule, TaxRule, Shift,
+)
+from core.apps.billing.serializers import  (
+    SalesTransactionSerializer, ProductReturnSerializer, SalesTransactionValuesSerializer,
+    ArchivedSalesTransactionSerializer, ArchivedSalesTransactionValuesSerializer,
+    ArchivedProductReturnSerializer, ArchivedProductReturnValuesSerializer,
+    LoyaltyRuleSerializer, TaxRuleSerializer, ShiftSerializer, ShiftCloseSerializer, ZReportSerializer,
+    ReportQuerySerializer, TopProductsQuerySerializer, TopProductSerializer, CategoryMixSerializer, HeatmapSerializer,
+)
+from core.apps.billing import loyalty, reports, shifts, tax
 from core.apps.users.permissions import IsSuperUser, IsAdmin
+from core.apps.common.cache import bump_model_version
+from core.apps.common.outbox import record_event
+from core.apps.common.serializers import decimal_to_string
+from core.apps.common.taskqueue import enqueue
+from core.apps.common.views import ReadReplicaMixin, ValuesReadMixin
+from core.apps.users.ledger import locked_balance, post_entry
+from core.apps.users.models import CustomerLedgerEntry
 
 
-class SalesTransactionViewSet(viewsets.ModelViewSet):
+class SalesTransactionViewSet(ValuesReadMixin, ReadReplicaMixin, viewsets.ModelViewSet):
     queryset = SalesTransaction.objects.select_related('customer').prefetch_related('items__product', 'returns__items__product')
     serializer_class = SalesTransactionSerializer
+    values_serializer_class = SalesTransactionValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_permissions(self):
@@ -24,31 +47,44 @@ class SalesTransactionViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         
         items_data = serializer.validated_data.pop('items', [])
+        points = serializer.validated_data.pop('redeem_points', 0)
         
         if not items_data:
             raise serializers.ValidationError("Transaction must have at least one item")
         
         with transaction.atomic():
+            #spend loyalty points, their value is taken off as a discount
+            if points:
+                self._redeem_points(serializer.validated_data, points)
+            
             #create the main transaction
             sales_transaction = SalesTransaction.objects.create(**serializer.validated_data)
             
-            #bulk create items
-            if items_data:
-                items_to_create = [
-                    SalesTransactionItem(transaction=sales_transaction, **item_data)
-                    for item_data in items_data
-                ]
-                SalesTransactionItem.objects.bulk_create(items_to_create)
+            items_to_create = [
+                SalesTransactionItem(transaction=sales_transaction, **item_data)
+                for item_data in items_data
+            ]
             
-            #caluclate totals
-            self._calculate_totals(sales_transaction)
+            #tax the lines and calculate totals, before the items are written with their tax
+            self._calculate_totals(sales_transaction, items_to_create)
+            
+            #bulk create items
+            SalesTransactionItem.objects.bulk_create(items_to_create)
             
             #update inventory
             self._update_inventory(sales_transaction)
             
             #handle customer accounting
             self._handle_customer_accounting(sales_transaction)
+            
+            #outbox event, committed with the sale
+            record_event('sale.created', self._event_payload(sales_transaction, items_to_create))
+            
+            #analytics facts of the sale are written by the worker
+            enqueue('billing.refresh_sales_facts', {'sale_ids': [sales_transaction.id]})
         
+        #reload through the viewset queryset so nested items are prefetched
+        sales_transaction = self.get_queryset().get(pk=sales_transaction.pk)
         return Response(
             self.get_serializer(sales_transaction).data,
             status=status.HTTP_201_CREATED
@@ -123,26 +159,61 @@ class SalesTransactionViewSet(viewsets.ModelViewSet):
         
         # return Response(self.get_serializer(instance).data)
     
-    def _calculate_totals(self, instance):
-        """Calculate transaction totals and update the instance"""
-        #calculate subtotal
-        subtotal = sum(item.total_price for item in instance.items.all())
-        
-        #apply transaction discount
+    def _event_payload(self, instance, items):
+        return {
+            'id': instance.id,
+            'customer': instance.customer_id,
+            'transaction_date': instance.transaction_date,
+            'payment_method': instance.payment_method,
+            'subtotal': decimal_to_string(instance.subtotal),
+            'discount_amount': decimal_to_string(instance.discount_amount),
+            'tax_amount': decimal_to_string(instance.tax_amount),
+            'total_amount': decimal_to_string(instance.total_amount),
+            'amount_paid': decimal_to_string(instance.amount_paid),
+            'items': [
+                {
+                    'product': item.product_id,
+                    'quantity': decimal_to_string(item.quantity),
+                    'unit_price': decimal_to_string(item.unit_price),
+                    'discount_amount': decimal_to_string(item.discount_amount),
+                }
+                for item in items
+            ],
+        }
+    
+    def _redeem_points(self, validated_data, points):
+        """Take the points off the customer's balance and add their value to the transaction discount"""
+        if not loyalty.redeem_points(validated_data['customer'].id, points):
+            raise serializers.ValidationError({'redeem_points': "The customer does not have that many loyalty points"})
+        validated_data['points_redeemed'] = points
+        validated_data['discount_amount'] = validated_data.get('discount_amount', 0) + loyalty.points_value(points)
+    
+    def _calculate_totals(self, instance, items):
+        """Tax each item and calculate transaction totals, updating the instance"""
+        #transaction discount, redeemed loyalty points included
         discount = instance.discount_amount or 0
+        
+        #per line tax from the compiled rules, a dict lookup per item, on the discounted lines
+        tax.tax_items(items, discount)
+        
+        #calculate subtotal, inclusive taxes are part of the line prices
+        subtotal = sum(item.total_price for item in items)
+        tax_amount = sum(item.tax_amount for item in items)
+        exclusive_tax = sum(item.tax_amount for item in items if not item.tax_inclusive)
           
         #calculate total
-        total = subtotal - discount
+        total = subtotal + exclusive_tax - discount
         
         #update instance
         instance.subtotal = subtotal
+        instance.tax_amount = tax_amount
         instance.total_amount = total
         
         #calculate change if amount paid is provided
         if instance.amount_paid:
             instance.change_amount = max(0, instance.amount_paid - total)
         
-        instance.save(update_fields=['subtotal', 'total_amount', 'change_amount'])
+        instance.save(update_fields=['subtotal', 'tax_amount', 'total_amount', 'change_amount'])
     
     def _update_inventory(self, instance):
         """Update product stock levels"""
@@ -163,37 +234,39 @@ class SalesTransactionViewSet(viewsets.ModelViewSet):
             products_to_update.append(product)
         
         Product.objects.bulk_update(products_to_update, ['current_stock'])
+        #bulk_update does not send signals, invalidate cached product responses
+        bump_model_version(Product)
+        #low stock warnings are raised by the worker, after checkout
+        enqueue('products.check_low_stock', {'product_ids': [product.id for product in products_to_update]})
     
     def _handle_customer_accounting(self, instance):
         """Handle customer credit/deposit application"""
-        if not instance.customer:
+        if not instance.customer_id:
             return
         
-        customer = instance.customer
+        #locked, two checkouts must not spend the same credit
+        balance = locked_balance(instance.customer_id)
         
         #apply existing customer credit (negative balance = credit)
-        if customer.outstanding_balance <= 0:
-            available_credit = abs(customer.outstanding_balance)
-            amount_owed = instance.total_amount - (instance.amount_paid or 0)
-            
-            if amount_owed > 0:
-                credit_to_use = min(available_credit, amount_owed)
-                instance.amount_paid = (instance.amount_paid or 0) + credit_to_use
-                customer.outstanding_balance += credit_to_use
+        credit_to_use = 0
+        amount_owed = instance.total_amount - (instance.amount_paid or 0)
+        if balance < 0 and amount_owed > 0:
+            credit_to_use = min(-balance, amount_owed)
+            instance.amount_paid = (instance.amount_paid or 0) + credit_to_use
         
         #handle new credit or partial payments
-        current_payment = instance.amount_paid or 0
-        amount_owed = instance.total_amount - current_payment
-        
-        if amount_owed > 0:
-                customer.outstanding_balance += amount_owed
+        amount_owed = instance.total_amount - (instance.amount_paid or 0)
+        charge = credit_to_use + max(amount_owed, 0)
+        if charge:
+            post_entry(
+                instance.customer_id, CustomerLedgerEntry.EntryTypeChoices.SALE, charge, reference=f"Sale-{instance.id}"
+            )
         
-        customer.save(update_fields=['outstanding_balance'])
         #as amount_paid is modified above internally it needs to be updated
         instance.save(update_fields=['amount_paid'])
         
 
-class ProductReturnViewSet(viewsets.ModelViewSet):
+class ProductReturnViewSet(ReadReplicaMixin, viewsets.ModelViewSet):
     queryset = ProductReturn.objects.select_related('transaction__customer').prefetch_related('items__product')
     serializer_class = ProductReturnSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -208,16 +281,16 @@ class ProductReturnViewSet(viewsets.ModelViewSet):
             #create the product return
             product_return = ProductReturn.objects.create(**serializer.validated_data)
             
-            #bulk create items
-            if items_data:
-                items_to_create = [
-                    ProductReturnItem(product_return=product_return, **item_data)
-                    for item_data in items_data
-                ]
-                ProductReturnItem.objects.bulk_create(items_to_create)
+            items_to_create = [
+                ProductReturnItem(product_return=product_return, **item_data)
+                for item_data in items_data
+            ]
             
-            #calculate refund amount
-            self._calculate_refund(product_return)
+            #calculate refund amount and tax, before the items are written with their tax
+            self._calculate_refund(product_return, items_to_create)
+            
+            #bulk create items
+            ProductReturnItem.objects.bulk_create(items_to_create)
             
             #update inventory
             self._update_inventory(product_return)
@@ -225,6 +298,14 @@ class ProductReturnViewSet(viewsets.ModelViewSet):
             #handle refund based on method
             self._update_customer_balance(product_return)
             
+            #outbox event, committed with the return
+            record_event('return.created', self._event_payload(product_return, items_to_create))
+            
+            #the returned quantities reach the sale's analytics facts through the worker
+            enqueue('billing.refresh_sales_facts', {'sale_ids': [product_return.transaction_id]})
+            
+        #reload through the viewset queryset so nested items are prefetched
+        product_return = self.get_queryset().get(pk=product_return.pk)
         return Response(
             self.get_serializer(product_return).data,
             status=status.HTTP_201_CREATED
@@ -238,9 +319,45 @@ class ProductReturnViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
         
-    def _calculate_refund(self, instance):
-        """Calculate refund amount based on returned items"""
-        refund_amount = sum(item.total_price for item in instance.items.all())
+    def _event_payload(self, instance, items):
+        return {
+            'id': instance.id,
+            'transaction': instance.transaction_id,
+            'return_date': instance.return_date,
+            'refund_method': instance.refund_method,
+            'refund_amount': decimal_to_string(instance.refund_amount),
+            'items': [
+                {
+                    'product': item.product_id,
+                    'quantity': decimal_to_string(item.quantity),
+                    'unit_price': decimal_to_string(item.unit_price),
+                }
+                for item in items
+            ],
+        }
+    
+    def _calculate_refund(self, instance, items):
+        """Calculate refund amount based on returned items and the tax they were sold with"""
+        sold_items = tax.sold_products(SalesTransactionItem.objects.filter(transaction_id=instance.transaction_id))
+        #what earlier returns of the sale already gave back, per product
+        returned = {
+            row['product_id']: row
+            for row in ProductReturnItem.objects.filter(product_return__transaction_id=instance.transaction_id)
+            .values('product_id').annotate(units=Sum('quantity'), refunded_tax=Sum('tax_amount')).order_by()
+        }
+        
+        refund_amount = 0
+        for item in items:
+            sold_item = sold_items[item.product_id]
+            previous = returned.get(item.product_id, {})
+            item.tax_amount = tax.refund_tax(
+                sold_item, item.quantity, previous.get('units') or 0, previous.get('refunded_tax') or 0
+            )
+            refund_amount += item.total_price
+            #inclusive tax is part of the price given back already
+            if not sold_item.tax_inclusive:
+                refund_amount += item.tax_amount
+        
         instance.refund_amount = refund_amount
         instance.save(update_fields=['refund_amount'])
     
@@ -256,12 +373,177 @@ class ProductReturnViewSet(viewsets.ModelViewSet):
         
         if products_to_update:
             Product.objects.bulk_update(products_to_update, ['current_stock'])
+            #bulk_update does not send signals, invalidate cached product responses
+            bump_model_version(Product)
     
     def _update_customer_balance(self, instance):
         """Handle refund based on the selected method"""
         if instance.refund_method == ProductReturn.RefundMethodChoices.CREDIT:
             #credit customer account for future purchases
-            if instance.transaction.customer:
-                customer = instance.transaction.customer
-                customer.outstanding_balance -= instance.refund_amount
-                customer.save(update_fields=['outstanding_balance'])
\ No newline at end of file
+            if instance.transaction.customer_id and instance.refund_amount:
+                post_entry(
+                    instance.transaction.customer_id, CustomerLedgerEntry.EntryTypeChoices.REFUND,
+                    -instance.refund_amount, reference=f"Return-{instance.id}",
+                )
+
+
+class ArchiveFilterMixin:
+    """Narrow an archive listing with ?date_from= / ?date_to= (inclusive, YYYY-MM-DD)"""
+    date_field = None
+
+    def _date_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise serializers.ValidationError({name: "Use the YYYY-MM-DD format."})
+        return date
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        date_from, date_to = self._date_param('date_from'), self._date_param('date_to')
+        if date_from:
+            queryset = queryset.filter(**{f'{self.date_field}__date__gte': date_from})
+        if date_to:
+            queryset = queryset.filter(**{f'{self.date_field}__date__lte': date_to})
+        return queryset
+
+
+class ArchivedSalesTransactionViewSet(ArchiveFilterMixin, ValuesReadMixin, ReadReplicaMixin, viewsets.ReadOnlyModelViewSet):
+    """Sales of closed periods, moved out of the live tables by `manage.py archive_sales`"""
+    queryset = ArchivedSalesTransaction.objects.select_related('customer').order_by('id')
+    serializer_class = ArchivedSalesTransactionSerializer
+    values_serializer_class = ArchivedSalesTransactionValuesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    date_field = 'transaction_date'
+
+
+class ArchivedProductReturnViewSet(ArchiveFilterMixin, ValuesReadMixin, ReadReplicaMixin, viewsets.ReadOnlyModelViewSet):
+    """Returns of archived sales"""
+    queryset = ArchivedProductReturn.objects.order_by('id')
+    serializer_class = ArchivedProductReturnSerializer
+    values_serializer_class = ArchivedProductReturnValuesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    date_field = 'return_date'
+
+
+class LoyaltyRuleViewSet(viewsets.ModelViewSet):
+    """Earn rules of the loyalty program, applied by `manage.py accrue_loyalty` to the sales it credits"""
+    queryset = LoyaltyRule.objects.select_related('category').order_by('id')
+    serializer_class = LoyaltyRuleSerializer
+    permission_classes = [IsSuperUser | IsAdmin]
+
+
+class TaxRuleViewSet(viewsets.ModelViewSet):
+    """Tax rates of products and categories, applied to every sale from the next one on"""
+    queryset = TaxRule.objects.order_by('id')
+    serializer_class = TaxRuleSerializer
+    permission_classes = [IsSuperUser | IsAdmin]
+
+
+class ShiftViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Cashier shifts. Staff see and close their own, managers everyone's,
+    narrowed with ?user=, ?terminal= and ?status=.
+    """
+    queryset = Shift.objects.order_by('-id')
+    serializer_class = ShiftSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not (user.is_superuser or user.role == user.RoleChoices.ADMIN):
+            queryset = queryset.filter(user=user)
+        for param in ('user', 'terminal', 'status'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+    
+    @extend_schema(request=ShiftSerializer, responses=ShiftSerializer)
+    @action(detail=False, methods=['post'])
+    def open(self, request):
+        """Open a shift for the current user at a terminal"""
+        serializer = ShiftSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            shift = shifts.open_shift(request.user, **serializer.validated_data)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return Response(ShiftSerializer(shift).data, status=status.HTTP_201_CREATED)
+    
+    @extend_schema(request=ShiftCloseSerializer, responses=ZReportSerializer)
+    @action(detail=True, methods=['post'])
+    def close(self, request, pk=None):
+        """Close the shift with the counted drawer cash, returning its Z-report"""
+        shift = self.get_object()
+        serializer = ShiftCloseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            report = shifts.close_shift(shift.id, serializer.validated_data['counted_cash'])
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        return Response(report.data)
+    
+    @extend_schema(responses=ZReportSerializer)
+    @action(detail=True)
+    def report(self, request, pk=None):
+        """The stored Z-report of a closed shift, running totals of an open one"""
+        shift = self.get_object()
+        if shift.status == Shift.StatusChoices.CLOSED:
+            return Response(shift.report.data)
+        return Response(shifts.z_report(shift))
+
+
+class ReportViewSet(ReadReplicaMixin, viewsets.ViewSet):
+    """
+    Dashboard reports over the sales of a period, live and archived, net
+    of their returns. Each is a handful of grouped aggregates, cached for
+    REPORTS['CACHE_SECONDS'] rather than invalidated by every sale.
+    """
+    permission_classes = [IsSuperUser | IsAdmin]
+
+    def _query(self, request, serializer_class):
+        serializer = serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        start, end = reports.report_period(params.get('date_from'), params.get('date_to'))
+        return start, end, params
+
+    @extend_schema(parameters=[TopProductsQuerySerializer], responses=TopProductSerializer(many=True))
+    @action(detail=False)
+    def top_products(self, request):
+        """Best selling products of the period"""
+        start, end, params = self._query(request, TopProductsQuerySerializer)
+        limit = params.get('limit', settings.REPORTS['TOP_PRODUCTS_LIMIT'])
+        order_by = params.get('order_by', 'revenue')
+        data = reports.cached_report(
+            'top_products', {'start': start, 'end': end, 'limit': limit, 'order_by': order_by},
+            lambda: reports.top_products(start, end, limit, order_by),
+        )
+        return Response(data)
+
+    @extend_schema(parameters=[ReportQuerySerializer], responses=HeatmapSerializer)
+    @action(detail=False)
+    def heatmap(self, request):
+        """Sales by weekday and hour of day"""
+        start, end, _ = self._query(request, ReportQuerySerializer)
+        data = reports.cached_report(
+            'heatmap', {'start': start, 'end': end}, lambda: reports.heatmap(start, end)
+        )
+        return Response(data)
+
+    @extend_schema(parameters=[ReportQuerySerializer], responses=CategoryMixSerializer(many=True))
+    @action(detail=False)
+    def category_mix(self, request):
+        """Share of each category in the period's revenue"""
+        start, end, _ = self._query(request, ReportQuerySerializer)
+        data = reports.cached_report(
+            'category_mix', {'start': start, 'end': end}, lambda: reports.category_mix(start, end)
+        )
+        return Response(data)
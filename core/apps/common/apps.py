@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CommonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core.apps.common'
+
+    def ready(self):
+        from core.apps.common import checks  # noqa: F401
+        from core.apps.common.middleware import install_query_collector
+        from core.apps.common.signals import connect_cache_invalidation
+
+        connect_cache_invalidation()
+        #request metrics count the queries of every connection, in whichever thread it lives
+        connection_created.connect(install_query_collector, dispatch_uid='install_query_collector')
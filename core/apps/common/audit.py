@@ -0,0 +1,136 @@
+import atexit
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, models, transaction
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, empty
+
+
+logger = logging.getLogger(__name__)
+
+#set by AuditContextMiddleware for the duration of a request
+current_request = ContextVar('current_request', default=None)
+
+
+def get_current_user():
+    """The authenticated user of the request being served, or None"""
+    request = current_request.get()
+    user = getattr(request, 'user', None)
+    #DRF replaces request.user once it authenticated, never trigger a session lookup just to stamp a row
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return None
+    return user if user.is_authenticated else None
+
+
+class AuditWriter:
+    """
+    Process-wide buffer of audit log entries, written with one bulk INSERT
+    once MAX_BUFFER entries are waiting or FLUSH_SECONDS passed since the
+    last write. Entries only reach the buffer when the transaction that
+    made the change commits, so rolled back changes are never logged.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+            due = (
+                len(self._entries) >= settings.AUDIT['MAX_BUFFER']
+                or time.monotonic() - self._flushed_at >= settings.AUDIT['FLUSH_SECONDS']
+            )
+        if due:
+            self.flush()
+
+    def flush_if_due(self, **kwargs):
+        if self._entries and time.monotonic() - self._flushed_at >= settings.AUDIT['FLUSH_SECONDS']:
+            self.flush()
+
+    def flush(self):
+        from core.apps.common.models import AuditLog
+
+        with self._lock:
+            entries, self._entries = self._entries, []
+            self._flushed_at = time.monotonic()
+        if not entries:
+            return 0
+        try:
+            AuditLog.objects.bulk_create(entries, batch_size=settings.AUDIT['MAX_BUFFER'])
+        except DatabaseError:
+            #the change itself already committed, keep its entries for the next flush
+            logger.exception("Could not write %s audit log entries, retrying on the next flush", len(entries))
+            with self._lock:
+                self._entries[:0] = entries[-settings.AUDIT['MAX_PENDING']:]
+            return 0
+        return len(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _flush_at_exit():
+    try:
+        audit_writer.flush()
+    except Exception:
+        logger.exception("Could not write %s buffered audit log entries at exit", len(audit_writer))
+
+
+audit_writer = AuditWriter()
+#a quiet worker still writes its tail after the request that filled it
+request_finished.connect(audit_writer.flush_if_due, dispatch_uid='audit_writer_flush')
+atexit.register(_flush_at_exit)
+
+
+def record_change(instance, action, changes=None, user=None):
+    """Queue an audit log entry for instance, written if and when the current transaction commits"""
+    from core.apps.common.models import AuditLog
+
+    entry = AuditLog(
+        model=instance._meta.label_lower, object_id=str(instance.pk), action=action,
+        changes=changes or {}, user_id=getattr(user, 'pk', None), created_at=timezone.now(),
+    )
+    transaction.on_commit(partial(audit_writer.add, entry))
+
+
+def field_changes(instance, attnames):
+    """{field: [old, new]} for the given attnames changed since the instance was loaded or last saved"""
+    snapshot = getattr(instance, '_audit_snapshot', None)
+    if snapshot is None:
+        return {}
+    exclude = instance.audit_exclude
+    changes = {}
+    for attname in attnames:
+        if attname in exclude or attname not in snapshot:
+            continue
+        field = instance._meta.get_field(attname)
+        old, new = _stored_value(field, snapshot[attname]), _stored_value(field, getattr(instance, attname))
+        if old != new:
+            changes[attname] = [old, new]
+    return changes
+
+
+def _stored_value(field, value):
+    """value as the database keeps it, so integer defaults and computed decimals compare and log like loaded ones"""
+    if isinstance(field, models.DecimalField) and value is not None:
+        return Decimal(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+def take_snapshot(instance, attnames=None):
+    """Remember field values, the baseline of the next change set"""
+    fields = attnames or [field.attname for field in instance._meta.concrete_fields]
+    snapshot = instance.__dict__.setdefault('_audit_snapshot', {})
+    for attname in fields:
+        #deferred fields are left out rather than loaded
+        if attname in instance.__dict__:
+            snapshot[attname] = instance.__dict__[attname]
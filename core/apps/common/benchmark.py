@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.db import connections
+
+
+def _drop_connection(alias):
+    """Close and forget the current thread's connection so the next use reconnects"""
+    connections[alias].close()
+    try:
+        del connections[alias]
+    except AttributeError:
+        pass
+
+
+@contextmanager
+def temporary_database(options=None, alias='default'):
+    """
+    Point a database alias at a fresh, migrated SQLite file for the
+    duration of the block. Threads started inside the block connect to
+    the temporary file as well.
+    """
+    original = connections.settings[alias]
+    tmpdir = tempfile.mkdtemp(prefix='pos-bench-')
+    config = {
+        **original,
+        'NAME': os.path.join(tmpdir, 'bench.sqlite3'),
+        'OPTIONS': dict(options or {}),
+    }
+
+    _drop_connection(alias)
+    connections.settings[alias] = config
+    try:
+        call_command('migrate', database=alias, verbosity=0, interactive=False)
+        yield config
+    finally:
+        _drop_connection(alias)
+        connections.settings[alias] = original
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
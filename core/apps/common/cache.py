@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process LRU cache whose entries expire after a TTL.
+    """
+
+    def __init__(self, max_entries=1024, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            #mark as most recently used
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+
+            #evict least recently used entries once we are over the bound
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _version_key(model):
+    return f"model-version:{model._meta.label_lower}"
+
+
+def get_model_versions(models):
+    """
+    Return the current version of each model in the response cache.
+    A missing version is seeded from the clock rather than 1, so an
+    evicted counter can never come back to a value still used by a
+    cached entry.
+    """
+    response_cache = caches['responses']
+    keys = [_version_key(model) for model in models]
+    versions = response_cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            response_cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = response_cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_model_versions(models):
+    """Async variant of get_model_versions, the cache backend is not read from the event loop thread"""
+    response_cache = caches['responses']
+    keys = [_version_key(model) for model in models]
+    versions = await response_cache.aget_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            await response_cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await response_cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(*models):
+    """
+    Invalidate every cached response that depends on the given models.
+    Inside a transaction the bump waits for the commit, so readers never
+    cache pre-commit data under the new version. Use it after bulk_update,
+    bulk_create and queryset.update(), which do not send model signals.
+    """
+    def bump():
+        response_cache = caches['responses']
+        for model in models:
+            key = _version_key(model)
+            try:
+                response_cache.incr(key)
+            except ValueError:
+                response_cache.set(key, time.time_ns(), timeout=None)
+
+    transaction.on_commit(bump)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_response_cache(app_configs, **kwargs):
+    """
+    The 'responses' cache holds the model versions every worker checks its
+    cached responses and auth users against. A per-process backend only
+    sees the bumps of its own worker, so the others serve stale data.
+    """
+    backend = settings.CACHES.get('responses', {}).get('BACKEND', '')
+    if backend.endswith('LocMemCache'):
+        return [Warning(
+            "The 'responses' cache is per process, workers will not see each other's invalidations.",
+            hint="Set RESPONSE_CACHE_BACKEND=file unless the server runs a single worker process.",
+            id='common.W001',
+        )]
+    return []
@@ -0,0 +1,34 @@
+from django.urls import URLResolver
+from django.urls.resolvers import RoutePattern
+from django.utils.module_loading import import_string
+
+
+def lazy_view(dotted_path, **initkwargs):
+    """
+    URL view for a class based view that is imported on its first request,
+    for rarely used views whose modules are expensive to import.
+    """
+    view = None
+
+    def wrapper(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    #the wrapped views are DRF views, which handle CSRF themselves
+    wrapper.csrf_exempt = True
+    wrapper.__name__ = dotted_path.rsplit('.', 1)[-1]
+    return wrapper
+
+
+def lazy_include(route, urlconf_name, namespace):
+    """
+    Like path(route, include((urlconf_name, namespace))), but the urlconf
+    module is only imported once a URL under route is resolved or any
+    URL is reversed.
+    """
+    return URLResolver(
+        RoutePattern(route, is_endpoint=False), urlconf_name,
+        app_name=namespace, namespace=namespace,
+    )
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.apps.billing.models import SalesTransaction
+from core.apps.common.benchmark import temporary_database, percentile
+from core.apps.products.models import Product
+from core.apps.users.models import User, Customer
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the async read endpoints in one process under WSGI and ASGI "
+        "while slow report requests are in flight"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='clients sending lookup requests at the same time')
+        parser.add_argument('--requests', type=int, default=1000, help='lookup requests in total')
+        parser.add_argument('--wsgi-threads', type=int, default=4,
+                            help='request threads of the WSGI worker, as in gunicorn --threads')
+        parser.add_argument('--slow', type=int, default=4,
+                            help='clients repeatedly requesting a slow purchase history report')
+        parser.add_argument('--sales', type=int, default=2000, help='size of the seeded sales history')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--db-latency', type=float, default=2.0,
+                            help='milliseconds added to every query to model a networked database, '
+                                 '0 measures the raw in-process SQLite')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write("DEBUG is on, run with MODE=production for representative numbers")
+
+        #the in-process handlers are addressed as "testserver"
+        with temporary_database(settings.DATABASES['default'].get('OPTIONS')), \
+                override_settings(ALLOWED_HOSTS=['testserver']):
+            call_command(
+                'generate_dataset', seed=options['seed'], sales=options['sales'],
+                products=500, customers=1000, purchase_orders=50, deposits=0, adjustments=0,
+                stdout=io.StringIO(),
+            )
+            headers = self._headers()
+            paths = self._lookup_paths(options['requests'])
+            slow_path = self._slow_path()
+            self._simulate_latency(options['db_latency'] / 1000)
+
+            self.stdout.write(
+                f"{'deployment':<12}{'lookups/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                f"{'errors':>8}{'reports':>9}"
+            )
+            for name, run in (('wsgi', self._run_wsgi), ('asgi', self._run_asgi)):
+                result = run(paths, slow_path, headers, options)
+                latencies = result['latencies']
+                self.stdout.write(
+                    f"{name:<12}{len(latencies) / result['elapsed']:>11.1f}"
+                    f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+                    f"{percentile(latencies, 99):>9.1f}{result['errors']:>8}{result['reports']:>9}"
+                )
+
+    def _simulate_latency(self, seconds):
+        if not seconds:
+            return
+
+        def delay(execute, sql, params, many, context):
+            #sleeping releases the GIL like waiting on a socket would
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        #weak=False keeps the local receiver alive for the rest of the run
+        connection_created.connect(install, weak=False)
+
+    def _headers(self):
+        user = User.objects.create_user('loadtest', 'loadtest@example.com', 'loadtest',
+                                        role=User.RoleChoices.ADMIN)
+        #a real token so authentication is part of every request
+        return {'authorization': f"Bearer {AccessToken.for_user(user)}"}
+
+    def _lookup_paths(self, number):
+        products = list(Product.objects.values_list('id', 'sku', 'name'))
+        customers = list(Customer.objects.values_list('id', 'phone'))
+        if not products or not customers:
+            raise CommandError("The generated dataset has no products or customers")
+
+        paths = []
+        for i in range(number):
+            product_id, sku, name = products[i % len(products)]
+            customer_id, phone = customers[i % len(customers)]
+            paths.append((
+                f"/async/products/scan/?code={sku}",
+                f"/async/products/search/?q={name.split()[0]}",
+                f"/async/customers/lookup/?q={phone[:6] or customer_id}",
+                f"/async/customers/{customer_id}/balance_summary/",
+            )[i % 4])
+        return paths
+
+    def _slow_path(self):
+        busiest = (
+            SalesTransaction.objects.filter(customer__isnull=False)
+            .values('customer').annotate(visits=Count('id')).order_by('-visits')
+            .values_list('customer', flat=True).first()
+        )
+        return f"/customers/{busiest}/purchase_history/"
+
+    def _run_wsgi(self, paths, slow_path, headers, options):
+        handler = WSGIHandler()
+        environ_headers = {
+            f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()
+        }
+
+        def call(path):
+            path, _, query = path.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+                'REMOTE_ADDR': '10.0.0.1', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                **environ_headers,
+            }
+            status = []
+            response = handler(environ, lambda code, response_headers: status.append(int(code[:3])))
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            return status[0]
+
+        #the worker's request threads; clients queue for them like on a real worker
+        pool = ThreadPoolExecutor(max_workers=options['wsgi_threads'])
+        pending = list(paths)
+        lock = threading.Lock()
+        done = threading.Event()
+        result = {'latencies': [], 'errors': 0, 'reports': 0}
+
+        def lookup_client():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    path = pending.pop()
+                started = time.perf_counter()
+                status = pool.submit(call, path).result()
+                with lock:
+                    result['latencies'].append((time.perf_counter() - started) * 1000)
+                    result['errors'] += status >= 400
+
+        def report_client():
+            while not done.is_set():
+                pool.submit(call, slow_path).result()
+                with lock:
+                    result['reports'] += 1
+
+        reporters = [threading.Thread(target=report_client) for _ in range(options['slow'])]
+        clients = [threading.Thread(target=lookup_client) for _ in range(options['concurrency'])]
+        for thread in reporters:
+            thread.start()
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        result['elapsed'] = time.perf_counter() - started
+        done.set()
+        for thread in reporters:
+            thread.join()
+        pool.shutdown()
+        return result
+
+    def _run_asgi(self, paths, slow_path, headers, options):
+        return asyncio.run(self._asgi(paths, slow_path, headers, options))
+
+    async def _asgi(self, paths, slow_path, headers, options):
+        handler = ASGIHandler()
+        scope_headers = [(b'host', b'testserver')] + [
+            (name.encode(), value.encode()) for name, value in headers.items()
+        ]
+
+        async def call(path):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': query.encode(), 'headers': scope_headers,
+                'client': ('10.0.0.1', 0), 'server': ('testserver', 80),
+            }
+            messages = []
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                #the client never disconnects
+                await asyncio.Event().wait()
+
+            async def send(message):
+                messages.append(message)
+
+            await handler(scope, receive, send)
+            return messages[0]['status']
+
+        pending = list(paths)
+        done = asyncio.Event()
+        result = {'latencies': [], 'errors': 0, 'reports': 0}
+
+        async def lookup_client():
+            while pending:
+                path = pending.pop()
+                started = time.perf_counter()
+                status = await call(path)
+                result['latencies'].append((time.perf_counter() - started) * 1000)
+                result['errors'] += status >= 400
+
+        async def report_client():
+            while not done.is_set():
+                await call(slow_path)
+                result['reports'] += 1
+
+        reporters = [asyncio.create_task(report_client()) for _ in range(options['slow'])]
+        started = time.perf_counter()
+        await asyncio.gather(*(lookup_client() for _ in range(options['concurrency'])))
+        result['elapsed'] = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*reporters)
+        return result
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.apps.common.benchmark import temporary_database
+from core.apps.common.taskqueue import Worker, enqueue, task
+
+
+@task('bench.noop')
+def noop(**payload):
+    pass
+
+
+@task('bench.noop_batch', batch=True)
+def noop_batch(payloads):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure task queue throughput: enqueue cost and how fast one worker drains the queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=settings.TASK_QUEUE['BATCH_SIZE'])
+
+    def handle(self, *args, **options):
+        count = options['tasks']
+        with temporary_database(settings.SQLITE_PRODUCTION_OPTIONS):
+            self.stdout.write(f"{'handler':<18}{'enqueue tasks/s':>17}{'drain tasks/s':>15}")
+            for name in ('bench.noop', 'bench.noop_batch'):
+                started = time.perf_counter()
+                #one transaction per 100 tasks, like many small requests
+                for start in range(0, count, 100):
+                    with transaction.atomic():
+                        for n in range(start, min(start + 100, count)):
+                            enqueue(name, {'n': n})
+                enqueued = time.perf_counter() - started
+
+                started = time.perf_counter()
+                processed = Worker(batch_size=options['batch_size']).run(burst=True)
+                drained = time.perf_counter() - started
+                self.stdout.write(f"{name:<18}{count / enqueued:>17.0f}{processed / drained:>15.0f}")
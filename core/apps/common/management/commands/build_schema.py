@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apps.common.schema import build_schema, code_version, stored_version
+
+
+class Command(BaseCommand):
+    help = "Prebuild the OpenAPI schema served at /api/schema/, only when the code version changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.SCHEMA_ARTIFACT['PATH'])
+        parser.add_argument('--force', action='store_true', help='rebuild even if the code version is unchanged')
+        parser.add_argument('--check', action='store_true',
+                            help='only report, and fail when the stored schema is missing or stale')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        version = code_version()
+        current = stored_version(path)
+
+        if options['check']:
+            if current != version:
+                raise CommandError(f"Schema at {path} is stale: built for {current}, code is {version}")
+            self.stdout.write(f"Schema at {path} is up to date ({version})")
+            return
+
+        if current == version and not options['force']:
+            self.stdout.write(f"Schema at {path} is up to date ({version}), skipping")
+            return
+
+        body = build_schema(path, version)
+        self.stdout.write(self.style.SUCCESS(
+            f"Schema for {version} written to {path} ({len(body)} bytes uncompressed)"
+        ))
@@ -0,0 +1,29 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.apps.common.outbox import Dispatcher
+
+
+class Command(BaseCommand):
+    help = "Deliver outbox events to the configured webhooks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=settings.OUTBOX['POLL_INTERVAL'],
+                            help='seconds an idle dispatcher waits before checking for new events')
+        parser.add_argument('--burst', action='store_true', help='exit once nothing is deliverable')
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher()
+
+        def stop(signum, frame):
+            #finish the delivery in hand, then exit
+            dispatcher.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"Dispatching to {', '.join(sorted(dispatcher.webhooks)) or 'no webhooks'}")
+        delivered = dispatcher.run(burst=options['burst'], poll_interval=options['poll_interval'])
+        self.stdout.write(f"Delivered {delivered} events")
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apps.common.startup import LAZY_MODULES, import_time_by_package, measure_startup
+
+
+class Command(BaseCommand):
+    help = "Profile worker startup: import time per package, slowest modules and the startup budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='startups measured, the fastest is reported')
+        parser.add_argument('--top', type=int, default=15, help='number of slowest modules listed')
+        parser.add_argument('--budget', type=float, default=settings.STARTUP['BUDGET_SECONDS'],
+                            help='seconds a worker may take to load before failing')
+
+    def handle(self, *args, **options):
+        runs = [measure_startup() for _ in range(options['runs'])]
+        seconds, modules, imports = min(runs, key=lambda run: run[0])
+
+        self.stdout.write(f"{'package':<28}{'import ms':>10}")
+        for package, microseconds in import_time_by_package(imports)[:options['top']]:
+            self.stdout.write(f"{package:<28}{microseconds / 1000:>10.1f}")
+
+        self.stdout.write(f"\n{'module (self time)':<56}{'self ms':>9}{'total ms':>10}")
+        slowest = sorted(imports, key=lambda record: -record[1])[:options['top']]
+        for module, self_us, cumulative_us, _ in slowest:
+            self.stdout.write(f"{module:<56}{self_us / 1000:>9.1f}{cumulative_us / 1000:>10.1f}")
+
+        self.stdout.write(f"\n{len(modules)} modules loaded, startup took {seconds:.3f}s "
+                          f"(budget {options['budget']:.3f}s)")
+
+        problems = []
+        eager = sorted(set(LAZY_MODULES) & modules)
+        if eager:
+            problems.append(f"modules meant to load lazily were imported: {', '.join(eager)}")
+        if seconds > options['budget']:
+            problems.append(f"startup took {seconds:.3f}s, budget {options['budget']:.3f}s")
+        if problems:
+            raise CommandError("Startup budget exceeded:\n  " + "\n  ".join(problems))
@@ -0,0 +1,31 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.apps.common.taskqueue import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks from the database task queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TASK_QUEUE['BATCH_SIZE'],
+                            help='tasks claimed per round trip')
+        parser.add_argument('--poll-interval', type=float, default=settings.TASK_QUEUE['POLL_INTERVAL'],
+                            help='seconds an idle worker waits before checking for new tasks')
+        parser.add_argument('--burst', action='store_true', help='exit once no task is due')
+
+    def handle(self, *args, **options):
+        worker = Worker(batch_size=options['batch_size'])
+
+        def stop(signum, frame):
+            #finish the batch in hand, then exit
+            worker.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"Worker {worker.worker_id} running {', '.join(sorted(worker.handlers)) or 'no tasks'}")
+        processed = worker.run(burst=options['burst'], poll_interval=options['poll_interval'])
+        self.stdout.write(f"Worker {worker.worker_id} stopped after {processed} tasks")
@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apps.common.routers import replica_alias
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the read replica file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='keep copying every N seconds instead of copying once')
+        parser.add_argument('--pages', type=int, default=1024,
+                            help='pages copied per step, so readers are never blocked for long')
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError("No read replica configured, set DATABASE_REPLICA_NAME")
+
+        primary = str(settings.DATABASES['default']['NAME'])
+        replica = str(settings.DATABASES[alias]['NAME'])
+
+        while True:
+            started = time.perf_counter()
+            self._copy(primary, replica, options['pages'])
+            self.stdout.write(f"Replica synced in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _copy(self, primary, replica, pages):
+        #the online backup API reads a consistent snapshot of the primary,
+        #even while checkouts keep writing to it
+        source = sqlite3.connect(primary)
+        target = sqlite3.connect(replica)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,80 @@
+import bisect
+import threading
+from collections import defaultdict
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        #one slot per bucket plus the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Per-process request metrics, one set of histograms per endpoint.
+    Each worker keeps its own registry, so scrape every worker or put
+    a single worker behind the metrics endpoint.
+    """
+
+    METRICS = (
+        ('pos_request_duration_seconds', 'Request latency', LATENCY_BUCKETS),
+        ('pos_request_sql_duration_seconds', 'Total SQL time per request', LATENCY_BUCKETS),
+        ('pos_request_slowest_query_seconds', 'Slowest SQL query per request', LATENCY_BUCKETS),
+        ('pos_request_render_duration_seconds', 'Response rendering time per request', LATENCY_BUCKETS),
+        ('pos_request_queries', 'SQL queries per request', QUERY_BUCKETS),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(
+            lambda: {name: Histogram(buckets) for name, _, buckets in self.METRICS}
+        )
+
+    def observe(self, view_name, method, **values):
+        with self._lock:
+            histograms = self._endpoints[(view_name, method)]
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def render(self):
+        """Render all histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, help_text, _ in self.METRICS:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (view_name, method), histograms in sorted(self._endpoints.items()):
+                    labels = f'view="{view_name}",method="{method}"'
+                    lines.extend(histograms[name].render(name, labels))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,247 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+from core.apps.common.audit import current_request
+from core.apps.common.compression import choose_encoding, compress, compress_stream, acompress_stream
+from core.apps.common.metrics import registry
+from core.apps.common.routers import PRIMARY_COOKIE
+
+
+slow_query_logger = logging.getLogger('core.slow_queries')
+
+
+class QueryCollector:
+    """execute_wrapper that counts and times every query of a request"""
+
+    def __init__(self, slow_query_ms):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self.slowest = max(self.slowest, elapsed)
+
+            if elapsed >= self.slow_query_seconds:
+                slow_query_logger.warning(
+                    "Slow query (%.1f ms) on %s: %s params=%r",
+                    elapsed * 1000, context['connection'].alias, sql, params
+                )
+
+
+#the QueryCollector of the request being served, copied into the sync_to_async
+#threads that run sync views under ASGI, whose connections are their own
+current_collector = ContextVar('current_collector', default=None)
+
+
+def collect_queries(execute, sql, params, many, context):
+    """execute_wrapper of every connection, handing its queries to the request's collector"""
+    collector = current_collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    return collector(execute, sql, params, many, context)
+
+
+def install_query_collector(sender, connection, **kwargs):
+    """connection_created receiver, wraps each new connection once"""
+    if collect_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(collect_queries)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, SQL time, slowest query, view and rendering time
+    for every request. The numbers are sent back as a Server-Timing
+    header and aggregated into the per-endpoint histograms served at
+    /metrics.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        #stay async under ASGI so async views keep running on the event loop
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        request._metrics_rendered_at = None
+        collector = QueryCollector(settings.METRICS['SLOW_QUERY_MS'])
+        return collector, current_collector.set(collector)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        collector, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        return self._finish(request, response, collector, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        collector, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        return self._finish(request, response, collector, started)
+
+    def _finish(self, request, response, collector, started):
+        finished = time.perf_counter()
+        total = finished - started
+        #rendering, and the middleware outside the view, run between process_template_response and here;
+        #serializer .data built inside the view counts as app time
+        rendered_at = request._metrics_rendered_at
+        render = finished - rendered_at if rendered_at else 0.0
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unmatched'
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={collector.duration * 1000:.2f};desc="{collector.count} queries"',
+            f'slowest-query;dur={collector.slowest * 1000:.2f}',
+            f'app;dur={(total - collector.duration - render) * 1000:.2f}',
+            f'render;dur={render * 1000:.2f}',
+            f'total;dur={total * 1000:.2f};desc="{view_name}"',
+        ])
+
+        registry.observe(
+            view_name, request.method,
+            pos_request_duration_seconds=total,
+            pos_request_sql_duration_seconds=collector.duration,
+            pos_request_slowest_query_seconds=collector.slowest,
+            pos_request_render_duration_seconds=render,
+            pos_request_queries=collector.count,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        #DRF responses are rendered right after this hook returns
+        request._metrics_rendered_at = time.perf_counter()
+        return response
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli/gzip response compression. Bodies under COMPRESSION['MIN_SIZE']
+    go out as they are, streaming responses are compressed chunk by chunk
+    and keep streaming. Responses served through cache_response carry
+    their cache key, and their compressed bodies are cached under it, so
+    repeat hits are not compressed again.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            #the compressed size is only known once the stream is done
+            del response.headers['Content-Length']
+        else:
+            compressed = self._compressed_content(response, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        #a strong ETag would claim byte equality with the uncompressed body
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _compressed_content(self, response, encoding):
+        cache_key = getattr(response, 'compression_cache_key', None)
+        if cache_key is None:
+            return compress(response.content, encoding)
+
+        #the same data renders differently per media type (JSON, browsable API)
+        media_type = response.get('Content-Type', '').split(';')[0]
+        key = f"{cache_key}:{media_type}:{encoding}"
+        response_cache = caches['responses']
+        compressed = response_cache.get(key)
+        if compressed is None:
+            compressed = compress(response.content, encoding)
+            response_cache.set(key, compressed, settings.RESPONSE_CACHE['TIMEOUT'])
+        return compressed
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """
+    Pin a client to the primary database for READ_REPLICA['STICKY_SECONDS']
+    after any successful write, whichever view handled it. The pin is a
+    cookie so every worker sees it, not only the one that took the write.
+    """
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            seconds = settings.READ_REPLICA['STICKY_SECONDS']
+            response.set_cookie(
+                PRIMARY_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
+
+class AuditContextMiddleware:
+    """
+    Expose the request being served to audit stamping (see
+    core.apps.common.audit), whose user DRF fills in once it authenticated.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_request.reset(token)
@@ -1,8 +1,13 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 
+from core.apps.common.audit import field_changes, get_current_user, record_change, take_snapshot
+from core.apps.common.cache import bump_model_version
+
+
 class TimeStampModelMixin(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
@@ -11,6 +16,60 @@ class TimeStampModelMixin(models.Model):
         abstract = True
 
 
+class AuditQuerySet(models.QuerySet):
+    """
+    Stamps created_by / updated_by from the request user and logs field
+    changes on the bulk paths, like AuditModelMixin.save does per row.
+    QuerySet.update() is stamped but not logged, it never sees old values.
+    """
+
+    def _audited(self):
+        return issubclass(self.model, AuditModelMixin)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not self._audited():
+            return super().bulk_create(objs, *args, **kwargs)
+        user = get_current_user()
+        objs = list(objs)
+        if user is not None:
+            for obj in objs:
+                if obj.created_by_id is None:
+                    obj.created_by = user
+                obj.updated_by = user
+        objs = super().bulk_create(objs, *args, **kwargs)
+        for obj in objs:
+            if obj.pk is not None:
+                record_change(obj, AuditLog.ActionChoices.CREATE, user=user)
+            take_snapshot(obj)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        if not self._audited():
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        user = get_current_user()
+        objs, fields = list(objs), list(fields)
+        if user is not None:
+            for obj in objs:
+                obj.updated_by = user
+            if 'updated_by' not in fields:
+                fields.append('updated_by')
+        rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        attnames = [self.model._meta.get_field(name).attname for name in fields]
+        for obj in objs:
+            changes = field_changes(obj, attnames)
+            if changes:
+                record_change(obj, AuditLog.ActionChoices.UPDATE, changes, user)
+            take_snapshot(obj, attnames)
+        return rows
+
+    def update(self, **kwargs):
+        if self._audited() and 'updated_by' not in kwargs and 'updated_by_id' not in kwargs:
+            user = get_current_user()
+            if user is not None:
+                kwargs['updated_by'] = user
+        return super().update(**kwargs)
+
+
 class AuditModelMixin(models.Model):
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -27,19 +86,65 @@ class AuditModelMixin(models.Model):
         editable=False,
     )
 
+    objects = models.Manager.from_queryset(AuditQuerySet)()
+
+    #attnames never written to the audit log
+    audit_exclude = ('created_at', 'updated_at', 'created_by_id', 'updated_by_id')
+
     class Meta:
         abstract = True
-        
 
-class SoftDeleteQuerySet(models.QuerySet):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #baseline the audit log diffs the next save against
+        instance._audit_snapshot = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Stamp the request user and log the changed fields"""
+        user = get_current_user()
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if user is not None:
+            if adding and self.created_by_id is None:
+                self.created_by = user
+            self.updated_by = user
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'updated_by'}
+
+        super().save(*args, **kwargs)
+
+        if adding:
+            record_change(self, AuditLog.ActionChoices.CREATE, user=user)
+            take_snapshot(self)
+            return
+        if update_fields is None:
+            attnames = [field.attname for field in self._meta.concrete_fields]
+        else:
+            attnames = [self._meta.get_field(name).attname for name in update_fields]
+        changes = field_changes(self, attnames)
+        if changes:
+            record_change(self, AuditLog.ActionChoices.UPDATE, changes, user)
+        take_snapshot(self, attnames)
+
+    def delete(self, *args, **kwargs):
+        record_change(self, AuditLog.ActionChoices.DELETE, user=get_current_user())
+        return super().delete(*args, **kwargs)
+
+
+class SoftDeleteQuerySet(AuditQuerySet):
     """
     Custom QuerySet for soft delete functionality.
     """
 
     def delete(self, user=None):
-        return super().update(
+        rows = super().update(
             is_deleted=True, deleted_at=timezone.now(), deleted_by=user
         )
+        #update() sends no post_save, cached responses and auth users would outlive the delete
+        bump_model_version(self.model)
+        return rows
 
     def hard_delete(self):
         return super().delete()
@@ -149,3 +254,106 @@ class UserManager(BaseUserManager):
             raise ValueError("Superuser must have is_superuser=True")
 
         return self.create_user(username, email, password, **extra_fields)
+
+
+class Task(models.Model):
+    """
+    A background task, queued as one row and run by `manage.py run_worker`
+    (see core.apps.common.taskqueue). Succeeded tasks are deleted, tasks out
+    of attempts stay as Failed.
+    """
+
+    class StatusChoices(models.TextChoices):
+        QUEUED = 'Queued', 'Queued'
+        RUNNING = 'Running', 'Running'
+        FAILED = 'Failed', 'Failed'
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    #claim token of the worker running the task and when its lease runs out
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            #due tasks are claimed in (run_at, id) order per status
+            models.Index(fields=['status', 'run_at', 'id'], name='common_task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id}"
+
+
+class OutboxEvent(models.Model):
+    """
+    A domain event, written in the transaction of the change it describes
+    and delivered to the webhooks by `manage.py dispatch_events`
+    (see core.apps.common.outbox). The id is the delivery order.
+    """
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
+
+
+class WebhookCursor(models.Model):
+    """Delivery position of one configured webhook: the last event it acknowledged"""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    #failed deliveries of the batch after last_event_id
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.name} at #{self.last_event_id}"
+
+
+class WebhookDeadLetter(models.Model):
+    """An event a webhook never acknowledged, skipped after the last retry"""
+    webhook = models.CharField(max_length=50)
+    event = models.ForeignKey(OutboxEvent, on_delete=models.CASCADE, related_name='dead_letters')
+    error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.webhook}: {self.event}"
+
+
+class AuditLog(models.Model):
+    """
+    Field level change history of the audited models, written in batches
+    by core.apps.common.audit.AuditWriter. changes maps each changed
+    field to [old, new].
+    """
+
+    class ActionChoices(models.TextChoices):
+        CREATE = 'Create', 'Create'
+        UPDATE = 'Update', 'Update'
+        DELETE = 'Delete', 'Delete'
+
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=64)
+    action = models.CharField(max_length=10, choices=ActionChoices.choices)
+    changes = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    #no constraint, a buffered entry must still be writable after its user is hard deleted
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+', db_constraint=False,
+    )
+    #when the change happened, not when the entry was flushed
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'created_at'], name='common_audit_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.model} #{self.object_id}"
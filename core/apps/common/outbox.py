@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from core.apps.common.models import OutboxEvent, WebhookCursor, WebhookDeadLetter
+
+
+logger = logging.getLogger(__name__)
+
+
+def record_event(event_type, payload):
+    """
+    Write a domain event with a single INSERT. Called inside the
+    transaction of the change, so an event exists only if the change
+    committed.
+    """
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def sign(secret, timestamp, body):
+    """Signature sent as X-POS-Signature: hex HMAC-SHA256 of "<timestamp>.<body>" under the webhook secret"""
+    message = f"{timestamp}.".encode() + body
+    return 'sha256=' + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def render_batch(events):
+    return json.dumps({
+        'events': [
+            {'id': event.id, 'type': event.event_type, 'created_at': event.created_at, 'data': event.payload}
+            for event in events
+        ],
+    }, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def configured_webhooks():
+    """{name: config} of the webhooks with a URL set"""
+    return {name: webhook for name, webhook in settings.OUTBOX['WEBHOOKS'].items() if webhook.get('URL')}
+
+
+class Dispatcher:
+    """
+    Delivers events to every configured webhook in id order, BATCH_SIZE
+    per signed POST. A webhook's cursor only moves past a batch once it
+    answered 2xx; a batch that keeps failing is retried with backoff and
+    dead-lettered after MAX_ATTEMPTS, so one bad batch cannot block the
+    webhook for good.
+    """
+
+    def __init__(self, webhooks=None):
+        self.webhooks = configured_webhooks() if webhooks is None else webhooks
+        self.stopping = False
+
+    def dispatch(self):
+        """Send at most one batch per due webhook, returning the number of events delivered"""
+        delivered = 0
+        for name, webhook in self.webhooks.items():
+            cursor, _ = WebhookCursor.objects.get_or_create(name=name)
+            if cursor.next_attempt_at and cursor.next_attempt_at > timezone.now():
+                continue
+            delivered += self._deliver(cursor, webhook)
+        return delivered
+
+    def _pending(self, cursor, webhook):
+        events = OutboxEvent.objects.filter(id__gt=cursor.last_event_id)
+        if webhook.get('EVENTS'):
+            events = events.filter(event_type__in=webhook['EVENTS'])
+        settle = settings.OUTBOX['SETTLE_SECONDS']
+        if settle:
+            #leave time for transactions holding lower ids to commit
+            events = events.filter(created_at__lte=timezone.now() - timedelta(seconds=settle))
+        return list(events.order_by('id')[:settings.OUTBOX['BATCH_SIZE']])
+
+    def _deliver(self, cursor, webhook):
+        events = self._pending(cursor, webhook)
+        if not events:
+            return 0
+
+        body = render_batch(events)
+        timestamp = str(int(time.time()))
+        request = urllib.request.Request(webhook['URL'], data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-POS-Timestamp': timestamp,
+            'X-POS-Signature': sign(webhook['SECRET'], timestamp, body),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=settings.OUTBOX['TIMEOUT']) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as exc:
+            #HTTPError, raised for non 2xx answers, is a URLError as well
+            self._failed(cursor, events, str(exc))
+            return 0
+
+        cursor.last_event_id = events[-1].id
+        cursor.attempts = 0
+        cursor.next_attempt_at = None
+        cursor.last_error = ''
+        cursor.save()
+        return len(events)
+
+    def _failed(self, cursor, events, error):
+        cursor.attempts += 1
+        cursor.last_error = error
+        options = settings.OUTBOX
+        if cursor.attempts >= options['MAX_ATTEMPTS']:
+            logger.error("Webhook %s dead-lettered events #%s-#%s: %s", cursor.name, events[0].id, events[-1].id, error)
+            with transaction.atomic():
+                WebhookDeadLetter.objects.bulk_create([
+                    WebhookDeadLetter(webhook=cursor.name, event=event, error=error) for event in events
+                ])
+                cursor.last_event_id = events[-1].id
+                cursor.attempts = 0
+                cursor.next_attempt_at = None
+                cursor.save()
+            return
+
+        delay = min(options['BACKOFF_MAX_SECONDS'], options['BACKOFF_SECONDS'] * 2 ** (cursor.attempts - 1))
+        cursor.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning("Webhook %s failed (attempt %s), retrying in %ss: %s", cursor.name, cursor.attempts, delay, error)
+        cursor.save()
+
+    def prune(self):
+        """Delete events every webhook is past and older than RETENTION_DAYS"""
+        cursors = WebhookCursor.objects.filter(name__in=list(self.webhooks))
+        if cursors.count() < len(self.webhooks):
+            return 0
+        delivered_up_to = cursors.aggregate(position=Min('last_event_id'))['position'] or 0
+        cutoff = timezone.now() - timedelta(days=settings.OUTBOX['RETENTION_DAYS'])
+        #dead-lettered events are kept for replay
+        count, _ = OutboxEvent.objects.filter(
+            id__lte=delivered_up_to, created_at__lt=cutoff, dead_letters__isnull=True
+        ).delete()
+        return count
+
+    def run(self, burst=False, poll_interval=None):
+        """Deliver until stopped; burst returns once nothing is deliverable right now"""
+        poll_interval = settings.OUTBOX['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        delivered = 0
+        while not self.stopping:
+            count = self.dispatch()
+            delivered += count
+            if not count:
+                if burst:
+                    break
+                self.prune()
+                time.sleep(poll_interval)
+        return delivered
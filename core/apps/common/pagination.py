@@ -0,0 +1,67 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class MergedIds:
+    """
+    The id rows of querysets sharing one id space, such as the live and
+    archived rows of the same data, filtered, ordered and sliced by
+    KeysetPagination as if they were one queryset. Each row carries the
+    index of the queryset it came from as `source`.
+    """
+
+    def __init__(self, querysets):
+        self.querysets = querysets
+
+    def order_by(self, *ordering):
+        return MergedIds([queryset.order_by(*ordering) for queryset in self.querysets])
+
+    def filter(self, **kwargs):
+        return MergedIds([queryset.filter(**kwargs) for queryset in self.querysets])
+
+    def __getitem__(self, page):
+        #the first page.stop rows of the merge are among the first page.stop rows of each queryset
+        rows = [
+            {**row, 'source': source}
+            for source, queryset in enumerate(self.querysets)
+            for row in queryset.values('id')[:page.stop]
+        ]
+        descending = self.querysets[0].query.order_by[0].startswith('-')
+        return sorted(rows, key=lambda row: row['id'], reverse=descending)[page]
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Newest first cursor pagination over the primary key. A page is read
+    with `id < <last id seen>` instead of an OFFSET, so deep pages cost
+    what the first one does and rows written meanwhile never shift a page.
+    """
+    ordering = '-id'
+    page_size = settings.PAGINATION['PAGE_SIZE']
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PAGINATION['MAX_PAGE_SIZE']
+
+    def paginate_values(self, queryset, request, view, values_serializer_class):
+        """
+        Page through queryset reading only ids, then render the page with
+        a ValuesSerializer: a fixed number of queries whatever the page size.
+        """
+        page = self.paginate_queryset(queryset.values('id'), request, view)
+        ids = [row['id'] for row in page]
+        data = values_serializer_class(queryset.filter(id__in=ids).order_by(*self.ordering)).data if ids else []
+        return self.get_paginated_response(data)
+
+    def paginate_merged_values(self, sources, request, view):
+        """
+        paginate_values over [(queryset, values_serializer_class)] sharing
+        one id space, live rows and their archive: one id query per source,
+        then each source with rows on the page renders its own.
+        """
+        page = self.paginate_queryset(MergedIds([queryset for queryset, _ in sources]), request, view)
+        positions = {row['id']: position for position, row in enumerate(page)}
+        data = []
+        for source, (queryset, values_serializer_class) in enumerate(sources):
+            ids = [row['id'] for row in page if row['source'] == source]
+            if ids:
+                data += values_serializer_class(queryset.filter(id__in=ids)).data
+        return self.get_paginated_response(sorted(data, key=lambda row: positions[row['id']]))
@@ -0,0 +1,48 @@
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+#set by ReadReplicaMixin for the duration of a safe-method request
+use_replica = ContextVar('use_replica', default=False)
+
+#set by ReadYourWritesMiddleware after a write, holds the time it expires at
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+def replica_alias():
+    """Return the configured replica alias, or None when no replica is set up"""
+    alias = settings.READ_REPLICA['ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+def pinned_to_primary(request):
+    """Whether the client wrote within the last READ_REPLICA['STICKY_SECONDS'] and must read the primary"""
+    try:
+        return float(request.COOKIES[PRIMARY_COOKIE]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to the replica only while a request has opted in through
+    ReadReplicaMixin; everything else, and all writes, use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if use_replica.get():
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #the replica is a copy of the primary so objects can relate across them
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        #the replica only ever receives copies of the migrated primary
+        return db != settings.READ_REPLICA['ALIAS']
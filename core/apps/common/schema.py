@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import os
+import threading
+from importlib import import_module
+from pathlib import Path
+
+from django.conf import settings
+
+
+#sources hashed into the code version when CODE_VERSION is not set
+SOURCE_PATTERNS = ('core/**/*.py',)
+
+#drf-spectacular extensions, imported only when a schema is generated
+SCHEMA_EXTENSION_MODULES = ('core.apps.users.schema',)
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+class SchemaArtifact:
+    """A prebuilt OpenAPI schema, kept gzip compressed in memory"""
+
+    def __init__(self, compressed, code_version):
+        self.compressed = compressed
+        self.code_version = code_version
+        #weak because the same tag is sent for the gzip and identity encodings
+        self.etag = f'W/"{hashlib.sha256(compressed).hexdigest()[:32]}"'
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = gzip.decompress(self.compressed)
+        return self._body
+
+
+def load_schema_extensions(endpoints, **kwargs):
+    """Preprocessing hook registering the project's drf-spectacular extensions"""
+    for module in SCHEMA_EXTENSION_MODULES:
+        import_module(module)
+    return endpoints
+
+
+def code_version():
+    """Return CODE_VERSION, or a hash of the sources and the schema libraries when it is unset"""
+    configured = settings.SCHEMA_ARTIFACT['CODE_VERSION']
+    if configured:
+        return configured
+
+    import drf_spectacular
+    import rest_framework
+
+    digest = hashlib.sha256()
+    base_dir = Path(settings.BASE_DIR)
+    for pattern in SOURCE_PATTERNS:
+        for path in sorted(base_dir.glob(pattern)):
+            digest.update(str(path.relative_to(base_dir)).encode())
+            digest.update(path.read_bytes())
+    digest.update(f"{rest_framework.VERSION} {drf_spectacular.__version__}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _version_path(path):
+    return f"{path}.version"
+
+
+def stored_version(path=None):
+    """Code version the stored schema was built from, or None when there is none"""
+    path = path or settings.SCHEMA_ARTIFACT['PATH']
+    try:
+        with open(_version_path(path)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_schema(path=None, version=None):
+    """Generate the OpenAPI schema and store it gzip compressed along with its code version"""
+    from drf_spectacular.renderers import OpenApiJsonRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    path = path or settings.SCHEMA_ARTIFACT['PATH']
+    version = version or code_version()
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+    body = OpenApiJsonRenderer().render(schema, renderer_context={})
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    #mtime=0 keeps the bytes, and so the ETag, stable across identical builds
+    _write_atomic(path, gzip.compress(body, compresslevel=9, mtime=0))
+    _write_atomic(_version_path(path), version.encode())
+    return body
+
+
+def load_schema_artifact(path=None):
+    """Return the stored schema, re-read only when the file changes, or None when it is missing"""
+    path = path or settings.SCHEMA_ARTIFACT['PATH']
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+
+        with open(path, 'rb') as f:
+            artifact = SchemaArtifact(f.read(), stored_version(path))
+        _loaded[path] = (modified, artifact)
+        return artifact
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from rest_framework import serializers
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that, inside a BulkRelatedListSerializer,
+    resolves ids from objects the list loaded with a single query.
+    """
+
+    prefetched = None
+
+    def to_internal_value(self, data):
+        if self.prefetched is not None:
+            try:
+                obj = self.prefetched.get(self.get_queryset().model._meta.pk.to_python(data))
+            except ValidationError:
+                obj = None
+            if obj is not None:
+                return obj
+        #unknown or malformed ids get the regular error messages
+        return super().to_internal_value(data)
+
+
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    """
+    List serializer that loads the related objects of every
+    BulkPrimaryKeyRelatedField on the child in one query per field,
+    instead of one query per item.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            for name, field in self.child.fields.items():
+                if not isinstance(field, BulkPrimaryKeyRelatedField) or field.read_only:
+                    continue
+                pk_field = field.get_queryset().model._meta.pk
+                ids = set()
+                for item in data:
+                    try:
+                        ids.add(pk_field.to_python(item.get(name)))
+                    except (AttributeError, TypeError, ValidationError):
+                        continue
+                ids.discard(None)
+                field.prefetched = field.get_queryset().in_bulk(ids)
+        return super().to_internal_value(data)
+
+
+class DateRangeQuerySerializer(serializers.Serializer):
+    """?date_from= / ?date_to= query parameters, inclusive local days"""
+    date_from = serializers.DateField(required=False, help_text="First day, inclusive.")
+    date_to = serializers.DateField(required=False, help_text="Last day, inclusive.")
+
+    def validate(self, data):
+        if data.get('date_from') and data.get('date_to') and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError({'date_to': "Must not be before date_from."})
+        return data
+
+    def date_filter(self, lookup):
+        """
+        Filter keyword arguments restricting the datetime field `lookup` to
+        the requested days. A plain range rather than __date, so an index
+        on the field is used.
+        """
+        filters = {}
+        if self.validated_data.get('date_from'):
+            filters[f'{lookup}__gte'] = day_start(self.validated_data['date_from'])
+        if self.validated_data.get('date_to'):
+            filters[f'{lookup}__lt'] = day_start(self.validated_data['date_to'] + timedelta(days=1))
+        return filters
+
+
+def day_start(date):
+    """Aware datetime of the local midnight starting date"""
+    return timezone.make_aware(datetime.combine(date, datetime.min.time()))
+
+
+TWO_PLACES = Decimal('0.01')
+FOUR_PLACES = Decimal('0.0001')
+
+
+def decimal_to_string(value, places=TWO_PLACES):
+    """Match DecimalField(decimal_places=2) output without instantiating a field"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        #unsaved instances hold integer defaults or numbers straight from the request body
+        value = Decimal(value)
+    return f'{value.quantize(places):f}'
+
+
+def rate_to_string(value):
+    """Match DecimalField(decimal_places=4) output, for rates"""
+    return decimal_to_string(value, FOUR_PLACES)
+
+
+def datetime_to_string(value):
+    """Match the ISO 8601 output of DateTimeField"""
+    if not value:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer that builds representations from `.values_list()`
+    rows instead of model instances and serializer fields, for hot list
+    endpoints. The output must match the ModelSerializer it stands in for.
+
+    `fields` holds (name, source, to_representation) tuples; the source is
+    either a lookup, fetched in the main query, or a callable taking the
+    raw row. `nested` holds (name, ValuesSerializer class, foreign key)
+    tuples; each nested list is loaded with one grouped query.
+    """
+    model = None
+    fields = ()
+    nested = ()
+    #ids per IN clause, below the SQLite variable limit
+    chunk_size = 900
+
+    def __init__(self, queryset=None):
+        self.queryset = queryset
+
+    @property
+    def data(self):
+        return self.to_representation(self.queryset)
+
+    def _lookups(self):
+        lookups = []
+        for _, source, _ in self.fields:
+            if isinstance(source, str) and source not in lookups:
+                lookups.append(source)
+        return lookups
+
+    def _represent(self, lookups, records):
+        data = []
+        for record in records:
+            raw = dict(zip(lookups, record))
+            row = {}
+            for name, source, to_representation in self.fields:
+                value = raw[source] if isinstance(source, str) else source(raw)
+                row[name] = to_representation(value) if to_representation else value
+            data.append(row)
+        return data
+
+    def _attach_nested(self, data):
+        if not self.nested or not data:
+            return data
+        ids = [row['id'] for row in data]
+        for name, serializer_class, foreign_key in self.nested:
+            grouped = serializer_class().grouped_by(foreign_key, ids)
+            for row in data:
+                row[name] = grouped.get(row['id'], [])
+        return data
+
+    def to_representation(self, queryset):
+        lookups = self._lookups()
+        #prefetches do not apply to values() querysets
+        records = queryset.prefetch_related(None).values_list(*lookups)
+        return self._attach_nested(self._represent(lookups, records))
+
+    async def ato_representation(self, queryset):
+        """Async variant of to_representation for async views"""
+        lookups = self._lookups()
+        records = [record async for record in queryset.prefetch_related(None).values_list(*lookups)]
+        data = self._represent(lookups, records)
+        if self.nested and data:
+            await sync_to_async(self._attach_nested)(data)
+        return data
+
+    def grouped_by(self, foreign_key, parent_ids):
+        """Return {parent id: [representation, ...]} for the given parents"""
+        lookups = self._lookups()
+        grouped = {}
+        for offset in range(0, len(parent_ids), self.chunk_size):
+            chunk = parent_ids[offset:offset + self.chunk_size]
+            records = list(
+                self.model._default_manager.filter(**{f'{foreign_key}__in': chunk})
+                .order_by('id').values_list(foreign_key, *lookups)
+            )
+            rows = self._attach_nested(self._represent(lookups, [record[1:] for record in records]))
+            for record, row in zip(records, rows):
+                grouped.setdefault(record[0], []).append(row)
+        return grouped
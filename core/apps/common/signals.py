@@ -0,0 +1,25 @@
+from django.apps import apps
+from django.db.models.signals import post_save, post_delete
+
+from core.apps.common.cache import bump_model_version
+
+
+#models never served through the response cache; without a listener their
+#queryset deletes stay a single DELETE instead of a fetch and a signal per row
+UNCACHED_MODELS = {
+    'common.task', 'common.outboxevent', 'common.webhookcursor', 'common.webhookdeadletter', 'common.auditlog',
+    'users.customerledgerentry', 'users.customerbalancesnapshot',
+    'billing.loyaltycursor', 'billing.shiftreport', 'billing.salesfact',
+}
+
+
+def invalidate_cached_responses(sender, **kwargs):
+    """Bump the response cache version of any of our models on save and delete"""
+    bump_model_version(sender)
+
+
+def connect_cache_invalidation():
+    for model in apps.get_models():
+        if model.__module__.startswith('core.apps.') and model._meta.label_lower not in UNCACHED_MODELS:
+            post_save.connect(invalidate_cached_responses, sender=model)
+            post_delete.connect(invalidate_cached_responses, sender=model)
@@ -0,0 +1,68 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+
+
+#modules only needed by rarely used endpoints, which must not load at startup
+LAZY_MODULES = (
+    'drf_spectacular.views',
+    'drf_spectacular.generators',
+    'drf_spectacular.renderers',
+    'django.contrib.admin.views.main',
+    'core.admin_urls',
+    'core.apps.users.schema',
+    'debug_toolbar.urls',
+)
+
+#what a worker does before serving its first request
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from core.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({'seconds': time.perf_counter() - started, 'modules': sorted(sys.modules)}))
+"""
+
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure_startup(env=None):
+    """
+    Start a fresh interpreter the way a worker starts and return its
+    startup time, the modules it loaded and its -X importtime records
+    as (module, self microseconds, cumulative microseconds, depth).
+    """
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'),
+        #the warm-up is measured separately
+        'WARM_UP': 'False',
+        **(env or {}),
+    }
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report['seconds'], set(report['modules']), imports
+
+
+def import_time_by_package(imports):
+    """Sum the self import time of every module per top level package, in microseconds"""
+    totals = defaultdict(int)
+    for module, self_us, _, _ in imports:
+        totals[module.split('.')[0]] += self_us
+    return sorted(totals.items(), key=lambda item: -item[1])
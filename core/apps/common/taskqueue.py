@@ -0,0 +1,181 @@
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.apps.common.models import Task
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class TaskHandler:
+    def __init__(self, name, func, batch, max_attempts):
+        self.name = name
+        self.func = func
+        self.batch = batch
+        self.max_attempts = max_attempts or settings.TASK_QUEUE['MAX_ATTEMPTS']
+
+
+def task(name, batch=False, max_attempts=None):
+    """
+    Register a task handler under name. A plain handler is called with
+    each task's payload as keyword arguments, a batch handler once with
+    the list of payloads of every claimed task of that name.
+    """
+    def decorator(func):
+        _registry[name] = TaskHandler(name, func, batch, max_attempts)
+        func.task_name = name
+        return func
+    return decorator
+
+
+def load_tasks():
+    """Import the tasks module of every installed app so their handlers register"""
+    autodiscover_modules('tasks')
+    return _registry
+
+
+def enqueue(name, payload=None, delay=None):
+    """
+    Queue a task with a single INSERT. Inside a transaction the task
+    commits or rolls back with the caller's work, workers only ever see
+    committed tasks.
+    """
+    run_at = timezone.now() + timedelta(seconds=delay) if delay else timezone.now()
+    return Task.objects.create(name=name, payload=payload or {}, run_at=run_at)
+
+
+def backoff_seconds(attempts):
+    """Delay before retrying a task that failed attempts times, doubling per attempt with jitter"""
+    delay = min(settings.TASK_QUEUE['BACKOFF_MAX_SECONDS'], settings.TASK_QUEUE['BACKOFF_SECONDS'] * 2 ** (attempts - 1))
+    #jitter keeps a failed batch from retrying in lockstep
+    return delay * random.uniform(1, 1.25)
+
+
+class Worker:
+    """Claims due tasks in batches, runs them and records the outcome"""
+
+    def __init__(self, batch_size=None, lease_seconds=None):
+        self.batch_size = batch_size or settings.TASK_QUEUE['BATCH_SIZE']
+        self.lease_seconds = lease_seconds or settings.TASK_QUEUE['LEASE_SECONDS']
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"[:55]
+        self.handlers = load_tasks()
+        self.stopping = False
+
+    def requeue_expired(self):
+        """Put tasks whose worker died mid-run back in the queue"""
+        count = Task.objects.filter(
+            status=Task.StatusChoices.RUNNING, locked_until__lt=timezone.now()
+        ).update(status=Task.StatusChoices.QUEUED, locked_by='', locked_until=None)
+        if count:
+            logger.warning("Requeued %s tasks with an expired lease", count)
+        return count
+
+    def claim(self):
+        """Lease up to batch_size due tasks to this worker, oldest first"""
+        now = timezone.now()
+        token = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        with transaction.atomic():
+            due = Task.objects.filter(status=Task.StatusChoices.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            ids = list(due.values_list('id', flat=True)[:self.batch_size])
+            if not ids:
+                return []
+            #the status condition keeps a task claimed by a concurrent worker out
+            Task.objects.filter(id__in=ids, status=Task.StatusChoices.QUEUED).update(
+                status=Task.StatusChoices.RUNNING, locked_by=token,
+                locked_until=now + timedelta(seconds=self.lease_seconds),
+                #counted up front, so a task that kills its worker still runs out of attempts
+                attempts=F('attempts') + 1,
+            )
+        return list(Task.objects.filter(locked_by=token, status=Task.StatusChoices.RUNNING).order_by('run_at', 'id'))
+
+    def run_batch(self):
+        """Claim and run one batch, returning the number of tasks processed"""
+        tasks = self.claim()
+        if not tasks:
+            return 0
+
+        groups = {}
+        for task_row in tasks:
+            groups.setdefault(task_row.name, []).append(task_row)
+
+        done, failed = [], []
+        for name, group in groups.items():
+            handler = self.handlers.get(name)
+            if handler is None:
+                failed.extend((task_row, f"No handler registered for task {name!r}", True) for task_row in group)
+            elif handler.batch:
+                self._run(lambda: handler.func([task_row.payload for task_row in group]), group, done, failed)
+            else:
+                for task_row in group:
+                    self._run(lambda: handler.func(**task_row.payload), [task_row], done, failed)
+
+        if done:
+            Task.objects.filter(id__in=[task_row.id for task_row in done]).delete()
+        if failed:
+            self._record_failures(failed)
+        return len(tasks)
+
+    def _run(self, call, group, done, failed):
+        try:
+            #a failing task leaves none of its writes behind
+            with transaction.atomic():
+                call()
+        except Exception as exc:
+            logger.exception("Task %s failed", group[0].name)
+            error = ''.join(traceback.format_exception_only(exc)).strip()
+            failed.extend((task_row, error, False) for task_row in group)
+        else:
+            done.extend(group)
+
+    def _record_failures(self, failed):
+        now = timezone.now()
+        for task_row, error, permanent in failed:
+            handler = self.handlers.get(task_row.name)
+            if permanent or task_row.attempts >= handler.max_attempts:
+                task_row.status = Task.StatusChoices.FAILED
+            else:
+                task_row.status = Task.StatusChoices.QUEUED
+                task_row.run_at = now + timedelta(seconds=backoff_seconds(task_row.attempts))
+            task_row.last_error = error
+            task_row.locked_by = ''
+            task_row.locked_until = None
+        Task.objects.bulk_update(
+            [task_row for task_row, _, _ in failed],
+            ['status', 'run_at', 'last_error', 'locked_by', 'locked_until'],
+        )
+
+    def run(self, burst=False, poll_interval=None, max_tasks=None):
+        """
+        Process batches until stopped. burst drains the due tasks and returns,
+        otherwise an idle worker sleeps poll_interval seconds between checks.
+        """
+        poll_interval = settings.TASK_QUEUE['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        processed = 0
+        self.requeue_expired()
+        while not self.stopping:
+            count = self.run_batch()
+            processed += count
+            if max_tasks is not None and processed >= max_tasks:
+                break
+            if not count:
+                if burst:
+                    break
+                self.requeue_expired()
+                time.sleep(poll_interval)
+        return processed
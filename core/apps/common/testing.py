@@ -0,0 +1,176 @@
+import re
+import threading
+from collections import Counter
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from core.apps.billing.models import SalesTransaction, SalesTransactionItem, ProductReturn, ProductReturnItem
+from core.apps.products.models import Category, Supplier, Product
+from core.apps.users.models import User, Customer
+
+
+#data sizes every query budget is checked at
+SCALES = (1, 10, 100)
+
+_sequence = count()
+
+
+def _normalize(sql):
+    """Reduce a query to its shape so repeated lookups with different ids compare equal"""
+    sql = re.sub(r'SAVEPOINT "\w+"', 'SAVEPOINT ?', sql)
+    sql = re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", '?', sql)
+    sql = re.sub(r"IN \([?, ]+\)", 'IN (...)', sql)
+    #multi-row inserts and CASE based bulk updates
+    sql = re.sub(r"VALUES \([^)]*\)(, \([^)]*\))*", 'VALUES (...)', sql)
+    return re.sub(r"(WHEN \(.*?\) THEN \(.*?\) )+", 'WHEN ... ', sql)
+
+
+def _relation(sql):
+    match = re.search(r'FROM "(\w+)"', sql)
+    return match.group(1) if match else 'unknown table'
+
+
+def make_products(number, **fields):
+    """Create products, each in its own category and from its own supplier"""
+    products = []
+    for _ in range(number):
+        n = next(_sequence)
+        category = Category.objects.create(name=f"Category {n}")
+        supplier = Supplier.objects.create(name=f"Supplier {n}", contact_person="Contact", phone="1", address="-")
+        products.append(Product.objects.create(**{
+            'name': f"Product {n}", 'sku': f"SKU-{n}", 'category': category, 'supplier': supplier,
+            'purchase_price': Decimal('5.00'), 'selling_price': Decimal('10.00'),
+            'current_stock': Decimal('1000.00'), **fields,
+        }))
+    return products
+
+
+def make_customer(**fields):
+    return Customer.objects.create(**{'name': f"Customer {next(_sequence)}", **fields})
+
+
+def make_sale(customer=None, items=2, returned=True):
+    """Create a sale with distinct products per item and, optionally, a return of its first item"""
+    sale = SalesTransaction.objects.create(
+        customer=customer, payment_method=SalesTransaction.PaymentMethodChoices.CASH,
+        amount_paid=Decimal('1000.00'),
+    )
+    products = make_products(items)
+    SalesTransactionItem.objects.bulk_create([
+        SalesTransactionItem(transaction=sale, product=product, quantity=Decimal('2'), unit_price=Decimal('10.00'))
+        for product in products
+    ])
+    if returned:
+        make_return(sale, products[:1])
+    return sale
+
+
+def make_return(sale, products):
+    product_return = ProductReturn.objects.create(
+        transaction=sale, reason="Test", refund_method=ProductReturn.RefundMethodChoices.CASH,
+    )
+    ProductReturnItem.objects.bulk_create([
+        ProductReturnItem(product_return=product_return, product=product, quantity=Decimal('1'), unit_price=Decimal('10.00'))
+        for product in products
+    ])
+    return product_return
+
+
+class WebhookReceiver:
+    """
+    Local HTTP server recording the webhook calls it receives, for use as
+    a context manager. Answers every POST with status.
+    """
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = []
+
+    def __enter__(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.calls.append((self.headers, body))
+                self.send_response(receiver.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QueryCountTestCase(APITestCase):
+    """
+    Base class for query-count regression tests. Requests are made as a
+    superuser, with the response cache cleared before every measurement
+    so the uncached path is the one being counted.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            f"admin{next(_sequence)}", "admin@example.com", "password", role=User.RoleChoices.ADMIN
+        )
+        self.client.force_authenticate(self.user)
+        #model version bumps wait for commits that never happen in a TestCase
+        caches['responses'].clear()
+
+    def assertConstantQueries(self, setup, request, scales=SCALES):
+        """
+        Call setup(scale) and then request(state) with the state it returns
+        at every scale, and fail when the number of queries changes.
+        The failure names the relation whose queries grew with the data.
+        """
+        captured = {}
+        for scale in scales:
+            state = setup(scale)
+            caches['responses'].clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = request(state)
+            self.assertLess(response.status_code, 400, getattr(response, 'data', response.content))
+            captured[scale] = [query['sql'] for query in queries.captured_queries]
+
+        base_scale = scales[0]
+        for scale in scales[1:]:
+            if len(captured[scale]) != len(captured[base_scale]):
+                self.fail(self._explain(captured[base_scale], captured[scale], base_scale, scale))
+
+    def _explain(self, base_queries, queries, base_scale, scale):
+        base = Counter(_normalize(sql) for sql in base_queries)
+        grown = Counter(_normalize(sql) for sql in queries)
+        lines = [f"{len(base_queries)} queries at {base_scale}x but {len(queries)} at {scale}x"]
+        for shape, number in grown.items():
+            if number != base.get(shape, 0):
+                lines.append(
+                    f'  "{_relation(shape)}" queried {base.get(shape, 0)} -> {number} times: {shape[:200]}'
+                )
+        return '\n'.join(lines)
+
+
+class ValuesParityTestCase(QueryCountTestCase):
+    """Base class for tests comparing values based endpoints with their serializers"""
+
+    def assertMatchesSerializer(self, path, serializer_class, instance, many=False):
+        """Fail unless GET path renders exactly the bytes serializer_class renders"""
+        caches['responses'].clear()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', response.content))
+        expected = JSONRenderer().render(serializer_class(instance, many=many).data)
+        self.assertEqual(response.content.decode(), expected.decode())
@@ -1,3 +1,437 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.apps.common import compression
+from core.apps.common.cache import _version_key, bump_model_version
+from core.apps.common.checks import check_shared_response_cache
+from core.apps.common.metrics import registry
+from core.apps.common.middleware import CompressionMiddleware
+from core.apps.common.routers import PRIMARY_COOKIE, ReadReplicaRouter, use_replica
+from core.apps.common.audit import audit_writer
+from core.apps.common.models import AuditLog, OutboxEvent, Task, WebhookCursor, WebhookDeadLetter
+from core.apps.common.outbox import Dispatcher, record_event
+from core.apps.common.startup import LAZY_MODULES, measure_startup
+from core.apps.common.taskqueue import Worker, enqueue, task
+from core.apps.common.testing import QueryCountTestCase, WebhookReceiver, make_products, make_sale
+from core.apps.common.warmup import warm_up
+from core.apps.billing.models import SalesTransaction
+from core.apps.products.models import Product
+from core.apps.users.authentication import user_cache
+from core.apps.users.models import Customer
+
+
+class PrebuiltSchemaTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'openapi.json.gz')
+        settings_override = override_settings(SCHEMA_ARTIFACT={'PATH': self.path, 'CODE_VERSION': 'v1'})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('build_schema', stdout=io.StringIO())
+
+    def test_served_compressed_with_etag(self):
+        response = self.client.get('/api/schema/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('/products/', json.loads(gzip.decompress(response.content))['paths'])
+
+        plain = self.client.get('/api/schema/')
+        self.assertEqual(plain.content, gzip.decompress(response.content))
+
+        cached = self.client.get('/api/schema/', headers={'if-none-match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_rebuilt_only_when_code_version_changes(self):
+        modified = os.stat(self.path).st_mtime_ns
+        call_command('build_schema', stdout=io.StringIO())
+        self.assertEqual(os.stat(self.path).st_mtime_ns, modified)
+
+        with override_settings(SCHEMA_ARTIFACT={'PATH': self.path, 'CODE_VERSION': 'v2'}):
+            call_command('build_schema', stdout=io.StringIO())
+            call_command('build_schema', check=True, stdout=io.StringIO())
+        with open(f"{self.path}.version") as f:
+            self.assertEqual(f.read(), 'v2')
+
+
+class StartupTests(SimpleTestCase):
+    def test_startup_within_budget(self):
+        seconds, modules, _ = measure_startup()
+        self.assertFalse(set(LAZY_MODULES) & modules, "rarely used modules were imported at startup")
+        self.assertLess(seconds, settings.STARTUP['BUDGET_SECONDS'])
+
+
+class WarmUpTests(QueryCountTestCase):
+    def test_warm_up_fills_auth_and_product_caches(self):
+        sale = make_sale(returned=False)
+        product = sale.items.first().product
+        user_cache.clear()
+        caches['responses'].clear()
+
+        with self.assertLogs('core.apps.common.warmup', 'INFO'):
+            warm_up()
+
+        self.assertIsNotNone(user_cache.get(str(self.user.pk)))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/products/{product.id}/')
+        self.assertEqual(response.data['id'], product.id)
+        self.assertFalse([query for query in queries.captured_queries if 'products_product' in query['sql']])
+
+
+class RequestMetricsTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_server_timing_and_histograms(self):
+        make_products(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/products/')
+        timings = {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(timings), {'db', 'slowest-query', 'app', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+        self.assertIn('desc="products-list"', timings['total'])
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('pos_request_queries_count{view="products-list",method="GET"} 1', metrics)
+        self.assertIn('pos_request_render_duration_seconds_sum{view="products-list",method="GET"}', metrics)
+
+    async def test_queries_counted_under_asgi(self):
+        #the sync view's queries run in a sync_to_async thread, on its own connection
+        response = await AsyncClient().get(
+            '/customers/', headers={'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        db = response['Server-Timing'].split(', ')[0]
+        self.assertGreater(int(db.split('desc="')[1].split()[0]), 0)
+        observed = next(
+            line for line in registry.render().splitlines()
+            if line.startswith('pos_request_queries_sum{view="customers-list"')
+        )
+        self.assertGreater(float(observed.split()[-1]), 0)
+
+    @override_settings(METRICS={**settings.METRICS, 'TOKEN': '', 'ALLOWED_IPS': ['127.0.0.1']})
+    def test_metrics_limited_to_allowed_ips(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 403)
+
+    @override_settings(METRICS={**settings.METRICS, 'TOKEN': 'scrape', 'ALLOWED_IPS': ['127.0.0.1']})
+    def test_metrics_token_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.9', headers={'authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_products(1)[0]
+
+    def price(self):
+        return self.client.get(f'/products/{self.product.id}/').data['selling_price']
+
+    def test_save_invalidates(self):
+        self.assertEqual(self.price(), '10.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/products/{self.product.id}/', {'selling_price': '12.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.price(), '12.00')
+
+    def test_queryset_update_is_cached_until_bumped(self):
+        self.assertEqual(self.price(), '10.00')
+        Product.objects.filter(pk=self.product.pk).update(selling_price=Decimal('11.00'))
+        self.assertEqual(self.price(), '10.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_model_version(Product)
+        self.assertEqual(self.price(), '11.00')
+
+    def test_bump_by_another_worker_invalidates_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={**settings.CACHES, 'responses': backend}):
+                self.assertEqual(self.price(), '10.00')
+                #another process: its own cache object over the same directory
+                Product.objects.filter(pk=self.product.pk).update(selling_price=Decimal('13.00'))
+                FileBasedCache(location, {}).incr(_version_key(Product))
+                self.assertEqual(self.price(), '13.00')
+
+    def test_deploy_check_rejects_per_process_cache(self):
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CACHES={**settings.CACHES, 'responses': locmem}):
+            self.assertEqual([error.id for error in check_shared_response_cache(None)], ['common.W001'])
+        with override_settings(CACHES={**settings.CACHES, 'responses': settings.RESPONSE_CACHE_BACKENDS['file']}):
+            self.assertEqual(check_shared_response_cache(None), [])
+
+
+class ReadYourWritesTests(QueryCountTestCase):
+    def replica_reads(self, path):
+        """Whether each read of GET path asked for the replica"""
+        reads = []
+        caches['responses'].clear()
+
+        def db_for_read(router, model, **hints):
+            reads.append(use_replica.get())
+
+        with mock.patch.object(ReadReplicaRouter, 'db_for_read', db_for_read):
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return set(reads)
+
+    def test_any_write_pins_the_client_to_the_primary(self):
+        self.assertEqual(self.replica_reads('/customers/'), {True})
+        #a viewset that never reads from the replica itself
+        response = self.client.post('/categories/', {'name': "Pinned"}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+        self.assertEqual(self.replica_reads('/customers/'), {False})
+
+    def test_pin_expires(self):
+        self.client.cookies[PRIMARY_COOKIE] = "1.0"
+        self.assertEqual(self.replica_reads('/customers/'), {True})
+
+    def test_reads_and_failed_writes_do_not_pin(self):
+        self.assertNotIn(PRIMARY_COOKIE, self.client.get('/customers/').cookies)
+        response = self.client.post('/categories/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+
+class CompressionTests(QueryCountTestCase):
+    def test_large_responses_compressed_small_ones_not(self):
+        products = make_products(20)
+        plain = self.client.get('/products/')
+        compressed = self.client.get('/products/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+        scan = self.client.get(f'/products/{products[0].id}/', headers={'accept-encoding': 'gzip'})
+        self.assertFalse(scan.has_header('Content-Encoding'))
+
+    def test_cached_responses_reuse_compressed_body(self):
+        make_products(20)
+        with mock.patch('core.apps.common.middleware.compress', wraps=compression.compress) as compress:
+            first = self.client.get('/products/', headers={'accept-encoding': 'gzip'})
+            second = self.client.get('/products/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+
+    def test_streaming_responses_keep_streaming(self):
+        middleware = CompressionMiddleware(lambda request: None)
+        request = RequestFactory().get('/', headers={'accept-encoding': 'gzip'})
+        chunks = [b'a' * 2000, b'b' * 2000]
+        response = middleware.process_response(request, StreamingHttpResponse(iter(chunks)))
+        self.assertTrue(response.streaming)
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    def test_choose_encoding_follows_client_quality(self):
+        with mock.patch.object(compression, 'brotli', object()):
+            self.assertEqual(compression.choose_encoding('gzip;q=1, br;q=0.1'), 'gzip')
+            self.assertEqual(compression.choose_encoding('gzip;q=0.5, br'), 'br')
+            self.assertEqual(compression.choose_encoding('gzip, br'), 'br')
+            self.assertEqual(compression.choose_encoding('br;q=0, *'), 'gzip')
+            self.assertIsNone(compression.choose_encoding('identity'))
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertIsNone(compression.choose_encoding('br'))
+            self.assertEqual(compression.choose_encoding('br, gzip;q=0.2'), 'gzip')
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        middleware = CompressionMiddleware(lambda request: None)
+        request = RequestFactory().get('/', headers={'accept-encoding': 'gzip, br'})
+        response = middleware.process_response(request, HttpResponse(b'x' * 5000))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), b'x' * 5000)
+
+
+calls = []
+
+
+@task('tests.record')
+def record(value):
+    calls.append(('record', value))
+
+
+@task('tests.record_batch', batch=True)
+def record_batch(payloads):
+    calls.append(('batch', [payload['value'] for payload in payloads]))
+
+
+@task('tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError("boom")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_rolls_back_with_the_caller(self):
+        with CaptureQueriesContext(connection) as queries:
+            enqueue('tests.record', {'value': 1})
+        self.assertEqual(len(queries), 1)
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            enqueue('tests.record', {'value': 2})
+            raise ValueError
+        self.assertEqual(list(Task.objects.values_list('payload', flat=True)), [{'value': 1}])
+
+    def test_worker_runs_tasks_and_batches(self):
+        for value in range(3):
+            enqueue('tests.record', {'value': value})
+            enqueue('tests.record_batch', {'value': value})
+        enqueue('tests.record', {'value': 'later'}, delay=60)
+
+        self.assertEqual(Worker().run(burst=True), 6)
+        self.assertEqual(calls, [('record', 0), ('record', 1), ('record', 2), ('batch', [0, 1, 2])])
+        #succeeded tasks are removed, the delayed one is not due yet
+        self.assertEqual(Task.objects.get().payload, {'value': 'later'})
+
+    def test_failed_task_retried_with_backoff_then_kept_as_failed(self):
+        failing = enqueue('tests.fail')
+        unknown = enqueue('tests.missing')
+        worker = Worker()
+
+        with self.assertLogs('core.apps.common.taskqueue', 'ERROR'):
+            worker.run(burst=True)
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Task.StatusChoices.QUEUED, 1))
+        self.assertGreater(failing.run_at, timezone.now())
+        self.assertIn("RuntimeError: boom", failing.last_error)
+        self.assertEqual(Task.objects.get(pk=unknown.pk).status, Task.StatusChoices.FAILED)
+
+        Task.objects.filter(pk=failing.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.apps.common.taskqueue', 'ERROR'):
+            worker.run(burst=True)
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (Task.StatusChoices.FAILED, 2))
+
+    def test_expired_lease_requeued(self):
+        enqueue('tests.record', {'value': 1})
+        Task.objects.update(status=Task.StatusChoices.RUNNING, locked_by='dead', locked_until=timezone.now())
+
+        with self.assertLogs('core.apps.common.taskqueue', 'WARNING'):
+            Worker().run(burst=True)
+        self.assertEqual(calls, [('record', 1)])
+        self.assertFalse(Task.objects.exists())
+
+
+@override_settings(OUTBOX={**settings.OUTBOX, 'BATCH_SIZE': 2, 'MAX_ATTEMPTS': 2})
+class OutboxTests(TestCase):
+    def dispatcher(self, receiver, events=()):
+        return Dispatcher({'erp': {'URL': receiver.url, 'SECRET': 's3cret', 'EVENTS': list(events)}})
+
+    def test_delivers_ordered_signed_batches(self):
+        events = [record_event('sale.created', {'id': n}) for n in range(5)]
+        with WebhookReceiver() as receiver:
+            self.assertEqual(self.dispatcher(receiver).run(burst=True), 5)
+
+        delivered = []
+        for headers, body in receiver.calls:
+            expected = hmac.new(b's3cret', f"{headers['X-POS-Timestamp']}.".encode() + body, hashlib.sha256)
+            self.assertEqual(headers['X-POS-Signature'], f"sha256={expected.hexdigest()}")
+            delivered.append([event['id'] for event in json.loads(body)['events']])
+        ids = [event.id for event in events]
+        self.assertEqual(delivered, [ids[0:2], ids[2:4], ids[4:5]])
+        self.assertEqual(WebhookCursor.objects.get(name='erp').last_event_id, ids[-1])
+
+    def test_failing_batch_retried_then_dead_lettered(self):
+        first = record_event('sale.created', {'id': 1})
+        with WebhookReceiver(status=500) as receiver:
+            dispatcher = self.dispatcher(receiver)
+            with self.assertLogs('core.apps.common.outbox', 'WARNING'):
+                self.assertEqual(dispatcher.dispatch(), 0)
+            cursor = WebhookCursor.objects.get(name='erp')
+            self.assertEqual((cursor.last_event_id, cursor.attempts), (0, 1))
+            self.assertGreater(cursor.next_attempt_at, timezone.now())
+
+            #backing off, nothing is sent until the retry is due
+            self.assertEqual(dispatcher.dispatch(), 0)
+            self.assertEqual(len(receiver.calls), 1)
+
+            WebhookCursor.objects.update(next_attempt_at=None)
+            with self.assertLogs('core.apps.common.outbox', 'ERROR'):
+                dispatcher.dispatch()
+        self.assertEqual(WebhookDeadLetter.objects.get().event, first)
+
+        #later events flow again once the receiver recovers
+        second = record_event('sale.created', {'id': 2})
+        with WebhookReceiver() as receiver:
+            self.assertEqual(self.dispatcher(receiver).run(burst=True), 1)
+        self.assertEqual(json.loads(receiver.calls[0][1])['events'][0]['id'], second.id)
+
+    def test_webhook_receives_only_its_event_types(self):
+        record_event('sale.created', {'id': 1})
+        adjusted = record_event('stock.adjusted', {'id': 2})
+        with WebhookReceiver() as receiver:
+            self.dispatcher(receiver, events=['stock.adjusted']).run(burst=True)
+        self.assertEqual([event['id'] for event in json.loads(receiver.calls[0][1])['events']], [adjusted.id])
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+
+@override_settings(AUDIT={**settings.AUDIT, 'FLUSH_SECONDS': 3600})
+class AuditTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        audit_writer.flush()
+        #never leave entries behind for the exit flush, after the test database is gone
+        self.addCleanup(audit_writer.flush)
+
+    def sell(self, products, quantity='1'):
+        return self.client.post('/sales/', {
+            'payment_method': 'Cash', 'amount_paid': '1000.00',
+            'items': [{'product': product.id, 'quantity': quantity, 'unit_price': '10.00'} for product in products],
+        }, format='json')
+
+    def test_request_user_stamped_on_save_and_bulk_paths(self):
+        products = make_products(2)
+        sale = SalesTransaction.objects.get(pk=self.sell(products).data['id'])
+        self.assertEqual((sale.created_by, sale.updated_by), (self.user, self.user))
+        #stock went through bulk_update
+        updated_by = Product.objects.filter(pk__in=[product.id for product in products]).values_list('updated_by', flat=True)
+        self.assertEqual(set(updated_by), {self.user.id})
+
+        customer_id = self.client.post('/customers/', {'name': 'Walk in'}, format='json').data['id']
+        self.assertEqual(Customer.objects.get(pk=customer_id).created_by, self.user)
+
+    def test_field_changes_written_in_one_batch_after_commit(self):
+        products = make_products(20)
+        with self.captureOnCommitCallbacks(execute=True):
+            sale_id = self.sell(products).data['id']
+        self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertGreater(len(audit_writer), 20)
+
+        with CaptureQueriesContext(connection) as queries:
+            audit_writer.flush()
+        self.assertEqual(len(queries), 1)
+
+        stock = AuditLog.objects.get(model='products.product', object_id=str(products[0].id))
+        self.assertEqual((stock.action, stock.user), (AuditLog.ActionChoices.UPDATE, self.user))
+        self.assertEqual(stock.changes, {'current_stock': ['1000.00', '999.00']})
+        sale = AuditLog.objects.filter(model='billing.salestransaction', object_id=str(sale_id))
+        self.assertEqual(list(sale.order_by('id').values_list('action', flat=True)), ['Create', 'Update'])
+        self.assertEqual(sale.last().changes['total_amount'], ['0.00', '200.00'])
+
+    def test_rolled_back_changes_not_logged(self):
+        product = make_products(1, current_stock=Decimal('1'))[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.sell([product], quantity='2')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(audit_writer), 0)
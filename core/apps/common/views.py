@@ -1,3 +1,220 @@
-from django.shortcuts import render
+import logging
+from functools import wraps
+from inspect import iscoroutinefunction
+from urllib.parse import urlencode
 
-# Create your views here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from core.apps.common.cache import get_model_versions
+from core.apps.common.metrics import registry
+from core.apps.common.routers import pinned_to_primary, use_replica
+from core.apps.common.schema import load_schema_artifact
+from core.apps.users.authentication import CachedJWTAuthentication
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA_METHODS = ('GET', 'HEAD')
+
+
+class ReadReplicaMixin:
+    """
+    Viewset mixin that routes GET/HEAD actions to the read replica.
+    After a client writes, anywhere in the API, its reads stay on the
+    primary for READ_REPLICA['STICKY_SECONDS'] so it always sees its own
+    writes (see ReadYourWritesMiddleware).
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        read_only = request.method in REPLICA_METHODS and not pinned_to_primary(request)
+        self._replica_token = use_replica.set(read_only)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            use_replica.reset(token)
+            self._replica_token = None
+        return response
+
+
+def cache_response(view_method):
+    """
+    Cache the data of a successful response from a viewset action.
+    The viewset must use CachedResponseMixin.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = self.get_response_cache_key(request, kwargs)
+        response_cache = caches['responses']
+
+        data = response_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            #lets CompressionMiddleware reuse the compressed body as well
+            response.compression_cache_key = key
+            return response
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, response.data, settings.RESPONSE_CACHE['TIMEOUT'])
+            response.compression_cache_key = key
+        return response
+    return wrapper
+
+
+def response_cache_key(basename, action, view_kwargs, query_params, models):
+    """Key of a cached response, built from the current versions of the models it depends on"""
+    versions = get_model_versions(models)
+    params = urlencode(sorted(query_params), doseq=True)
+    lookup = urlencode(sorted(view_kwargs.items()))
+    return (
+        f"response:{basename}:{action}:{lookup}:{params}:"
+        f"{'.'.join(str(version) for version in versions)}"
+    )
+
+
+class CachedResponseMixin:
+    """
+    Viewset mixin that caches list and retrieve responses.
+    Keys include the version of every model in `cache_models`, which is
+    bumped whenever one of them is saved, deleted or bulk updated, so a
+    write invalidates every response built from that model.
+    Permissions are checked before the cache is consulted.
+    """
+    cache_models = ()
+
+    def get_cache_models(self):
+        return self.cache_models or (self.queryset.model,)
+
+    def get_response_cache_key(self, request, view_kwargs):
+        return response_cache_key(
+            self.basename, self.action, view_kwargs, request.query_params.lists(), self.get_cache_models()
+        )
+
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class ValuesReadMixin:
+    """
+    Viewset mixin serving list and retrieve through `values_serializer_class`,
+    a ValuesSerializer producing the same JSON as `serializer_class` from
+    plain rows. Paginated viewsets keep the regular path. Only for viewsets
+    without object-level permissions, since no instance is built to check.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(self.values_serializer_class(queryset).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            data = self.values_serializer_class(
+                queryset.filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+            ).data
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+
+def json_response(data, status=200):
+    """Render data the way DRF's JSONRenderer does for the regular API"""
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def async_read_view(view):
+    """
+    Turn an async function into a read-only API view for ASGI.
+    The request is authenticated with the API's JWT authentication
+    without leaving the event loop on a cache hit, errors are rendered
+    like DRF's, and queries go to the read replica unless the client
+    is pinned to the primary.
+    """
+    assert iscoroutinefunction(view), "async_read_view needs an async function"
+    authenticator = CachedJWTAuthentication()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in REPLICA_METHODS:
+            return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            authenticated = await authenticator.aauthenticate(request)
+            if authenticated is None:
+                raise exceptions.NotAuthenticated()
+        except exceptions.APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            response = json_response(detail, status=exc.status_code)
+            response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return response
+        request.user, request.auth = authenticated
+
+        token = use_replica.set(not pinned_to_primary(request))
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            use_replica.reset(token)
+    return wrapper
+
+
+def metrics_view(request):
+    """Expose the request metrics of this worker in Prometheus text format"""
+    token = settings.METRICS['TOKEN']
+    if token:
+        allowed = request.headers.get('Authorization') == f"Bearer {token}"
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in settings.METRICS['ALLOWED_IPS']
+    if not allowed:
+        return HttpResponseForbidden()
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
+
+
+@require_safe
+def schema_view(request):
+    """
+    Serve the OpenAPI schema prebuilt by `manage.py build_schema` as JSON,
+    gzip encoded when the client accepts it and revalidated by ETag.
+    Falls back to live generation when no schema has been built.
+    """
+    artifact = load_schema_artifact()
+    if artifact is None:
+        from drf_spectacular.views import SpectacularAPIView
+        logger.warning("No prebuilt schema, generating it per request; run `manage.py build_schema`")
+        return SpectacularAPIView.as_view()(request)
+
+    if artifact.etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(artifact.compressed, content_type='application/vnd.oai.openapi+json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(artifact.body, content_type='application/vnd.oai.openapi+json')
+
+    response['ETag'] = artifact.etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,77 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Count, F
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+#sales looked at to find the best selling products
+BEST_SELLER_DAYS = 30
+
+
+def warm_auth_cache(limit):
+    """Load the most recently active users into the JWT authentication cache"""
+    from core.apps.users.authentication import cache_user, user_version
+    from core.apps.users.models import User
+
+    version = user_version()
+    users = User.objects.filter(is_active=True).order_by(F('last_login').desc(nulls_last=True), '-id')[:limit]
+    count = 0
+    for user in users:
+        cache_user(user, version)
+        count += 1
+    return count
+
+
+def warm_product_cache(limit):
+    """Cache the product detail responses of the best selling products, as scanned at the till"""
+    from core.apps.billing.models import SalesTransactionItem
+    from core.apps.common.views import response_cache_key
+    from core.apps.products.views import ProductViewSet
+
+    since = timezone.now() - timedelta(days=BEST_SELLER_DAYS)
+    best_sellers = list(
+        SalesTransactionItem.objects.filter(transaction__transaction_date__gte=since)
+        .values('product').annotate(sold=Count('id')).order_by('-sold')
+        .values_list('product', flat=True)[:limit]
+    )
+    queryset = ProductViewSet.queryset.filter(pk__in=best_sellers)
+    products = ProductViewSet.values_serializer_class(queryset).data
+
+    response_cache = caches['responses']
+    response_cache.set_many({
+        #keyed exactly like a GET /products/<pk>/ through CachedResponseMixin
+        response_cache_key('products', 'retrieve', {'pk': str(product['id'])}, [], ProductViewSet.cache_models): product
+        for product in products
+    }, settings.RESPONSE_CACHE['TIMEOUT'])
+    return len(products)
+
+
+def warm_up():
+    """Fill the per-process caches hot paths depend on, before the worker takes traffic"""
+    started = time.perf_counter()
+    users = warm_auth_cache(settings.STARTUP['WARM_UP_USERS'])
+    products = warm_product_cache(settings.STARTUP['WARM_UP_PRODUCTS'])
+    logger.info(
+        "Warmed up %s users and %s products in %.0f ms",
+        users, products, (time.perf_counter() - started) * 1000
+    )
+
+
+def warm_up_if_enabled():
+    """Run warm_up() when STARTUP['WARM_UP'] is on; a failure is logged and never stops the worker"""
+    if not settings.STARTUP['WARM_UP']:
+        return
+    try:
+        warm_up()
+    except Exception:
+        logger.exception("Worker warm-up failed, starting with cold caches")
+    finally:
+        #never hand a connection opened here to forked workers
+        connections.close_all()
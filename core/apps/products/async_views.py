@@ -0,0 +1,40 @@
+from django.db.models import Q
+
+from core.apps.common.views import async_read_view, json_response
+from core.apps.products.serializers import ProductValuesSerializer
+from core.apps.products.views import ProductViewSet
+
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+@async_read_view
+async def product_scan(request):
+    """Find a product by barcode or SKU, as scanned at the till"""
+    code = request.GET.get('code', '').strip()
+    if not code:
+        return json_response({'code': ['This query parameter is required.']}, status=400)
+
+    queryset = ProductViewSet.queryset.filter(Q(barcode=code) | Q(sku=code)).order_by('id')[:1]
+    products = await ProductValuesSerializer().ato_representation(queryset)
+    if not products:
+        return json_response({'detail': 'No product matches this code.'}, status=404)
+    return json_response(products[0])
+
+
+@async_read_view
+async def product_search(request):
+    """Search products by name, SKU or barcode"""
+    term = request.GET.get('q', '').strip()
+    if not term:
+        return json_response({'q': ['This query parameter is required.']}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return json_response({'limit': ['A valid integer is required.']}, status=400)
+
+    queryset = ProductViewSet.queryset.filter(
+        Q(name__icontains=term) | Q(sku__istartswith=term) | Q(barcode__startswith=term)
+    ).order_by('name', 'id')[:limit]
+    return json_response(await ProductValuesSerializer().ato_representation(queryset))
@@ -34,7 +34,8 @@ class Product(TimeStampModelMixin, AuditModelMixin):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     sku = models.CharField(max_length=50, unique=True)  # Stock Keeping Unit
-    barcode = models.CharField(max_length=50, blank=True)
+    #till scans and the barcode prefix search look products up by it
+    barcode = models.CharField(max_length=50, blank=True, db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='products')
     supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name='products')
     purchase_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from core.apps.common.serializers import (
+    BulkPrimaryKeyRelatedField, BulkRelatedListSerializer, ValuesSerializer, decimal_to_string
+)
 from core.apps.products.models import (
     Category, Supplier, Product, PurchaseOrder, PurchaseOrderItem,
     InventoryAdjustment, ProductPurchasePriceHistory
@@ -35,11 +38,34 @@ class ProductSerializer(serializers.ModelSerializer):
         return data
 
 
+class ProductValuesSerializer(ValuesSerializer):
+    """Values based equivalent of ProductSerializer for the read endpoints"""
+    model = Product
+    fields = (
+        ('id', 'id', None),
+        ('name', 'name', None),
+        ('description', 'description', None),
+        ('sku', 'sku', None),
+        ('barcode', 'barcode', None),
+        ('category', 'category_id', None),
+        ('category_name', 'category__name', None),
+        ('supplier', 'supplier_id', None),
+        ('supplier_name', 'supplier__name', None),
+        ('purchase_price', 'purchase_price', decimal_to_string),
+        ('selling_price', 'selling_price', decimal_to_string),
+        ('current_stock', 'current_stock', decimal_to_string),
+        ('minimum_stock', 'minimum_stock', decimal_to_string),
+        ('unit_of_measurement', 'unit_of_measurement', None),
+    )
+
+
 class PurchaseOrderItemSerializer(serializers.ModelSerializer):
+    product = BulkPrimaryKeyRelatedField(queryset=Product.objects.all())
     product_name = serializers.CharField(source='product.name', read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True) 
     class Meta:
         model = PurchaseOrderItem
+        list_serializer_class = BulkRelatedListSerializer
         fields = [
             'id', 'product', 'product_name', 'quantity', 'unit_price', 
             'received_quantity', 'total_price'
@@ -0,0 +1,20 @@
+import logging
+
+from django.db.models import F
+
+from core.apps.common.taskqueue import task
+from core.apps.products.models import Product
+
+
+logger = logging.getLogger(__name__)
+
+
+@task('products.check_low_stock', batch=True)
+def check_low_stock(payloads):
+    """Warn about products at or below their minimum stock, for every queued check at once"""
+    product_ids = {product_id for payload in payloads for product_id in payload['product_ids']}
+    low = Product.objects.filter(id__in=product_ids, current_stock__lte=F('minimum_stock')).values_list(
+        'id', 'name', 'current_stock', 'minimum_stock'
+    )
+    for product_id, name, current_stock, minimum_stock in low:
+        logger.warning("Low stock: %s (#%s) has %s left, minimum %s", name, product_id, current_stock, minimum_stock)
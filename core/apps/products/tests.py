@@ -1,3 +1,273 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.db.models import Q
+from django.test import AsyncClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.apps.common.models import OutboxEvent
+from core.apps.common.testing import QueryCountTestCase, ValuesParityTestCase, make_products
+from core.apps.products.models import (
+    Product, PurchaseOrder, PurchaseOrderItem, InventoryAdjustment, ProductPurchasePriceHistory
+)
+from core.apps.products.serializers import ProductSerializer
+
+
+def make_purchase_order(items=2):
+    products = make_products(items)
+    purchase_order = PurchaseOrder.objects.create(supplier=products[0].supplier)
+    PurchaseOrderItem.objects.bulk_create([
+        PurchaseOrderItem(purchase_order=purchase_order, product=product, quantity=Decimal('10'), unit_price=Decimal('4.00'))
+        for product in products
+    ])
+    return purchase_order
+
+
+class CategoryQueryCountTests(QueryCountTestCase):
+    def test_list(self):
+        self.assertConstantQueries(make_products, lambda _: self.client.get('/categories/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(1)[0].category,
+            lambda category: self.client.get(f'/categories/{category.id}/'),
+        )
+
+
+class SupplierQueryCountTests(QueryCountTestCase):
+    def test_list(self):
+        self.assertConstantQueries(make_products, lambda _: self.client.get('/suppliers/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(1)[0].supplier,
+            lambda supplier: self.client.get(f'/suppliers/{supplier.id}/'),
+        )
+
+
+class ProductQueryCountTests(QueryCountTestCase):
+    def test_list(self):
+        self.assertConstantQueries(make_products, lambda _: self.client.get('/products/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(1)[0],
+            lambda product: self.client.get(f'/products/{product.id}/'),
+        )
+
+    def test_low_stocks(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(scale, current_stock=Decimal('1'), minimum_stock=Decimal('5')),
+            lambda _: self.client.get('/products/low_stocks/'),
+        )
+
+    def test_price_history(self):
+        def setup(scale):
+            product = make_products(1)[0]
+            ProductPurchasePriceHistory.objects.bulk_create([
+                ProductPurchasePriceHistory(
+                    product=product, purchase_price=Decimal('4.00'),
+                    purchase_order=make_purchase_order(1), quantity_received=Decimal('1'),
+                )
+                for _ in range(scale)
+            ])
+            return product, scale
+
+        self.assertConstantQueries(
+            setup,
+            lambda state: self.client.get(f'/products/{state[0].id}/price_history/?limit={state[1]}'),
+        )
+
+    def test_adjust_stock(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(1)[0],
+            lambda product: self.client.post(
+                f'/products/{product.id}/adjust_stock/',
+                {'adjustment_type': 'Increase', 'quantity': '5', 'reason': 'count'}, format='json',
+            ),
+        )
+
+
+
+class ProductValuesParityTests(ValuesParityTestCase):
+    def setUp(self):
+        super().setUp()
+        make_products(2)
+        make_products(
+            1, name="Çay 500g", description="Line one\nline two", barcode="8690000000017",
+            purchase_price=Decimal('0.05'), selling_price=Decimal('12345678.90'),
+            current_stock=Decimal('2.5'), minimum_stock=Decimal('0'),
+            unit_of_measurement=Product.UnitChoices.KG,
+        )
+
+    def test_list(self):
+        self.assertMatchesSerializer(
+            '/products/', ProductSerializer, Product.objects.select_related('category', 'supplier'), many=True
+        )
+
+    def test_retrieve(self):
+        product = Product.objects.last()
+        self.assertMatchesSerializer(f'/products/{product.id}/', ProductSerializer, product)
+
+    def test_retrieve_missing(self):
+        self.assertEqual(self.client.get('/products/0/').status_code, 404)
+        self.assertEqual(self.client.get('/products/abc/').status_code, 404)
+
+
+
+class AsyncProductEndpointTests(ValuesParityTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_products(1, barcode="8690000000017")[0]
+        make_products(2)
+        self.async_client = AsyncClient()
+        self.auth = {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_scan_matches_retrieve(self):
+        expected = await self.async_client.get(f'/products/{self.product.id}/', headers=self.auth)
+        for code in (self.product.barcode, self.product.sku):
+            response = await self.async_client.get('/async/products/scan/', {'code': code}, headers=self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content)
+
+    def test_scan_searches_indexes(self):
+        plan = Product.objects.filter(Q(barcode=self.product.barcode) | Q(sku=self.product.barcode)).explain()
+        self.assertIn('products_product_barcode', plan)
+        self.assertNotIn('SCAN products_product', plan)
+
+    async def test_scan_unknown_code(self):
+        response = await self.async_client.get('/async/products/scan/', {'code': 'missing'}, headers=self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_search(self):
+        response = await self.async_client.get('/async/products/search/', {'q': self.product.sku}, headers=self.auth)
+        self.assertEqual([row['id'] for row in response.json()], [self.product.id])
+
+    async def test_requires_authentication(self):
+        response = await AsyncClient().get('/async/products/search/', {'q': 'Product'})
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+
+class PurchaseOrderQueryCountTests(QueryCountTestCase):
+    def test_list(self):
+        self.assertConstantQueries(
+            lambda scale: [make_purchase_order() for _ in range(scale)],
+            lambda _: self.client.get('/purchase_orders/'),
+        )
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            make_purchase_order,
+            lambda purchase_order: self.client.get(f'/purchase_orders/{purchase_order.id}/'),
+        )
+
+    def test_create(self):
+        def payload(scale):
+            products = make_products(scale)
+            return {
+                'supplier': products[0].supplier_id,
+                'items': [{'product': product.id, 'quantity': '3', 'unit_price': '4.00'} for product in products],
+            }
+
+        self.assertConstantQueries(
+            payload, lambda data: self.client.post('/purchase_orders/', data, format='json')
+        )
+
+    def test_update(self):
+        def setup(scale):
+            purchase_order = make_purchase_order(scale)
+            items = [
+                {'id': item.id, 'product': item.product_id, 'quantity': '7', 'unit_price': '4.50'}
+                for item in purchase_order.items.all()
+            ]
+            return purchase_order, {'items': items}
+
+        self.assertConstantQueries(
+            setup,
+            lambda state: self.client.patch(f'/purchase_orders/{state[0].id}/', state[1], format='json'),
+        )
+
+    def test_complete(self):
+        def setup(scale):
+            purchase_order = make_purchase_order(scale)
+            received = {str(item_id): 10 for item_id in purchase_order.items.values_list('id', flat=True)}
+            return purchase_order, {'received_quantities': received}
+
+        self.assertConstantQueries(
+            setup,
+            lambda state: self.client.post(f'/purchase_orders/{state[0].id}/complete/', state[1], format='json'),
+        )
+
+    def test_complete_writes_outbox_event(self):
+        purchase_order = make_purchase_order(1)
+        item = purchase_order.items.get()
+        self.client.post(
+            f'/purchase_orders/{purchase_order.id}/complete/', {'received_quantities': {str(item.id): 4}}, format='json'
+        )
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.event_type, 'purchase_order.completed')
+        self.assertEqual(event.payload['items'][0]['received_quantity'], '4.00')
+
+
+class InventoryAdjustmentQueryCountTests(QueryCountTestCase):
+    def make_adjustments(self, scale):
+        return InventoryAdjustment.objects.bulk_create([
+            InventoryAdjustment(
+                product=product, adjustment_type=InventoryAdjustment.AdjustmentTypeChoices.INCREASE,
+                quantity=Decimal('1'), reason='count', created_by=self.user,
+            )
+            for product in make_products(scale)
+        ])
+
+    def test_list(self):
+        self.assertConstantQueries(self.make_adjustments, lambda _: self.client.get('/inventory_adjustment/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: self.make_adjustments(1)[0],
+            lambda adjustment: self.client.get(f'/inventory_adjustment/{adjustment.id}/'),
+        )
+
+    def test_create(self):
+        self.assertConstantQueries(
+            lambda scale: make_products(1)[0],
+            lambda product: self.client.post('/inventory_adjustment/', {
+                'product': product.id, 'adjustment_type': 'Increase', 'quantity': '2', 'reason': 'count',
+            }, format='json'),
+        )
+
+
+class InventoryAdjustmentTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_products(1, current_stock=Decimal('3.00'))[0]
+
+    def assertNothingApplied(self, response):
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertIn('quantity', response.data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.current_stock, Decimal('3.00'))
+        self.assertFalse(InventoryAdjustment.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_adjust_stock_commits_adjustment_and_event_together(self):
+        response = self.client.post(
+            f'/products/{self.product.id}/adjust_stock/',
+            {'adjustment_type': 'Decrease', 'quantity': '2', 'reason': 'broken'}, format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.current_stock, Decimal('1.00'))
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event_type, event.payload['id']), ('stock.adjusted', response.data['adjustment_id']))
+
+    def test_adjust_stock_without_enough_stock(self):
+        self.assertNothingApplied(self.client.post(
+            f'/products/{self.product.id}/adjust_stock/',
+            {'adjustment_type': 'Decrease', 'quantity': '5', 'reason': 'broken'}, format='json',
+        ))
+
+    def test_create_without_enough_stock(self):
+        self.assertNothingApplied(self.client.post('/inventory_adjustment/', {
+            'product': self.product.id, 'adjustment_type': 'Decrease', 'quantity': '5', 'reason': 'broken',
+        }, format='json'))
@@ -1,4 +1,7 @@
 from django.core.exceptions import ValidationError
+from core.apps.common.outbox import record_event
+from core.apps.common.serializers import decimal_to_string
+from core.apps.common.taskqueue import enqueue
 from core.apps.products.models import InventoryAdjustment
 
 def apply_inventory_adjustment(adjustment):
@@ -12,4 +15,15 @@ def apply_inventory_adjustment(adjustment):
         if product.current_stock < quantity:
             raise ValidationError("Not enough stock for this adjustment")
         product.current_stock -= quantity
-    product.save()
\ No newline at end of file
+    product.save()
+    #outbox event, committed with the adjustment
+    record_event('stock.adjusted', {
+        'id': adjustment.id,
+        'product': product.id,
+        'adjustment_type': adjustment_type,
+        'quantity': decimal_to_string(quantity),
+        'current_stock': decimal_to_string(product.current_stock),
+        'reason': adjustment.reason,
+    })
+    if adjustment_type == InventoryAdjustment.AdjustmentTypeChoices.DECREASE:
+        enqueue('products.check_low_stock', {'product_ids': [product.id]})
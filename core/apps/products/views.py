@@ -1,7 +1,8 @@
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import F
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, status, permissions
+from rest_framework import exceptions, viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -11,28 +12,51 @@ from core.apps.products.models import (
 )
 from core.apps.products.serializers import (
     CategorySerializer, SupplierSerializer, ProductSerializer, PurchaseOrderSerializer,
-    InventoryAdjustmentSerializer, ProductPurchasePriceHistorySerializer, AdjustStockSerializer
+    InventoryAdjustmentSerializer, ProductPurchasePriceHistorySerializer, AdjustStockSerializer,
+    ProductValuesSerializer
 )
 from core.apps.products.utils import apply_inventory_adjustment
+from core.apps.users.models import User
 from core.apps.users.permissions import IsSuperUser, IsAdmin
+from core.apps.common.cache import bump_model_version
+from core.apps.common.outbox import record_event
+from core.apps.common.serializers import decimal_to_string
+from core.apps.common.views import ReadReplicaMixin, CachedResponseMixin, ValuesReadMixin, cache_response
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def save_adjustment(serializer, **fields):
+    """
+    Save an inventory adjustment and apply it to its product in one
+    transaction, with its outbox event. Not enough stock rolls all of it
+    back and is a 400.
+    """
+    try:
+        with transaction.atomic():
+            adjustment = serializer.save(**fields)
+            apply_inventory_adjustment(adjustment)
+    except ValidationError as e:
+        raise exceptions.ValidationError({'quantity': e.messages})
+    return adjustment
+
+
+class CategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedResponseMixin, ValuesReadMixin, ReadReplicaMixin, viewsets.ModelViewSet):
     queryset = Product.objects.select_related('category', 'supplier')
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (Product, Category, Supplier, ProductPurchasePriceHistory)
     
     def get_permissions(self):
         """Override to set different permissions for different actions"""
@@ -52,15 +76,13 @@ class ProductViewSet(viewsets.ModelViewSet):
         ]
     )    
     @action(detail=True, methods=['post'])
-    @transaction.atomic
     def adjust_stock(self, request, pk=None):
         """Custom action to adjust product stock"""
         product = self.get_object()
         serializer = AdjustStockSerializer(data=request.data)
         
         if serializer.is_valid():
-            adjustment = serializer.save(product=product, created_by=request.user)
-            apply_inventory_adjustment(adjustment)
+            adjustment = save_adjustment(serializer, product=product, created_by=request.user)
             return Response({
                 'message': 'Stock adjusted successfully',
                 'stock_after_adjustment': product.current_stock,
@@ -70,6 +92,7 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
+    @cache_response
     def low_stocks(self, request):
         """Get products with low stock"""
         low_stock_products = self.get_queryset().filter(
@@ -95,11 +118,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         ]
     )
     @action(detail=True, methods=['get'])
+    @cache_response
     def price_history(self, request, pk=None):
         product = self.get_object()
         limit = int(request.query_params.get('limit', 5))
         
-        price_history = product.purchase_price_history.all()[:limit]
+        price_history = product.purchase_price_history.select_related('purchase_order')[:limit]
         serializer = ProductPurchasePriceHistorySerializer(price_history, many=True)
         
         return Response(
@@ -112,10 +136,11 @@ class ProductViewSet(viewsets.ModelViewSet):
         )
 
 
-class PurchaseOrderViewSet(viewsets.ModelViewSet):
+class PurchaseOrderViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = PurchaseOrder.objects.select_related('supplier').prefetch_related('items__product')
     serializer_class = PurchaseOrderSerializer
     permission_classes = [IsSuperUser | IsAdmin]
+    cache_models = (PurchaseOrder, PurchaseOrderItem, Supplier, Product)
     
     def create(self, request, *args, **kwargs):
         """Create a draft (PENDING) purchase order"""
@@ -135,10 +160,14 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     for item_data in items_data
                 ]
                 PurchaseOrderItem.objects.bulk_create(items_to_create)
+                #bulk_create does not send signals
+                bump_model_version(PurchaseOrderItem)
             
             #calculate total amount
             self._calculate_total(purchase_order)
         
+        #reload through the viewset queryset so nested items are prefetched
+        purchase_order = self.get_queryset().get(pk=purchase_order.pk)
         return Response(
             self.get_serializer(purchase_order).data,
             status=status.HTTP_201_CREATED
@@ -195,6 +224,10 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 if items_to_update:
                     update_fields = ['product', 'quantity', 'unit_price']
                     PurchaseOrderItem.objects.bulk_update(items_to_update, update_fields)
+                
+                #bulk operations do not send signals
+                if items_to_create or items_to_update:
+                    bump_model_version(PurchaseOrderItem)
 
                 #bulk delete items that are no longer needed
                 items_to_delete = set(existing_items.keys()) - items_to_keep
@@ -235,21 +268,23 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 #update received quantities if provided
                 if received_quantities:
                     items_to_update = []
+                    #items are prefetched with the purchase order, look them up in memory
+                    order_items = {str(item.id): item for item in purchase_order.items.all()}
                     
                     for item_id, received_qty in received_quantities.items():
-                        try:
-                            item = purchase_order.items.get(id=item_id)
-                            if received_qty > item.quantity:
-                                raise ValidationError(
-                                    "Received quantity exceeded ordered quantity"
-                                )
-                            item.received_quantity = received_qty
-                            items_to_update.append(item)
-                        except PurchaseOrderItem.DoesNotExist:
+                        item = order_items.get(str(item_id))
+                        if item is None:
                             raise ValidationError(f"Product with id {item_id} not found in this purchase order")
+                        if received_qty > item.quantity:
+                            raise ValidationError(
+                                "Received quantity exceeded ordered quantity"
+                            )
+                        item.received_quantity = received_qty
+                        items_to_update.append(item)
 
                     #bulk update all items
                     PurchaseOrderItem.objects.bulk_update(items_to_update, ['received_quantity'])
+                    bump_model_version(PurchaseOrderItem)
                 
                 #update inventory and track purchase prices
                 self._update_inventory_and_prices(purchase_order)
@@ -258,6 +293,22 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 purchase_order.status = PurchaseOrder.StatusChoices.COMPLETED
                 purchase_order.save(update_fields=['status'])
                 
+                #outbox event, committed with the completion
+                record_event('purchase_order.completed', {
+                    'id': purchase_order.id,
+                    'supplier': purchase_order.supplier_id,
+                    'total_amount': decimal_to_string(purchase_order.total_amount),
+                    'items': [
+                        {
+                            'product': item.product_id,
+                            'quantity': decimal_to_string(item.quantity),
+                            'received_quantity': decimal_to_string(item.received_quantity),
+                            'unit_price': decimal_to_string(item.unit_price),
+                        }
+                        for item in purchase_order.items.all()
+                    ],
+                })
+                
                 # serializer = self.get_serializer(purchase_order)
                 return Response({"message":"Purchase Order completed successfully."}, status=status.HTTP_200_OK)
         
@@ -319,19 +370,19 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
             if price_history_to_create:
                 update_fields.append('purchase_price')
             Product.objects.bulk_update(products_to_update, update_fields)
+            bump_model_version(Product)
         
         #bulk create price history records
         if price_history_to_create:
             ProductPurchasePriceHistory.objects.bulk_create(price_history_to_create)
+            bump_model_version(ProductPurchasePriceHistory)
 
 
-class InventoryAdjustmentViewSet(viewsets.ModelViewSet):
+class InventoryAdjustmentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = InventoryAdjustment.objects.select_related('product', 'created_by')
     serializer_class = InventoryAdjustmentSerializer
     permission_classes = [IsSuperUser | IsAdmin]
+    cache_models = (InventoryAdjustment, Product, User)
     
     def perform_create(self, serializer):
-        user = self.request.user
-        adjustment = serializer.save(created_by=user)
-
-        apply_inventory_adjustment(adjustment)
+        save_adjustment(serializer, created_by=self.request.user)
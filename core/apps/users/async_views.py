@@ -0,0 +1,37 @@
+from django.db.models import Q
+
+from core.apps.common.views import async_read_view, json_response
+from core.apps.users.models import Customer
+from core.apps.users.serializers import CustomerValuesSerializer
+
+
+LOOKUP_LIMIT = 20
+
+
+@async_read_view
+async def customer_lookup(request):
+    """Find customers by phone number, email or name"""
+    term = request.GET.get('q', '').strip()
+    if not term:
+        return json_response({'q': ['This query parameter is required.']}, status=400)
+
+    queryset = Customer.objects.filter(
+        Q(phone__startswith=term) | Q(email__iexact=term) | Q(name__icontains=term)
+    ).order_by('name', 'id')[:LOOKUP_LIMIT]
+    return json_response(await CustomerValuesSerializer().ato_representation(queryset))
+
+
+@async_read_view
+async def customer_balance_summary(request, pk):
+    """Async counterpart of /customers/<pk>/balance_summary/ with the same response"""
+    try:
+        outstanding_balance = await Customer.objects.values_list('outstanding_balance', flat=True).aget(pk=pk)
+    except Customer.DoesNotExist:
+        return json_response({'error': 'Customer not found.'}, status=400)
+
+    return json_response({
+        'outstanding_balance': outstanding_balance,
+        'balance_status': 'No balance' if outstanding_balance == 0 else
+                        'Credit available' if outstanding_balance < 0 else
+                        'Amount owed'
+    })
@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from core.apps.common.cache import TTLCache, aget_model_versions, get_model_versions
+from core.apps.users.models import User
+
+
+_cache_settings = getattr(settings, 'AUTH_USER_CACHE', {})
+user_cache = TTLCache(
+    max_entries=_cache_settings.get('MAX_ENTRIES', 1024),
+    timeout=_cache_settings.get('TIMEOUT', 60),
+)
+
+#every concrete column is cached so the rebuilt user never lazy loads a field
+#keys are str because the token claim carries the user id as a string
+_USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+
+
+def user_version():
+    """
+    The User model version in the shared response cache. Any worker that
+    saves or soft deletes a user bumps it, so entries cached under an
+    older version are misses in every worker sharing that cache.
+    """
+    version, = get_model_versions([User])
+    return version
+
+
+async def auser_version():
+    """Async variant of user_version for aget_user"""
+    version, = await aget_model_versions([User])
+    return version
+
+
+def cache_user(user, version):
+    """Store the resolved state of a user in the auth cache, as of version"""
+    user_cache.set(str(user.pk), (version, tuple(getattr(user, attname) for attname in _USER_FIELDS)))
+
+
+def invalidate_user(user_id):
+    """Drop a user from the auth cache"""
+    user_cache.delete(str(user_id))
+
+
+def get_cached_user(user_id, version):
+    """Return a fresh User instance built from the auth cache, or None on a miss or an older version"""
+    entry = user_cache.get(str(user_id))
+    if entry is None or entry[0] != version:
+        return None
+    return User.from_db('default', _USER_FIELDS, entry[1])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token user from an in-process cache.
+    Deleted users are kept in the cache as well, so they are rejected
+    without a query until the entry expires or the User version moves.
+    """
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from e
+
+    def _check_user(self, user, validated_token):
+        if user.is_deleted:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        #read before the user, a change committed in between leaves the entry stale
+        version = user_version()
+
+        user = get_cached_user(user_id, version)
+        if user is None:
+            try:
+                #all_objects so soft deleted users are cached as deleted too
+                user = User.all_objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist as e:
+                raise AuthenticationFailed(
+                    _("User not found"), code="user_not_found"
+                ) from e
+            cache_user(user, version)
+
+        return self._check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        #read before the user, a change committed in between leaves the entry stale
+        version = await auser_version()
+
+        user = get_cached_user(user_id, version)
+        if user is None:
+            try:
+                user = await User.all_objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist as e:
+                raise AuthenticationFailed(
+                    _("User not found"), code="user_not_found"
+                ) from e
+            cache_user(user, version)
+
+        return self._check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """Async variant of authenticate() for plain Django async views"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
@@ -0,0 +1,108 @@
+import logging
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+from core.apps.common.audit import get_current_user
+from core.apps.common.cache import bump_model_version
+from core.apps.users.models import Customer, CustomerLedgerEntry, CustomerBalanceSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+ZERO = Value(0, output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def post_entry(customer_id, entry_type, amount, reference='', notes=''):
+    """
+    Move a customer's outstanding balance by amount, positive when the
+    customer owes more, and append the matching ledger entry.
+
+    The balance is moved with one UPDATE ... SET balance = balance + amount,
+    so concurrent writers never lose each other's changes, and read back
+    inside the same transaction for the entry's running balance: the row
+    stays write locked until commit, nobody can move it in between.
+    """
+    with transaction.atomic():
+        #rounded in the statement: SQLite adds decimals as floats and would let the stored balance drift
+        Customer.objects.filter(pk=customer_id).update(outstanding_balance=Round(F('outstanding_balance') + amount, 2))
+        balance = Customer.objects.filter(pk=customer_id).values_list('outstanding_balance', flat=True).get()
+        entry = CustomerLedgerEntry.objects.create(
+            customer_id=customer_id, entry_type=entry_type, amount=amount, balance_after=balance,
+            reference=reference, notes=notes, created_by=get_current_user(),
+        )
+        #update() sends no signals, cached customer responses hold the old balance
+        bump_model_version(Customer)
+    return entry
+
+
+def locked_balance(customer_id):
+    """
+    The outstanding balance of a customer, locked until the end of the
+    transaction where the database supports it, for decisions such as
+    how much credit a sale may use
+    """
+    return Customer.objects.select_for_update().values_list('outstanding_balance', flat=True).get(pk=customer_id)
+
+
+def _latest_balance(customer_ref, upto=None):
+    entries = CustomerLedgerEntry.objects.filter(customer_id=customer_ref)
+    if upto is not None:
+        entries = entries.filter(id__lte=upto)
+    return Subquery(entries.order_by('-id').values('balance_after')[:1])
+
+
+def take_snapshots():
+    """
+    Snapshot the balance of every customer with entries since the last
+    snapshot and check the ledger while doing so: the previous snapshot
+    plus the sum of the new entries must equal the running balance of the
+    last one. Returns the number of snapshots written and the ids of the
+    customers whose ledger does not add up.
+    """
+    with transaction.atomic():
+        previous = CustomerBalanceSnapshot.objects.aggregate(upto=Max('last_entry_id'))['upto'] or 0
+        upto = CustomerLedgerEntry.objects.aggregate(upto=Max('id'))['upto'] or 0
+        if upto <= previous:
+            return 0, []
+
+        #one grouped query for the whole period, the subqueries walk the (customer, id) indexes
+        movements = (
+            CustomerLedgerEntry.objects.filter(id__gt=previous, id__lte=upto)
+            .values('customer_id')
+            .annotate(
+                total=Sum('amount'),
+                prior=Coalesce(Subquery(
+                    CustomerBalanceSnapshot.objects.filter(customer_id=OuterRef('customer_id'))
+                    .order_by('-last_entry_id').values('balance')[:1]
+                ), ZERO),
+                ledger_balance=_latest_balance(OuterRef('customer_id'), upto),
+            )
+            .order_by()
+        )
+        snapshots, mismatched = [], []
+        for row in movements:
+            balance = row['prior'] + row['total']
+            if balance != row['ledger_balance']:
+                mismatched.append(row['customer_id'])
+                logger.error(
+                    "Ledger of customer #%s does not add up: %s + %s != %s",
+                    row['customer_id'], row['prior'], row['total'], row['ledger_balance'],
+                )
+            snapshots.append(CustomerBalanceSnapshot(customer_id=row['customer_id'], balance=balance, last_entry_id=upto))
+        CustomerBalanceSnapshot.objects.bulk_create(snapshots, batch_size=500)
+    return len(snapshots), mismatched
+
+
+def balance_mismatches():
+    """
+    Ids of the customers whose outstanding balance differs from the running
+    balance of their latest ledger entry, checked in a single statement so
+    concurrent writers cannot produce false alarms
+    """
+    return list(
+        Customer.objects.annotate(ledger_balance=Coalesce(_latest_balance(OuterRef('pk')), ZERO))
+        .exclude(outstanding_balance=F('ledger_balance'))
+        .values_list('id', flat=True)
+    )
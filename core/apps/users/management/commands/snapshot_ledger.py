@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apps.users.ledger import balance_mismatches, take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot customer balances from the ledger and check them, failing when a ledger does not add up"
+
+    def handle(self, *args, **options):
+        snapshots, mismatched = take_snapshots()
+        self.stdout.write(f"{snapshots} customer balances snapshotted")
+
+        #a balance moved without a ledger entry
+        drifted = balance_mismatches()
+        if mismatched or drifted:
+            raise CommandError(
+                f"Ledger does not add up for customers {sorted(mismatched)}, "
+                f"balance differs from the ledger for customers {drifted}"
+            )
+        self.stdout.write(self.style.SUCCESS("Customer ledger checked"))
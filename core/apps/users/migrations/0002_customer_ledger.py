@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_ledgers(apps, schema_editor):
+    """Start the ledger of every customer with a balance from that balance"""
+    Customer = apps.get_model('users', 'Customer')
+    CustomerLedgerEntry = apps.get_model('users', 'CustomerLedgerEntry')
+    CustomerLedgerEntry.objects.bulk_create([
+        CustomerLedgerEntry(customer_id=customer_id, entry_type='Opening', amount=balance, balance_after=balance)
+        for customer_id, balance in Customer.objects.exclude(outstanding_balance=0).values_list('id', 'outstanding_balance')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='users.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'last_entry_id'], name='users_snapshot_customer_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('Opening', 'Opening balance'), ('Sale', 'Sale on credit'), ('Payment', 'Payment'), ('Deposit', 'Deposit'), ('Refund', 'Refund to account'), ('Adjustment', 'Adjustment')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(blank=True, max_length=50)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='users.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'id'], name='users_ledger_customer_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_customer_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerledgerentry',
+            index=models.Index(fields=['created_by', 'created_at'], name='users_ledger_user_date_idx'),
+        ),
+    ]
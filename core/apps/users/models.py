@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from core.apps.common.models import (
@@ -17,6 +18,9 @@ class User(SoftDeleteModelMixin, TimeStampModelMixin, AuditModelMixin, AbstractU
 
     objects = UserManager()
 
+    #credentials stay out of the change history, logins are not changes
+    audit_exclude = AuditModelMixin.audit_exclude + ('password', 'last_login')
+
     class Meta:
         db_table = "auth_user"
 
@@ -45,3 +49,82 @@ class CustomerDeposit(models.Model):
     
     def __str__(self):
         return f"Deposit of {self.amount} by {self.customer.name}"
+
+
+class CustomerLedgerQuerySet(models.QuerySet):
+    """Ledger entries are never changed or removed, a correction is a new entry"""
+
+    def update(self, **kwargs):
+        raise TypeError("Customer ledger entries are append-only")
+
+    def delete(self):
+        raise TypeError("Customer ledger entries are append-only")
+
+
+class CustomerLedgerEntry(models.Model):
+    """
+    One movement of a customer's outstanding balance, positive when the
+    customer owes more. Written only through core.apps.users.ledger, which
+    moves Customer.outstanding_balance in the same transaction.
+    """
+    class EntryTypeChoices(models.TextChoices):
+        OPENING = 'Opening', 'Opening balance'
+        SALE = 'Sale', 'Sale on credit'
+        PAYMENT = 'Payment', 'Payment'
+        DEPOSIT = 'Deposit', 'Deposit'
+        REFUND = 'Refund', 'Refund to account'
+        ADJUSTMENT = 'Adjustment', 'Adjustment'
+
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=10, choices=EntryTypeChoices.choices)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    #outstanding balance right after this entry, read back from the increment
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2)
+    #"Sale-12", "Deposit-3": plain text, archiving sales must not touch the ledger
+    reference = models.CharField(max_length=50, blank=True)
+    notes = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CustomerLedgerQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            #statement pages and the latest balance of a customer
+            models.Index(fields=['customer', 'id'], name='users_ledger_customer_idx'),
+            #deposits and payments a cashier took during a shift
+            models.Index(fields=['created_by', 'created_at'], name='users_ledger_user_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Customer ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Customer ledger entries are append-only")
+
+    def __str__(self):
+        return f"{self.entry_type} of {self.amount} for customer #{self.customer_id}"
+
+
+class CustomerBalanceSnapshot(models.Model):
+    """
+    Balance of a customer as of ledger entry last_entry_id, written by
+    `manage.py snapshot_ledger` after checking it against the entries
+    since the previous snapshot.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='balance_snapshots')
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    last_entry_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'last_entry_id'], name='users_snapshot_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Balance of customer #{self.customer_id} at entry #{self.last_entry_id}"
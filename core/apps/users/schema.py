@@ -0,0 +1,7 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+#imported by core.apps.common.schema.load_schema_extensions when a schema is generated
+class CachedJWTScheme(SimpleJWTScheme):
+    """Expose CachedJWTAuthentication as the regular jwtAuth scheme in the schema"""
+    target_class = 'core.apps.users.authentication.CachedJWTAuthentication'
@@ -1,6 +1,8 @@
 from django.db import transaction
 from rest_framework import serializers
-from core.apps.users.models import User, Customer, CustomerDeposit
+from core.apps.common.serializers import DateRangeQuerySerializer, ValuesSerializer, decimal_to_string, datetime_to_string
+from core.apps.users.ledger import post_entry
+from core.apps.users.models import User, Customer, CustomerDeposit, CustomerLedgerEntry
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -45,6 +47,43 @@ class CustomerSerializer(serializers.ModelSerializer):
             'outstanding_balance'
         ]
         read_only_fields = ['loyalty_points']
+    
+    def create(self, validated_data):
+        #a new customer may bring a balance, recorded as the first ledger entry
+        opening_balance = validated_data.pop('outstanding_balance', 0)
+        with transaction.atomic():
+            customer = super().create(validated_data)
+            if opening_balance:
+                entry = post_entry(customer.id, CustomerLedgerEntry.EntryTypeChoices.OPENING, opening_balance)
+                customer.outstanding_balance = entry.balance_after
+        return customer
+    
+    def update(self, instance, validated_data):
+        balance = validated_data.pop('outstanding_balance', instance.outstanding_balance)
+        if balance != instance.outstanding_balance:
+            raise serializers.ValidationError(
+                {'outstanding_balance': "The balance changes through sales, returns, payments and deposits only."}
+            )
+        #only the edited fields are written, the balance and the points move through
+        #relative updates that a full save of an earlier loaded instance would undo
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+class CustomerValuesSerializer(ValuesSerializer):
+    """Values based equivalent of CustomerSerializer for the read endpoints"""
+    model = Customer
+    fields = (
+        ('id', 'id', None),
+        ('name', 'name', None),
+        ('phone', 'phone', None),
+        ('email', 'email', None),
+        ('address', 'address', None),
+        ('loyalty_points', 'loyalty_points', None),
+        ('outstanding_balance', 'outstanding_balance', decimal_to_string),
+    )
 
 
 class CustomerDepositSerializer(serializers.ModelSerializer):
@@ -54,4 +93,32 @@ class CustomerDepositSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'customer', 'customer_name', 'amount', 'deposit_date', 'notes'
         ]
-        read_only_fields = ['deposit_date']
\ No newline at end of file
+        read_only_fields = ['deposit_date']
+
+
+class HistoryQuerySerializer(DateRangeQuerySerializer):
+    summary = serializers.BooleanField(
+        required=False, default=False, help_text="Return only the totals of the history instead of its pages."
+    )
+
+
+class CustomerLedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerLedgerEntry
+        fields = ['id', 'entry_type', 'amount', 'balance_after', 'reference', 'notes', 'created_by', 'created_at']
+        read_only_fields = fields
+
+
+class CustomerLedgerEntryValuesSerializer(ValuesSerializer):
+    """Values based equivalent of CustomerLedgerEntrySerializer for account statements"""
+    model = CustomerLedgerEntry
+    fields = (
+        ('id', 'id', None),
+        ('entry_type', 'entry_type', None),
+        ('amount', 'amount', decimal_to_string),
+        ('balance_after', 'balance_after', decimal_to_string),
+        ('reference', 'reference', None),
+        ('notes', 'notes', None),
+        ('created_by', 'created_by_id', None),
+        ('created_at', 'created_at', datetime_to_string),
+    )
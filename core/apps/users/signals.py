@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.apps.users.authentication import invalidate_user
+from core.apps.users.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the auth cache entry on save, soft delete, restore and hard delete"""
+    invalidate_user(instance.pk)
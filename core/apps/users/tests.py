@@ -1,3 +1,456 @@
-from django.test import TestCase
+import io
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.test import AsyncClient, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.apps.billing.archive import archive_chunk
+from core.apps.billing.models import SalesTransaction, ProductReturn, ArchivedSalesTransaction
+from core.apps.billing.serializers import SalesTransactionSerializer
+from core.apps.common.cache import _version_key
+from core.apps.common.serializers import datetime_to_string
+from core.apps.common.testing import (
+    QueryCountTestCase, ValuesParityTestCase, make_customer, make_products, make_sale
+)
+from core.apps.users.authentication import user_cache
+from core.apps.users.ledger import balance_mismatches, post_entry, take_snapshots
+from core.apps.users.models import User, Customer, CustomerDeposit, CustomerLedgerEntry
+from core.apps.users.serializers import CustomerSerializer
+
+
+_usernames = count()
+
+
+class UserQueryCountTests(QueryCountTestCase):
+    def make_users(self, scale):
+        return [
+            User.objects.create_user(f"user{next(_usernames)}", "user@example.com", "password")
+            for _ in range(scale)
+        ]
+
+    def test_list(self):
+        self.assertConstantQueries(self.make_users, lambda _: self.client.get('/users/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: self.make_users(1)[0],
+            lambda user: self.client.get(f'/users/{user.id}/'),
+        )
+
+    def test_self_detail(self):
+        self.assertConstantQueries(lambda scale: None, lambda _: self.client.get('/users/self/'))
+
+
+class AuthUserCacheTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        user_cache.clear()
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/users/self/')
+        return response, [query for query in queries.captured_queries if '"users_user"."password"' in query['sql']]
+
+    def test_cached_user_needs_no_query(self):
+        self.assertEqual(self.user_queries()[0].status_code, 200)
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_queryset_soft_delete_rejects_cached_user(self):
+        self.user_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).delete()
+        self.assertEqual(self.user_queries()[0].status_code, 401)
+
+    def test_change_made_by_another_worker_rejects_cached_user(self):
+        self.user_queries()
+        #another worker deactivated the user: the row and the shared version moved, this process' entry did not
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        caches['responses'].incr(_version_key(User))
+        self.assertEqual(self.user_queries()[0].status_code, 401)
+
+    async def test_async_views_read_the_version_off_the_event_loop(self):
+        loop_thread = threading.current_thread()
+        threads = []
+        get = LocMemCache.get
+
+        def recording_get(cache, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return get(cache, *args, **kwargs)
+
+        with mock.patch.object(LocMemCache, 'get', recording_get):
+            response = await AsyncClient().get(
+                '/async/customers/lookup/', {'q': '0555'},
+                headers={'authorization': f'Bearer {AccessToken.for_user(self.user)}'},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+
+class CustomerQueryCountTests(QueryCountTestCase):
+    def make_history(self, scale):
+        customer = make_customer()
+        for _ in range(scale):
+            make_sale(customer)
+        return customer
+
+    def test_list(self):
+        self.assertConstantQueries(
+            lambda scale: [make_customer() for _ in range(scale)],
+            lambda _: self.client.get('/customers/'),
+        )
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: make_customer(),
+            lambda customer: self.client.get(f'/customers/{customer.id}/'),
+        )
+
+    def test_purchase_history(self):
+        self.assertConstantQueries(
+            self.make_history,
+            lambda customer: self.client.get(f'/customers/{customer.id}/purchase_history/'),
+        )
+
+    def test_return_history(self):
+        self.assertConstantQueries(
+            self.make_history,
+            lambda customer: self.client.get(f'/customers/{customer.id}/return_history/'),
+        )
+
+    def test_balance_summary(self):
+        self.assertConstantQueries(
+            self.make_history,
+            lambda customer: self.client.get(f'/customers/{customer.id}/balance_summary/'),
+        )
+
+    def test_pay_credit(self):
+        self.assertConstantQueries(
+            lambda scale: make_customer(outstanding_balance=Decimal('100.00')),
+            lambda customer: self.client.post(
+                f'/customers/{customer.id}/pay_credit/', {'payment_amount': 40}, format='json'
+            ),
+        )
+
+
+    def test_purchase_history_summary(self):
+        self.assertConstantQueries(
+            self.make_history,
+            lambda customer: self.client.get(f'/customers/{customer.id}/purchase_history/?summary=true'),
+        )
+
+
+class CustomerHistoryTests(ValuesParityTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = make_customer()
+        self.sales = [make_sale(self.customer) for _ in range(5)]
+        make_sale(make_customer())
+
+    def pages(self, path):
+        pages = []
+        while path:
+            data = self.client.get(path).json()
+            pages.append([row['id'] for row in data['results']])
+            path = data['next']
+        return pages
+
+    def test_purchase_history_pages_newest_first(self):
+        pages = self.pages(f'/customers/{self.customer.id}/purchase_history/?page_size=2')
+        ids = [sale.id for sale in reversed(self.sales)]
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+
+    def test_purchase_history_matches_serializer(self):
+        data = self.client.get(f'/customers/{self.customer.id}/purchase_history/').json()
+        expected = SalesTransactionSerializer(
+            SalesTransaction.objects.filter(customer=self.customer).order_by('-id'), many=True
+        ).data
+        self.assertEqual(data['results'], json.loads(JSONRenderer().render(expected)))
+
+    def test_return_history_pages(self):
+        returns = list(ProductReturn.objects.filter(transaction__customer=self.customer).order_by('-id'))
+        pages = self.pages(f'/customers/{self.customer.id}/return_history/?page_size=3')
+        self.assertEqual(pages, [[r.id for r in returns[:3]], [r.id for r in returns[3:]]])
+
+    def test_date_filters(self):
+        long_ago = timezone.now() - timedelta(days=400)
+        SalesTransaction.objects.filter(id__in=[sale.id for sale in self.sales[:2]]).update(transaction_date=long_ago)
+        path = f'/customers/{self.customer.id}/purchase_history/'
+
+        recent = self.client.get(f'{path}?date_from={timezone.localdate() - timedelta(days=1)}').json()
+        self.assertEqual(len(recent['results']), 3)
+        old = self.client.get(f'{path}?date_to={timezone.localdate(long_ago)}').json()
+        self.assertEqual(len(old['results']), 2)
+        self.assertEqual(self.client.get(f'{path}?date_from=yesterday').status_code, 400)
+
+    def test_summary(self):
+        SalesTransaction.objects.filter(customer=self.customer).update(total_amount=Decimal('12.50'))
+        ProductReturn.objects.update(refund_amount=Decimal('10.00'))
+        last = SalesTransaction.objects.get(id=self.sales[-1].id)
+
+        data = self.client.get(f'/customers/{self.customer.id}/purchase_history/?summary=true').json()
+        self.assertEqual(data, {
+            'total_spent': '62.50', 'visits': 5, 'last_visit': datetime_to_string(last.transaction_date),
+        })
+        data = self.client.get(f'/customers/{self.customer.id}/return_history/?summary=true').json()
+        self.assertEqual((data['total_refunded'], data['returns']), ('50.00', 5))
+
+        empty = self.client.get(f'/customers/{make_customer().id}/purchase_history/?summary=true').json()
+        self.assertEqual(empty, {'total_spent': '0.00', 'visits': 0, 'last_visit': None})
+
+
+    def test_history_includes_archived_sales(self):
+        SalesTransaction.objects.filter(customer=self.customer).update(total_amount=Decimal('12.50'))
+        ProductReturn.objects.update(refund_amount=Decimal('10.00'))
+        paths = [
+            f'/customers/{self.customer.id}/{history}/{query}'
+            for history in ('purchase_history', 'return_history') for query in ('?page_size=2', '?summary=true')
+        ]
+        before = [self.client.get(path).json() for path in paths]
+        before_pages = self.pages(paths[0])
+
+        #the customer's two oldest sales, so the second page spans live and archived rows
+        archive_chunk(timezone.now() + timedelta(days=1), 2)
+        self.assertEqual(ArchivedSalesTransaction.objects.filter(customer=self.customer).count(), 2)
+        caches['responses'].clear()
+        self.assertEqual(self.pages(paths[0]), before_pages)
+        for path, expected in zip(paths, before):
+            data = self.client.get(path).json()
+            if 'results' in data:
+                data, expected = data['results'], expected['results']
+            self.assertEqual(data, expected, path)
+
+
+class CustomerValuesParityTests(ValuesParityTestCase):
+    def setUp(self):
+        super().setUp()
+        make_customer()
+        make_customer(
+            name="Zoë \"Q\" Müller", phone="+90 555 000", email="zoe@example.com",
+            address="Street 1\nCity", loyalty_points=120, outstanding_balance=Decimal('-15.5'),
+        )
+
+    def test_list(self):
+        self.assertMatchesSerializer('/customers/', CustomerSerializer, Customer.objects.all(), many=True)
+
+    def test_retrieve(self):
+        customer = Customer.objects.last()
+        self.assertMatchesSerializer(f'/customers/{customer.id}/', CustomerSerializer, customer)
+
+
+
+class AsyncCustomerEndpointTests(ValuesParityTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = make_customer(phone="0555123", outstanding_balance=Decimal('-15.5'))
+        make_customer(phone="0666123")
+        self.async_client = AsyncClient()
+        self.auth = {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_lookup(self):
+        response = await self.async_client.get('/async/customers/lookup/', {'q': '0555'}, headers=self.auth)
+        self.assertEqual([row['id'] for row in response.json()], [self.customer.id])
+
+    async def test_balance_summary_matches_sync(self):
+        for pk in (self.customer.id, 0):
+            expected = await self.async_client.get(f'/customers/{pk}/balance_summary/', headers=self.auth)
+            response = await self.async_client.get(f'/async/customers/{pk}/balance_summary/', headers=self.auth)
+            self.assertNotEqual(response.status_code, 401)
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.content, expected.content)
+
+
+class CustomerDepositQueryCountTests(QueryCountTestCase):
+    def make_deposits(self, scale):
+        return CustomerDeposit.objects.bulk_create([
+            CustomerDeposit(customer=make_customer(), amount=Decimal('10.00')) for _ in range(scale)
+        ])
+
+    def test_list(self):
+        self.assertConstantQueries(self.make_deposits, lambda _: self.client.get('/customers_deposit/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda scale: self.make_deposits(1)[0],
+            lambda deposit: self.client.get(f'/customers_deposit/{deposit.id}/'),
+        )
+
+    def test_create(self):
+        self.assertConstantQueries(
+            lambda scale: make_customer(),
+            lambda customer: self.client.post(
+                '/customers_deposit/', {'customer': customer.id, 'amount': '25.00'}, format='json'
+            ),
+        )
+
+
+class CustomerLedgerTests(QueryCountTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.client.post(
+            '/customers/', {'name': "Ledger", 'outstanding_balance': '30.00'}, format='json'
+        ).json()
+        self.product = make_products(1)[0]
+
+    def entries(self):
+        return list(
+            CustomerLedgerEntry.objects.filter(customer_id=self.customer['id']).order_by('id')
+            .values_list('entry_type', 'amount', 'balance_after')
+        )
+
+    def test_every_balance_change_is_an_entry(self):
+        customer_id = self.customer['id']
+        #credit sale of 100 with 40 paid
+        self.client.post('/sales/', {
+            'customer': customer_id, 'payment_method': 'Credit', 'amount_paid': '40.00',
+            'items': [{'product': self.product.id, 'quantity': '10', 'unit_price': '10.00'}],
+        }, format='json')
+        sale = SalesTransaction.objects.get()
+        self.client.post('/returns/', {
+            'transaction': sale.id, 'reason': 'Broken', 'refund_method': 'Credit',
+            'items': [{'product': self.product.id, 'quantity': '1', 'unit_price': '10.00'}],
+        }, format='json')
+        self.client.post(f'/customers/{customer_id}/pay_credit/', {'payment_amount': 50}, format='json')
+        self.client.post('/customers_deposit/', {'customer': customer_id, 'amount': '100.00'}, format='json')
+
+        types = CustomerLedgerEntry.EntryTypeChoices
+        self.assertEqual(self.entries(), [
+            (types.OPENING, Decimal('30.00'), Decimal('30.00')),
+            (types.SALE, Decimal('60.00'), Decimal('90.00')),
+            (types.REFUND, Decimal('-10.00'), Decimal('80.00')),
+            (types.PAYMENT, Decimal('-50.00'), Decimal('30.00')),
+            (types.DEPOSIT, Decimal('-100.00'), Decimal('-70.00')),
+        ])
+        self.assertEqual(Customer.objects.get(id=customer_id).outstanding_balance, Decimal('-70.00'))
+
+        #the credit is spent by the next sale
+        self.client.post('/sales/', {
+            'customer': customer_id, 'payment_method': 'Credit', 'amount_paid': '0.00',
+            'items': [{'product': self.product.id, 'quantity': '5', 'unit_price': '10.00'}],
+        }, format='json')
+        self.assertEqual(self.entries()[-1], (types.SALE, Decimal('50.00'), Decimal('-20.00')))
+        self.assertEqual(SalesTransaction.objects.latest('id').amount_paid, Decimal('50.00'))
+
+    def test_entries_are_append_only(self):
+        entry = CustomerLedgerEntry.objects.get()
+        with self.assertRaises(TypeError):
+            entry.save()
+        with self.assertRaises(TypeError):
+            CustomerLedgerEntry.objects.all().delete()
+        with self.assertRaises(TypeError):
+            CustomerLedgerEntry.objects.update(amount=0)
+
+    def test_balance_not_editable(self):
+        path = f"/customers/{self.customer['id']}/"
+        response = self.client.patch(path, {'outstanding_balance': '0.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.patch(path, {'phone': '0555'}, format='json').status_code, 200)
+
+    def test_statement_pages(self):
+        for amount in range(1, 6):
+            post_entry(self.customer['id'], CustomerLedgerEntry.EntryTypeChoices.ADJUSTMENT, Decimal(amount))
+        data = self.client.get(f"/customers/{self.customer['id']}/statement/?page_size=4").json()
+        self.assertEqual([row['balance_after'] for row in data['results']], ['45.00', '40.00', '36.00', '33.00'])
+        rest = self.client.get(data['next']).json()
+        self.assertEqual([(row['entry_type'], row['balance_after']) for row in rest['results']], [('Adjustment', '31.00'), ('Opening', '30.00')])
+        self.assertIsNone(rest['next'])
+
+    def test_statement_queries(self):
+        def setup(scale):
+            for _ in range(scale):
+                post_entry(self.customer['id'], CustomerLedgerEntry.EntryTypeChoices.ADJUSTMENT, Decimal(1))
+            return self.customer['id']
+
+        self.assertConstantQueries(setup, lambda customer_id: self.client.get(f'/customers/{customer_id}/statement/'))
+
+    def test_snapshots_check_the_ledger(self):
+        call_command('snapshot_ledger', stdout=io.StringIO())
+        post_entry(self.customer['id'], CustomerLedgerEntry.EntryTypeChoices.ADJUSTMENT, Decimal('5.00'))
+        self.assertEqual(take_snapshots(), (1, []))
+        self.assertEqual(take_snapshots(), (0, []))
+
+        #a balance moved behind the ledger's back
+        Customer.objects.filter(id=self.customer['id']).update(outstanding_balance=Decimal('1.00'))
+        self.assertEqual(balance_mismatches(), [self.customer['id']])
+        with self.assertRaises(CommandError):
+            call_command('snapshot_ledger', stdout=io.StringIO())
+
+    def test_edit_keeps_a_balance_moved_meanwhile(self):
+        customer = Customer.objects.get(id=self.customer['id'])
+        post_entry(customer.id, CustomerLedgerEntry.EntryTypeChoices.SALE, Decimal('50.00'))
+        Customer.objects.filter(id=customer.id).update(loyalty_points=40)
+
+        serializer = CustomerSerializer(customer, data={'name': "Renamed"}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        customer.refresh_from_db()
+        self.assertEqual(
+            (customer.name, customer.outstanding_balance, customer.loyalty_points), ("Renamed", Decimal('80.00'), 40)
+        )
+        self.assertEqual(balance_mismatches(), [])
+
+
+class CustomerLedgerConcurrencyTests(TransactionTestCase):
+    """Writers on separate connections, each moving the same balance"""
+    workers = 8
+    operations = 25
+
+    def run_worker(self, customer_id, seed, amounts):
+        rng = random.Random(seed)
+        try:
+            for _ in range(self.operations):
+                amount = Decimal(rng.randint(-5000, 5000)) / 100
+                while True:
+                    try:
+                        with transaction.atomic():
+                            post_entry(customer_id, CustomerLedgerEntry.EntryTypeChoices.ADJUSTMENT, amount)
+                        break
+                    except OperationalError:
+                        #the test database is locked by another writer, try the whole entry again
+                        time.sleep(rng.random() / 100)
+                amounts.append(amount)
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        customer = Customer.objects.create(name="Busy")
+        amounts = []
+        threads = [
+            threading.Thread(target=self.run_worker, args=(customer.id, seed, amounts)) for seed in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(amounts), self.workers * self.operations)
+        customer.refresh_from_db()
+        self.assertEqual(customer.outstanding_balance, sum(amounts))
+
+        #every running balance follows from the one before it
+        balance = Decimal(0)
+        for amount, balance_after in CustomerLedgerEntry.objects.order_by('id').values_list('amount', 'balance_after'):
+            balance += amount
+            self.assertEqual(balance_after, balance)
+        self.assertEqual(take_snapshots()[1], [])
+        self.assertEqual(balance_mismatches(), [])
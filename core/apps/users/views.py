@@ -1,4 +1,7 @@
+from decimal import Decimal, InvalidOperation
+
 from django.db import transaction
+from django.db.models import Count, Max, Sum
 from django.http import Http404
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
@@ -7,13 +10,39 @@ from rest_framework.decorators import action
 from drf_spectacular.utils import extend_schema, OpenApiExample
 from core.apps.users.utils import customer_purchase_history_response_example
 
-from core.apps.users.models import User, Customer, CustomerDeposit
-from core.apps.users.serializers import UserSerializer, CustomerSerializer, CustomerDepositSerializer
-from core.apps.billing.models import SalesTransaction, ProductReturn
-from core.apps.billing.serializers import SalesTransactionSerializer, ProductReturnSerializer
+from core.apps.users.ledger import locked_balance, post_entry
+from core.apps.users.models import User, Customer, CustomerDeposit, CustomerLedgerEntry
+from core.apps.users.serializers import (
+    UserSerializer, CustomerSerializer, CustomerDepositSerializer, CustomerValuesSerializer, HistoryQuerySerializer,
+    CustomerLedgerEntrySerializer, CustomerLedgerEntryValuesSerializer,
+)
+from core.apps.billing.models import SalesTransaction, ProductReturn, ArchivedSalesTransaction, ArchivedProductReturn
+from core.apps.billing.serializers import (
+    SalesTransactionSerializer, ProductReturnSerializer, SalesTransactionValuesSerializer, ProductReturnValuesSerializer,
+    ArchivedSalesTransactionValuesSerializer, ArchivedProductReturnValuesSerializer,
+)
+from core.apps.common.pagination import KeysetPagination
+from core.apps.common.serializers import DateRangeQuerySerializer, decimal_to_string, datetime_to_string
 from core.apps.users.permissions import CustomUserPermission
+from core.apps.common.views import ReadReplicaMixin, CachedResponseMixin, ValuesReadMixin, cache_response
+
+def history_summary(querysets, **aggregates):
+    """Run aggregates (Sum, Count or Max) over the live and the archived queryset of a history and combine them"""
+    summary = dict.fromkeys(aggregates)
+    for queryset in querysets:
+        for name, value in queryset.aggregate(**aggregates).items():
+            if value is None:
+                continue
+            if summary[name] is None:
+                summary[name] = value
+            elif isinstance(aggregates[name], Max):
+                summary[name] = max(summary[name], value)
+            else:
+                summary[name] += value
+    return summary
+
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [CustomUserPermission]
@@ -27,12 +56,19 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(CachedResponseMixin, ValuesReadMixin, ReadReplicaMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
+    values_serializer_class = CustomerValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     @extend_schema(
+        parameters=[HistoryQuerySerializer],
+        responses=SalesTransactionSerializer(many=True),
+        description=(
+            "Purchases of the customer, archived ones included, newest first, one page per cursor. "
+            "With ?summary=true: total_spent, visits and last_visit instead."
+        ),
         examples=[
             OpenApiExample(
                 "Example response",
@@ -42,7 +78,7 @@ class CustomerViewSet(viewsets.ModelViewSet):
             )
         ]
     )
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def purchase_history(self, request, pk=None):
         """Get customer purchase history"""
         try:
@@ -52,56 +88,67 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 {"error": "Customer not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
-            
-        transactions = SalesTransaction.objects.filter(customer=customer)
-        # if not transactions.exists():
-        #     return Response(
-        #         {"message": "No purchase history found for this customer."},
-        #         status=status.HTTP_200_OK
-        #     )
         
-        serializer = SalesTransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        date_filter = query.date_filter('transaction_date')
+        transactions = SalesTransaction.objects.filter(customer=customer, **date_filter)
+        archived = ArchivedSalesTransaction.objects.filter(customer=customer, **date_filter)
+        
+        if query.validated_data['summary']:
+            summary = history_summary(
+                [transactions, archived],
+                total_spent=Sum('total_amount'), visits=Count('id'), last_visit=Max('transaction_date')
+            )
+            return Response({
+                'total_spent': decimal_to_string(summary['total_spent'] or 0),
+                'visits': summary['visits'],
+                'last_visit': datetime_to_string(summary['last_visit']),
+            })
+        
+        return self.paginator.paginate_merged_values([
+            (transactions, SalesTransactionValuesSerializer), (archived, ArchivedSalesTransactionValuesSerializer),
+        ], request, self)
     
     @action(detail=True, methods=['post'])
     def pay_credit(self, request, pk=None):
         """Allow customer to pay off their outstanding balance"""
         customer = self.get_object()
-        payment_amount = request.data.get('payment_amount', 0)
+        try:
+            payment_amount = Decimal(str(request.data.get('payment_amount', 0)))
+        except InvalidOperation:
+            payment_amount = Decimal(0)
         
-        if payment_amount <= 0:
+        if not payment_amount > 0:
             return Response(
                 {'error': 'Payment amount must be greater than 0'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        #customer owes money (positive oustanding balance ) or has credit (negative outstanding balance)
-        #we only allow paying off debt, not adding to credit
-        if customer.outstanding_balance <= 0:
-            return Response(
-                {'error':'Customer has no outstanding balance to pay'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        try:
-            amount_to_pay = min(payment_amount, customer.outstanding_balance)
+        with transaction.atomic():
+            #locked, so a concurrent payment cannot take the balance below zero
+            outstanding_balance = locked_balance(customer.id)
             
-            customer.outstanding_balance -= amount_to_pay
-            customer.save(update_fields=['outstanding_balance'])
+            #customer owes money (positive oustanding balance ) or has credit (negative outstanding balance)
+            #we only allow paying off debt, not adding to credit
+            if outstanding_balance <= 0:
+                return Response(
+                    {'error':'Customer has no outstanding balance to pay'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            amount_to_pay = min(payment_amount, outstanding_balance)
+            entry = post_entry(customer.id, CustomerLedgerEntry.EntryTypeChoices.PAYMENT, -amount_to_pay)
             
-            return Response({
-                'message': f'Successfully paid ${amount_to_pay}',
-                'remaining_balance': customer.outstanding_balance,
-                'payment_amount': amount_to_pay},
-                status=status.HTTP_200_OK
-            )
-        except Exception as e:
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response({
+            'message': f'Successfully paid ${amount_to_pay}',
+            'remaining_balance': entry.balance_after,
+            'payment_amount': amount_to_pay},
+            status=status.HTTP_200_OK
+        )
     
     @action(detail=True, methods=['get'])
+    @cache_response
     def balance_summary(self, request, pk=None):
         # i dont know if this api is needed to be called because
         # on the customer table we can see due amount directly
@@ -123,7 +170,15 @@ class CustomerViewSet(viewsets.ModelViewSet):
         
         return Response(balance_info)
     
-    @action(detail=True, methods=['get'])
+    @extend_schema(
+        parameters=[HistoryQuerySerializer],
+        responses=ProductReturnSerializer(many=True),
+        description=(
+            "Returns of the customer, archived ones included, newest first, one page per cursor. "
+            "With ?summary=true: total_refunded, returns and last_return instead."
+        ),
+    )
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def return_history(self, request, pk=None):
         # i dont know if this api is needed to be called because
         # from the purchase history we can see the return for that purchase as well
@@ -135,22 +190,55 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 {"error": "Customer not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
-            
-        returns = ProductReturn.objects.select_related('transaction__customer').filter(transaction__customer=customer)
-        if not returns.exists():
+        
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        date_filter = query.date_filter('return_date')
+        returns = ProductReturn.objects.filter(transaction__customer=customer, **date_filter)
+        archived = ArchivedProductReturn.objects.filter(transaction__customer=customer, **date_filter)
+        
+        if query.validated_data['summary']:
+            summary = history_summary(
+                [returns, archived],
+                total_refunded=Sum('refund_amount'), returns=Count('id'), last_return=Max('return_date')
+            )
+            return Response({
+                'total_refunded': decimal_to_string(summary['total_refunded'] or 0),
+                'returns': summary['returns'],
+                'last_return': datetime_to_string(summary['last_return']),
+            })
+        
+        return self.paginator.paginate_merged_values([
+            (returns, ProductReturnValuesSerializer), (archived, ArchivedProductReturnValuesSerializer),
+        ], request, self)
+    
+    @extend_schema(
+        parameters=[DateRangeQuerySerializer],
+        responses=CustomerLedgerEntrySerializer(many=True),
+        description="Account statement: the customer's ledger entries with running balances, newest first.",
+    )
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
+    def statement(self, request, pk=None):
+        """Get customer account statement"""
+        try:
+            customer = self.get_object()
+        except Http404:
             return Response(
-                {"message": "No return history found for this customer."},
-                status=status.HTTP_200_OK
+                {"error": "Customer not found."},
+                status=status.HTTP_404_NOT_FOUND
             )
         
-        serializer = ProductReturnSerializer(returns, many=True)
-        return Response(serializer.data)
+        query = DateRangeQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        entries = CustomerLedgerEntry.objects.filter(customer=customer, **query.date_filter('created_at'))
+        return self.paginator.paginate_values(entries, request, self, CustomerLedgerEntryValuesSerializer)
                 
                 
-class CustomerDepositViewSet(viewsets.ModelViewSet):
+class CustomerDepositViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = CustomerDeposit.objects.select_related('customer')
     serializer_class = CustomerDepositSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_models = (CustomerDeposit, Customer)
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -161,9 +249,10 @@ class CustomerDepositViewSet(viewsets.ModelViewSet):
             deposit = CustomerDeposit.objects.create(**serializer.validated_data)
             
             #update customer balance
-            customer = deposit.customer
-            customer.outstanding_balance -= deposit.amount
-            customer.save(update_fields=['outstanding_balance'])
+            post_entry(
+                deposit.customer_id, CustomerLedgerEntry.EntryTypeChoices.DEPOSIT, -deposit.amount,
+                reference=f"Deposit-{deposit.id}", notes=deposit.notes,
+            )
         
         return Response(
             self.get_serializer(deposit).data,
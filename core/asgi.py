@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+#optional cache warm-up before the worker accepts traffic, see STARTUP in settings
+from core.apps.common.warmup import warm_up_if_enabled  # noqa: E402
+warm_up_if_enabled()
@@ -55,7 +55,7 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.apps.users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -63,12 +63,16 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'core.apps.common.middleware.RequestMetricsMiddleware',
+    'core.apps.common.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.apps.common.middleware.AuditContextMiddleware',
+    'core.apps.common.middleware.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,6 +91,17 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
 
+# Cache of resolved token users used by CachedJWTAuthentication.
+# Entries are tagged with the User model version kept in the 'responses'
+# cache, which every user save and soft delete bumps. Workers see each
+# other's bumps only when that cache is shared (RESPONSE_CACHE_BACKEND
+# 'file'); with 'locmem' TIMEOUT bounds how long other workers may
+# serve a stale role or deleted flag, so keep it short.
+AUTH_USER_CACHE = {
+    'MAX_ENTRIES': config("AUTH_USER_CACHE_MAX_ENTRIES", cast=int, default=1024),
+    'TIMEOUT': config("AUTH_USER_CACHE_TIMEOUT", cast=int, default=60),
+}
+
 # ===============
 # Spectacular Settings
 # ===============
@@ -103,6 +118,17 @@ SPECTACULAR_SETTINGS = {
     },
     "COMPONENT_SPLIT_REQUEST": True,
     "SORT_OPERATIONS": False,
+    #keeps drf-spectacular's extension machinery out of worker startup
+    "PREPROCESSING_HOOKS": ["core.apps.common.schema.load_schema_extensions"],
+}
+
+# The schema served at /api/schema/ is prebuilt by `manage.py build_schema`
+# at deploy time. CODE_VERSION identifies the deployed code (e.g. the git
+# commit); when unset it is hashed from the project sources. The schema
+# is only regenerated when that version changes.
+SCHEMA_ARTIFACT = {
+    'PATH': config("SCHEMA_ARTIFACT_PATH", default=str(BASE_DIR / 'build' / 'openapi.json.gz')),
+    'CODE_VERSION': config("CODE_VERSION", default=""),
 }
 
 TEMPLATES = [
@@ -133,6 +159,276 @@ DATABASES = {
     }
 }
 
+# SQLite tuning used by the production profile (see production.py).
+# WAL lets readers run alongside the single writer, BEGIN IMMEDIATE takes
+# the write lock up front so concurrent checkouts queue on the busy
+# timeout instead of failing with "database is locked" on lock upgrade.
+SQLITE_PRODUCTION_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+    # seconds, passed to sqlite3 as the connection busy_timeout
+    'timeout': config("SQLITE_BUSY_TIMEOUT", cast=int, default=20),
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        f'PRAGMA mmap_size={config("SQLITE_MMAP_SIZE", cast=int, default=268435456)};'
+        # negative cache_size is in KiB
+        f'PRAGMA cache_size=-{config("SQLITE_CACHE_SIZE_KB", cast=int, default=65536)};'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+}
+
+# Optional read replica, a periodically refreshed copy of the primary
+# (see `manage.py sync_replica`). Safe-method actions of viewsets using
+# ReadReplicaMixin read from it; a client that just wrote, through any
+# endpoint, stays on the primary for STICKY_SECONDS. The pin is a cookie
+# (ReadYourWritesMiddleware) so it holds whichever worker serves the read.
+DATABASE_REPLICA_NAME = config("DATABASE_REPLICA_NAME", default="")
+if DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATABASE_REPLICA_NAME,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.apps.common.routers.ReadReplicaRouter']
+
+READ_REPLICA = {
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': config("READ_REPLICA_STICKY_SECONDS", cast=int, default=5),
+}
+
+# Cache
+# ===============
+# 'responses' holds the cached API responses of CachedResponseMixin and
+# the model versions their keys are built from. A write bumps a version
+# only in the cache it ran against, so every worker must share it: the
+# production profile defaults to the file backend, and `check --deploy`
+# warns about locmem. locmem is only right for a single worker process
+# (development, tests). Several hosts need a shared network cache.
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config("RESPONSE_CACHE_LOCATION", default="/var/tmp/pos-response-cache"),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': RESPONSE_CACHE_BACKENDS[config("RESPONSE_CACHE_BACKEND", default="locmem")],
+}
+
+RESPONSE_CACHE = {
+    'TIMEOUT': config("RESPONSE_CACHE_TIMEOUT", cast=int, default=300),
+}
+
+# Pagination
+# ===============
+# Endpoints paginated with core.apps.common.pagination.KeysetPagination
+# (customer purchase and return history) return PAGE_SIZE rows per page;
+# clients may ask for up to MAX_PAGE_SIZE with ?page_size=.
+PAGINATION = {
+    'PAGE_SIZE': config("PAGINATION_PAGE_SIZE", cast=int, default=50),
+    'MAX_PAGE_SIZE': config("PAGINATION_MAX_PAGE_SIZE", cast=int, default=500),
+}
+
+# Response compression
+# ===============
+# CompressionMiddleware encodes responses of at least MIN_SIZE bytes with
+# Brotli or gzip, whichever the client gives the higher q (Brotli on a
+# tie). Brotli needs the brotli package, installed by
+# requirements/production.txt. Small scan responses skip the overhead.
+COMPRESSION = {
+    'MIN_SIZE': config("COMPRESSION_MIN_SIZE", cast=int, default=1024),
+    'GZIP_LEVEL': config("COMPRESSION_GZIP_LEVEL", cast=int, default=6),
+    'BROTLI_QUALITY': config("COMPRESSION_BROTLI_QUALITY", cast=int, default=5),
+}
+
+# Request metrics
+# ===============
+# Per-request query/latency instrumentation (RequestMetricsMiddleware).
+# /metrics requires `Authorization: Bearer <TOKEN>` when a token is set,
+# otherwise it only answers ALLOWED_IPS.
+METRICS = {
+    'SLOW_QUERY_MS': config("SLOW_QUERY_MS", cast=int, default=100),
+    'TOKEN': config("METRICS_TOKEN", default=""),
+    'ALLOWED_IPS': ['127.0.0.1'],
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.slow_queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'core.apps.common.warmup': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'core.apps.common.taskqueue': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'core.apps.common.outbox': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Worker startup
+# ===============
+# With WARM_UP on, every worker fills the auth cache with recently active
+# users and the response cache with the best selling products before it
+# serves traffic (see core.apps.common.warmup). BUDGET_SECONDS is the
+# load time enforced by `manage.py profile_startup` and the startup test.
+STARTUP = {
+    'WARM_UP': config("WARM_UP", cast=bool, default=False),
+    'WARM_UP_USERS': config("WARM_UP_USERS", cast=int, default=200),
+    'WARM_UP_PRODUCTS': config("WARM_UP_PRODUCTS", cast=int, default=500),
+    'BUDGET_SECONDS': config("STARTUP_BUDGET_SECONDS", cast=float, default=3.0),
+}
+
+# Task queue
+# ===============
+# Side work is queued as rows of the common_task table inside the request's
+# transaction and run by `manage.py run_worker` (see core.apps.common.taskqueue).
+# A failing task is retried after BACKOFF_SECONDS, doubling per attempt up to
+# BACKOFF_MAX_SECONDS, and kept as Failed after MAX_ATTEMPTS. Tasks of a
+# worker that died are requeued once their LEASE_SECONDS run out.
+TASK_QUEUE = {
+    'BATCH_SIZE': config("TASK_QUEUE_BATCH_SIZE", cast=int, default=500),
+    'POLL_INTERVAL': config("TASK_QUEUE_POLL_INTERVAL", cast=float, default=1.0),
+    'LEASE_SECONDS': config("TASK_QUEUE_LEASE_SECONDS", cast=int, default=300),
+    'MAX_ATTEMPTS': config("TASK_QUEUE_MAX_ATTEMPTS", cast=int, default=5),
+    'BACKOFF_SECONDS': config("TASK_QUEUE_BACKOFF_SECONDS", cast=float, default=2.0),
+    'BACKOFF_MAX_SECONDS': config("TASK_QUEUE_BACKOFF_MAX_SECONDS", cast=float, default=3600.0),
+}
+
+# Outbox
+# ===============
+# Sales, returns, completed purchase orders and stock adjustments write an
+# event row in their own transaction. `manage.py dispatch_events` POSTs them
+# in id order, BATCH_SIZE per call, to every webhook with a URL, signed with
+# its SECRET (see core.apps.common.outbox). EVENTS limits a webhook to some
+# event types, empty sends all. A batch still failing after MAX_ATTEMPTS is
+# dead-lettered. Ids commit in order on SQLite, on databases with concurrent
+# writers set SETTLE_SECONDS so an event is only sent once lower ids committed.
+OUTBOX = {
+    'WEBHOOKS': {
+        'erp': {
+            'URL': config("ERP_WEBHOOK_URL", default=""),
+            'SECRET': config("ERP_WEBHOOK_SECRET", default=""),
+            'EVENTS': [],
+        },
+        'storefront': {
+            'URL': config("STOREFRONT_WEBHOOK_URL", default=""),
+            'SECRET': config("STOREFRONT_WEBHOOK_SECRET", default=""),
+            'EVENTS': ['sale.created', 'return.created', 'purchase_order.completed', 'stock.adjusted'],
+        },
+    },
+    'BATCH_SIZE': config("OUTBOX_BATCH_SIZE", cast=int, default=100),
+    'TIMEOUT': config("OUTBOX_TIMEOUT", cast=float, default=10.0),
+    'MAX_ATTEMPTS': config("OUTBOX_MAX_ATTEMPTS", cast=int, default=8),
+    'BACKOFF_SECONDS': config("OUTBOX_BACKOFF_SECONDS", cast=float, default=5.0),
+    'BACKOFF_MAX_SECONDS': config("OUTBOX_BACKOFF_MAX_SECONDS", cast=float, default=3600.0),
+    'POLL_INTERVAL': config("OUTBOX_POLL_INTERVAL", cast=float, default=1.0),
+    'SETTLE_SECONDS': config("OUTBOX_SETTLE_SECONDS", cast=float, default=0.0),
+    'RETENTION_DAYS': config("OUTBOX_RETENTION_DAYS", cast=int, default=7),
+}
+
+# Audit
+# ===============
+# Audited models (AuditModelMixin) get created_by / updated_by from the
+# request user and log their field changes to common_auditlog. Entries of
+# committed changes are buffered per process and written with one bulk
+# insert per MAX_BUFFER entries or every FLUSH_SECONDS (see
+# core.apps.common.audit). MAX_PENDING bounds what is kept while the
+# database refuses writes.
+AUDIT = {
+    'MAX_BUFFER': config("AUDIT_MAX_BUFFER", cast=int, default=500),
+    'FLUSH_SECONDS': config("AUDIT_FLUSH_SECONDS", cast=float, default=2.0),
+    'MAX_PENDING': config("AUDIT_MAX_PENDING", cast=int, default=50000),
+}
+
+# Archive
+# ===============
+# Returns are accepted for RETURN_WINDOW_DAYS after a sale. Whole months
+# before the window are closed and `manage.py archive_sales` moves their
+# sales and returns into the billing archive tables, CHUNK_SIZE sales per
+# short transaction with PAUSE_SECONDS in between (see
+# core.apps.billing.archive). Archived sales are served at /archive/sales/.
+RETURN_WINDOW_DAYS = config("RETURN_WINDOW_DAYS", cast=int, default=30)
+
+ARCHIVE = {
+    'CHUNK_SIZE': config("ARCHIVE_CHUNK_SIZE", cast=int, default=500),
+    'PAUSE_SECONDS': config("ARCHIVE_PAUSE_SECONDS", cast=float, default=0.05),
+}
+
+# Reports
+# ===============
+# The /reports/ endpoints cover the last DEFAULT_DAYS days unless asked
+# otherwise. A report is served from the response cache for CACHE_SECONDS;
+# for STALE_SECONDS after that the stale copy keeps being served while a
+# single request rebuilds it, given up after REBUILD_TIMEOUT seconds.
+REPORTS = {
+    'DEFAULT_DAYS': config("REPORTS_DEFAULT_DAYS", cast=int, default=7),
+    'TOP_PRODUCTS_LIMIT': config("REPORTS_TOP_PRODUCTS_LIMIT", cast=int, default=20),
+    'MAX_LIMIT': config("REPORTS_MAX_LIMIT", cast=int, default=100),
+    'CACHE_SECONDS': config("REPORTS_CACHE_SECONDS", cast=int, default=60),
+    'STALE_SECONDS': config("REPORTS_STALE_SECONDS", cast=int, default=300),
+    'REBUILD_TIMEOUT': config("REPORTS_REBUILD_TIMEOUT", cast=int, default=30),
+}
+
+# Sales facts
+# ===============
+# billing_salesfact holds one denormalized row per sale line for ad-hoc
+# analytics. Sales and returns queue a rebuild of their sale's facts for
+# the worker; `manage.py backfill_sales_facts` rebuilds all of them,
+# CHUNK_SIZE sales per transaction with PAUSE_SECONDS in between (see
+# core.apps.billing.facts).
+SALES_FACTS = {
+    'CHUNK_SIZE': config("SALES_FACTS_CHUNK_SIZE", cast=int, default=500),
+    'PAUSE_SECONDS': config("SALES_FACTS_PAUSE_SECONDS", cast=float, default=0.05),
+}
+
+# Columnar export
+# ===============
+# `manage.py export_columnar` appends sales lines and stock movements to
+# memory-mappable NumPy column files under PATH, CHUNK_SIZE rows at a
+# time, once they are SETTLE_SECONDS old, and rewrites the product table
+# (see core.apps.billing.columnar). Needs numpy, installed by
+# requirements/production.txt and optional elsewhere.
+COLUMNAR_EXPORT = {
+    'PATH': config("COLUMNAR_EXPORT_PATH", default=str(BASE_DIR / 'build' / 'columnar')),
+    'CHUNK_SIZE': config("COLUMNAR_EXPORT_CHUNK_SIZE", cast=int, default=50000),
+    'SETTLE_SECONDS': config("COLUMNAR_EXPORT_SETTLE_SECONDS", cast=int, default=5),
+}
+
+# Loyalty
+# ===============
+# Points are earned by the LoyaltyRule rows and credited off the checkout
+# path by `manage.py accrue_loyalty`, BATCH_SIZE sales or returns per
+# transaction, once they are SETTLE_SECONDS old (see
+# core.apps.billing.loyalty). An idle accrual job checks for new sales
+# every POLL_INTERVAL seconds. A redeemed point is worth POINT_VALUE.
+LOYALTY = {
+    'POINT_VALUE': config("LOYALTY_POINT_VALUE", default="0.01"),
+    'BATCH_SIZE': config("LOYALTY_BATCH_SIZE", cast=int, default=1000),
+    'SETTLE_SECONDS': config("LOYALTY_SETTLE_SECONDS", cast=int, default=5),
+    'POLL_INTERVAL': config("LOYALTY_POLL_INTERVAL", cast=float, default=30),
+}
+
+# Tax
+# ===============
+# Each process compiles the active TaxRule rows into a lookup (see
+# core.apps.billing.tax), rebuilt as soon as a rule change bumps its
+# response cache version and at the latest REFRESH_SECONDS after the last
+# build, so a worker that does not share that cache charges new rates
+# within that bound.
+TAX = {
+    'REFRESH_SECONDS': config("TAX_REFRESH_SECONDS", cast=float, default=60),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,6 +1,11 @@
 from .base import *
 DEBUG = False
 
+DATABASES['default']['OPTIONS'] = SQLITE_PRODUCTION_OPTIONS
+
+#workers must share the model versions or they serve each other's stale responses
+CACHES['responses'] = RESPONSE_CACHE_BACKENDS[config("RESPONSE_CACHE_BACKEND", default="file")]
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -14,23 +14,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls import path, include
+from django.urls import path
 from django.conf import settings
 from rest_framework.routers import DefaultRouter
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-    SpectacularRedocView,
-)
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
 )
 from core.apps.products.views import CategoryViewSet, SupplierViewSet, ProductViewSet, PurchaseOrderViewSet, InventoryAdjustmentViewSet
-from core.apps.billing.views import SalesTransactionViewSet, ProductReturnViewSet
+from core.apps.billing.views import (
+    SalesTransactionViewSet, ProductReturnViewSet, ArchivedSalesTransactionViewSet, ArchivedProductReturnViewSet,
+    ReportViewSet, LoyaltyRuleViewSet, TaxRuleViewSet, ShiftViewSet,
+)
 from core.apps.users.views import UserViewSet, CustomerViewSet, CustomerDepositViewSet
+from core.apps.products.async_views import product_scan, product_search
+from core.apps.users.async_views import customer_lookup, customer_balance_summary
+from core.apps.common.lazy import lazy_include, lazy_view
+from core.apps.common.views import metrics_view, schema_view
 
 router = DefaultRouter()
 router.register('users', UserViewSet, basename='users')
@@ -43,29 +44,43 @@ router.register(r'inventory_adjustment', InventoryAdjustmentViewSet, basename='i
 router.register(r'purchase_orders', PurchaseOrderViewSet, basename='purchase_orders')
 router.register('sales', SalesTransactionViewSet, basename='sales')
 router.register('returns', ProductReturnViewSet, basename='returns')
+router.register('archive/sales', ArchivedSalesTransactionViewSet, basename='archive-sales')
+router.register('archive/returns', ArchivedProductReturnViewSet, basename='archive-returns')
+router.register('reports', ReportViewSet, basename='reports')
+router.register('loyalty_rules', LoyaltyRuleViewSet, basename='loyalty_rules')
+router.register('tax_rules', TaxRuleViewSet, basename='tax_rules')
+router.register('shifts', ShiftViewSet, basename='shifts')
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
+    #admin and docs are rarely used, their modules load on first use
+    lazy_include('admin/', 'core.admin_urls', 'admin'),
+    path("api/schema/", schema_view, name="schema"),
     path(
         "api/docs/swagger/",
-        SpectacularSwaggerView.as_view(url_name="schema"),
+        lazy_view("drf_spectacular.views.SpectacularSwaggerView", url_name="schema"),
         name="swagger-ui",
     ),
     path(
-        "api/docs/redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"
+        "api/docs/redoc/", lazy_view("drf_spectacular.views.SpectacularRedocView", url_name="schema"), name="redoc"
     ),
     path("auth/token/", TokenObtainPairView.as_view(), name="token-obtain-pair"),
     path("auth/token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
     path("auth/token/verify/", TokenVerifyView.as_view(), name="token-verify"),
+    path("metrics", metrics_view, name="metrics"),
+    #async read endpoints, served without blocking a worker under ASGI
+    path("async/products/scan/", product_scan, name="async-product-scan"),
+    path("async/products/search/", product_search, name="async-product-search"),
+    path("async/customers/lookup/", customer_lookup, name="async-customer-lookup"),
+    path(
+        "async/customers/<int:pk>/balance_summary/", customer_balance_summary,
+        name="async-customer-balance-summary"
+    ),
 
 ] + router.urls
 
 
 # Only add debug toolbar in development
 if settings.DEBUG:
-    import debug_toolbar
-
     urlpatterns = [
-        path("__debug__/", include(debug_toolbar.urls)),
+        lazy_include("__debug__/", "debug_toolbar.urls", "djdt"),
     ] + urlpatterns